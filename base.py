@@ -1,7 +1,9 @@
 # adapted from https://github.com/masashi-y/depccg/blob/master/depccg/cat.py
 
-from typing import TypeVar, List, Union
+from typing import TypeVar, List, Dict, Union
 import re
+import copy
+import functools
 
 Node = TypeVar('Node')
 FALSE = TypeVar('False')
@@ -37,58 +39,177 @@ class FeatureStructure(Tag):
     pass
 
 
-cat_split = re.compile(r'([\[\]\(\)/\\])')
-punctuations = [',', '.', ';', ':', 'LRB', 'RRB', 'conj']
+# one token of a category string: a bracket, a slash or an atom with its feature
+cat_tokens = re.compile(r'\s*(?:([()<>/\\])|([^\s()<>/\\\[\]]+)(?:\[([^\s\[\]]+)\])?)')
+PARSE_CACHE_SIZE = 2 ** 16
 
 
 class Category(Tag):
+
+    # the interning table mapping printed category strings to their canonical categories,
+    # i.e. one immutable object for each distinct category
+    _interned: Dict[str, 'Category'] = dict()
+    # the global category table mapping dense integer ids to canonical categories,
+    # shared by the supertagger outputs, the rule tables and the decoders
+    _id2category: List['Category'] = list()
+
+    # attributes set only for canonical categories
+    _frozen = False
+    _str = None  # the category string computed once
+    _hash = None  # the hash value computed once
+    _equivalent = None  # the canonical category with ignorable features removed,
+                        # two canonical categories are equal iff they share this object
+    id = None  # the dense integer id in the global category table
+    key_id = None  # the id used for looking up rule tables, shared by atoms
+                   # differing only in ignorable features as Atom.__hash__ does
+    equivalent_id = None  # the id shared by all canonical categories equal to this one
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError(f'canonical category {self} is immutable')
+        super().__setattr__(name, value)
+
+    def __deepcopy__(self, memo):
+        # the deep copy of a canonical category is a mutable category
+        # whose X features are shared as in a freshly parsed one
+        if self._frozen:
+            return Category._parse(self._str)
+        copied = copy.copy(self)
+        memo[id(self)] = copied
+        for name, value in vars(self).items():
+            object.__setattr__(copied, name, copy.deepcopy(value, memo))
+        return copied
+
     @classmethod
-    def parse(cls, category_str: str) -> 'Category':
-        tokens = cat_split.sub(r' \1 ', category_str)
-        buffer = list(
-            reversed([token for token in tokens.split(' ') if token != ''])
+    def intern(cls, category: Union[str, 'Category']) -> 'Category':
+        # return the canonical category of one category or category string
+        if isinstance(category, str):
+            return Category.parse(category)
+        return cls._intern(category)
+
+    @classmethod
+    def from_id(cls, category_id: int) -> 'Category':
+        # return the canonical category of one id in the global category table
+        return cls._id2category[category_id]
+
+    @classmethod
+    def make_functor(cls, left: 'Category', slash: str, right: 'Category') -> 'Category':
+        # return the canonical functor of two categories,
+        # a new object is allocated only for a functor never seen before
+        left = cls._intern(left)
+        right = cls._intern(right)
+        category_str = (
+            (f'({left._str})' if isinstance(left, Functor) else left._str)
+            + slash
+            + (f'({right._str})' if isinstance(right, Functor) else right._str)
         )
+        interned = cls._interned.get(category_str)
+        if interned is None:
+            interned = Functor(left, slash, right)
+            interned._freeze(category_str)
+            cls._interned[category_str] = interned
+        return interned
+
+    @classmethod
+    def _intern(cls, category: 'Category') -> 'Category':
+        if category._frozen:
+            return category
+        if isinstance(category, Functor):
+            return cls.make_functor(category.left, category.slash, category.right)
+
+        category_str = str(category)
+        interned = cls._interned.get(category_str)
+        if interned is None:
+            feature = Feature(category.feature.feature[0])
+            feature.feature = tuple(feature.feature)
+            interned = Atom(category.tag, feature)
+            interned._freeze(category_str)
+            cls._interned[category_str] = interned
+        return interned
+
+    def _freeze(self, category_str: str) -> None:
+        object.__setattr__(self, '_str', category_str)
+        if isinstance(self, Atom):
+            object.__setattr__(
+                self, '_hash',
+                hash(self.tag) if self.feature.is_ignorable else hash(category_str)
+            )
+            equivalent = Category._intern(Atom(self.tag)) \
+                if self.feature.feature[0] == 'nb' else self
+        else:
+            object.__setattr__(self, '_hash', hash(category_str))
+            left = self.left._equivalent
+            right = self.right._equivalent
+            equivalent = self if left is self.left and right is self.right \
+                else Category.make_functor(left, self.slash, right)
+        object.__setattr__(self, '_equivalent', equivalent)
+        object.__setattr__(self, 'id', len(Category._id2category))
+        object.__setattr__(self, 'equivalent_id', equivalent.id)
+        object.__setattr__(
+            self, 'key_id',
+            equivalent.id if isinstance(self, Atom) and equivalent is not self else self.id
+        )
+        Category._id2category.append(self)
+        object.__setattr__(self, '_frozen', True)
+
+    @classmethod
+    @functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+    def parse(cls, category_str: str) -> 'Category':
+        # return the canonical category of one category string,
+        # repeated parses of the same string are looked up in a bounded cache
+        # (the canonical categories are immutable, so sharing them is safe)
+        interned = cls._interned.get(category_str)
+        if interned is not None:  # already in the canonical form
+            return interned
+        return cls._intern(cls._parse(category_str))
+
+    @staticmethod
+    def _parse(category_str: str) -> 'Category':
+        # parse one category string into a new mutable category
+        # with a single pass of the tokenizer
         stack = list()
 
         X_generic_feature = ['X']
-        while len(buffer):
-            item = buffer.pop()
-            if item in punctuations:
-                stack.append(Atom(item))
-            elif item in '(<':
-                stack.append(item)
-            elif item in ')>':
-                y = stack.pop()
-                assert len(stack) > 0
-                if (
-                    stack[-1] == '(' and item == ')'
-                    or stack[-1] == '<' and item == '>'
-                ):
-                    assert stack.pop() in '(<'
-                    stack.append(y)
+        end = 0
+        for token in cat_tokens.finditer(category_str):
+            if token.start() != end:
+                raise RuntimeError(f'failed to parse category: {category_str}')
+            end = token.end()
+
+            item, tag, feature_str = token.groups()
+            if tag is not None:
+                if feature_str is None:
+                    stack.append(Atom(tag))
+                elif feature_str == 'X':
+                    feature = Feature()
+                    feature.feature = X_generic_feature
+                    # to assign a shallow copy list containing 'X'
+                    # so that when one 'X' is assigned a concrete value
+                    # the other ones too
+                    stack.append(Atom(tag, feature))
                 else:
-                    slash = stack.pop()
-                    x = stack.pop()
-                    assert stack.pop() in '(<'
-                    stack.append(Functor(x, slash, y))
-            elif item in '/\\':
-                stack.append(item)
+                    stack.append(Atom(tag, Feature(feature_str)))
+            elif item in ')>':
+                try:
+                    y = stack.pop()
+                    if (
+                        stack[-1] == '(' and item == ')'
+                        or stack[-1] == '<' and item == '>'
+                    ):
+                        stack.pop()
+                        stack.append(y)
+                    else:
+                        slash = stack.pop()
+                        x = stack.pop()
+                        assert stack.pop() in ('(', '<')
+                        stack.append(Functor(x, slash, y))
+                except (IndexError, AssertionError):
+                    raise RuntimeError(f'failed to parse category: {category_str}')
             else:
-                if len(buffer) >= 3 and buffer[-1] == '[':
-                    buffer.pop()
-                    feature = Feature(feature_str=buffer.pop())
-                    assert buffer.pop() == ']'
-
-                    if repr(feature) == 'X':
-                        feature.feature = X_generic_feature
-                        # to assign a shallow copy list containing 'X'
-                        # so that when one 'X' is assigned a concrete value
-                        # the other ones too
-
-                    stack.append(Atom(item, feature))
-                else:
-                    stack.append(Atom(item))
+                stack.append(item)
 
+        if end != len(category_str.rstrip()):
+            raise RuntimeError(f'failed to parse category: {category_str}')
         if len(stack) == 1:
             return stack[0]
         try:
@@ -108,12 +229,16 @@ class Atom(Category):
         return str({'tag': self.tag, 'feature': self.feature})
 
     def __str__(self) -> str:  # to represent the atom category string itself
+        if self._str is not None:
+            return self._str
         if repr(self.feature) == '':
             return self.tag
         return f'{self.tag}[{self.feature}]'
 
     def __eq__(self, other: object) -> bool:
         if isinstance(other, Atom):
+            if self._frozen and other._frozen:
+                return self._equivalent is other._equivalent
             return (
                 self.tag == other.tag
                 and self.feature == other.feature
@@ -121,6 +246,8 @@ class Atom(Category):
         return False
 
     def __hash__(self):
+        if self._hash is not None:
+            return self._hash
         if self.feature.is_ignorable:
             return hash(str(self.tag))
         return hash(str(self))
@@ -152,6 +279,9 @@ class Functor(Category):
 
     def __str__(self) -> str:
         # to represent the functor category string itself
+        if self._str is not None:
+            return self._str
+
         def _str(cat):
             if isinstance(cat, Functor):
                 return f'({cat})'
@@ -160,6 +290,8 @@ class Functor(Category):
 
     def __eq__(self, other: object) -> bool:
         if isinstance(other, Functor):
+            if self._frozen and other._frozen:
+                return self._equivalent is other._equivalent
             return (
                 self.left == other.left
                 and self.slash == other.slash
@@ -169,6 +301,8 @@ class Functor(Category):
             return False
 
     def __hash__(self):
+        if self._hash is not None:
+            return self._hash
         return hash(str(self))
 
     def __xor__(self, other: object) -> bool:
@@ -187,6 +321,8 @@ class Functor(Category):
 
 class Token:
 
+    __slots__ = ('contents', 'lemma', 'POS', 'tag', 'start_end')
+
     def __init__(
         self,
         contents: str = None,
@@ -223,6 +359,11 @@ class Token:
 
 class ConstituentNode:
 
+    __slots__ = (
+        'tag', 'children', 'used_rule', 'head_is_left', 'start_end',
+        '_length', '_dep_length'
+    )
+
     def __init__(
         self,
         tag: Tag = None,
@@ -237,9 +378,10 @@ class ConstituentNode:
         self.start_end = None
 
         # used for calculating head-left dependency length
-        # following depccg's rule in English 
-        self._get_length()
-        self._get_dep_length()
+        # following depccg's rule in English,
+        # computed lazily once they are accessed
+        self._length = None
+        self._dep_length = None
 
     def __repr__(self) -> str:
         # to represent the constituent structure
@@ -263,31 +405,36 @@ class ConstituentNode:
             return self.tag == other.tag
         return False
 
-    def _get_length(self) -> None:
+    @property
+    def length(self) -> int:
         # get the length of the constituent
         # i.e. number of words contained in it
-        if len(self.children) == 1:
-            if isinstance(self.children[0], Token):
-                self.length = 1
-            elif isinstance(self.children[0], ConstituentNode):
-                self.length = self.children[0].length
+        if self._length is None:
+            if len(self.children) == 1:
+                if isinstance(self.children[0], Token):
+                    self._length = 1
+                elif isinstance(self.children[0], ConstituentNode):
+                    self._length = self.children[0].length
 
-        if len(self.children) == 2:
-            self.length = self.children[0].length + self.children[1].length
+            if len(self.children) == 2:
+                self._length = self.children[0].length + self.children[1].length
+        return self._length
 
-    def _get_dep_length(self) -> None:
+    @property
+    def dep_length(self) -> int:
         # get the head first dep length of one parse defined by depccg (for English)
-        if len(self.children) == 1:
-            if isinstance(self.children[0], ConstituentNode):
-                self.dep_length = self.children[0].dep_length
-            elif isinstance(self.children[0], Token):
-                self.dep_length = 0
-
-        if len(self.children) == 2:
-            self.dep_length = self.children[0].length + \
-                              self.children[0].dep_length + \
-                              self.children[1].dep_length
-
+        if self._dep_length is None:
+            if len(self.children) == 1:
+                if isinstance(self.children[0], ConstituentNode):
+                    self._dep_length = self.children[0].dep_length
+                elif isinstance(self.children[0], Token):
+                    self._dep_length = 0
+
+            if len(self.children) == 2:
+                self._dep_length = self.children[0].length + \
+                                   self.children[0].dep_length + \
+                                   self.children[1].dep_length
+        return self._dep_length
 
 if __name__ == '__main__':
     # sample
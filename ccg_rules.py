@@ -1,14 +1,20 @@
-import copy
 from typing import Tuple, Union, TypeVar
 from string import ascii_letters
 from base import Token, Atom, Functor, ConstituentNode, Category
-from ccg_unification import unification
+from ccg_unification import UnificationPattern, node_left, node_right, build_category
 
 
 X = TypeVar('X')
 FALSE = TypeVar('False')
 Pair = Tuple[X, X]
 
+# All categories here are canonical and immutable (see Category.intern),
+# so the rules share the sub-categories of their inputs
+# and allocate nothing but the result category.
+N = Category.parse('N')
+NP = Category.parse('NP')
+NP_modifier = Category.parse('NP\\NP')
+
 
 def _is_punct(x: Category) -> bool:
     if isinstance(x, Functor):
@@ -41,12 +47,8 @@ def forward_type_raising(
     x: ConstituentNode, T: Category
 ) -> Union[ConstituentNode, FALSE]:
     return ConstituentNode(
-        tag=Functor(
-            left=copy.deepcopy(T),
-            slash='/',
-            right=Functor(
-                copy.deepcopy(T), '\\', copy.deepcopy(x.tag)
-            )
+        tag=Category.make_functor(
+            T, '/', Category.make_functor(T, '\\', x.tag)
         ),
         children=[x],
         used_rule='FT',
@@ -58,12 +60,8 @@ def backward_type_raising(
     x: ConstituentNode, T: Category
 ) -> Union[ConstituentNode, FALSE]:
     return ConstituentNode(
-        tag=Functor(
-            left=copy.deepcopy(T),
-            slash='\\',
-            right=Functor(
-                copy.deepcopy(T), '/', copy.deepcopy(x.tag)
-            )
+        tag=Category.make_functor(
+            T, '\\', Category.make_functor(T, '/', x.tag)
         ),
         children=[x],
         used_rule='BT',
@@ -76,18 +74,27 @@ BINARY RULES
 '''
 
 
+# patterns of the binary rules, each compiled once into a matcher
+forward_application_pattern = UnificationPattern(('a/b', 'b'))
+backward_application_pattern = UnificationPattern(('b', 'a\\b'))
+forward_composition_pattern = UnificationPattern(('a/b', 'b/c'))
+backward_crossing_composition_pattern = UnificationPattern(('b/c', 'a\\b'))
+generalized_forward_composition_pattern_0 = UnificationPattern(('a/b', '(b/c)/$'))
+generalized_forward_composition_pattern_1 = UnificationPattern(('a/b', '(b/c)\\$'))
+generalized_backward_crossing_composition_pattern_0 = UnificationPattern(('(b/c)/$', 'a\\b'))
+generalized_backward_crossing_composition_pattern_1 = UnificationPattern(('(b/c)\\$', 'a\\b'))
+
+
 def forward_application(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
 
-    pattern = ('a/b', 'b')
-    unified_pair = unification(
-        copy.deepcopy(x.tag), copy.deepcopy(y.tag), pattern
-    )
+    unified = forward_application_pattern.unify(x.tag, y.tag)
 
-    if unified_pair:
-        result = copy.deepcopy(y.tag) if _is_modifier(x.tag) \
-            else unified_pair[0].left
+    if unified:
+        unified_x, unified_y, substitution = unified
+        result = Category.intern(y.tag) if _is_modifier(x.tag) \
+            else build_category(node_left(unified_x), substitution)
         return ConstituentNode(
             tag=result,
             children=[x, y],
@@ -102,15 +109,13 @@ def backward_application(
 ) -> Union[ConstituentNode, FALSE]:
 
     if str(x.tag) == 'S[dcl]' and str(y.tag) == 'S[em]\\S[em]':
-        result = copy.deepcopy(x.tag)
+        result = Category.intern(x.tag)
     else:
-        pattern = ('b', 'a\\b')
-        unified_pair = unification(
-            copy.deepcopy(x.tag), copy.deepcopy(y.tag), pattern
-        )
-        if unified_pair:
-            result = copy.deepcopy(x.tag) if _is_modifier(y.tag) \
-                else unified_pair[1].left
+        unified = backward_application_pattern.unify(x.tag, y.tag)
+        if unified:
+            unified_x, unified_y, substitution = unified
+            result = Category.intern(x.tag) if _is_modifier(y.tag) \
+                else build_category(node_left(unified_y), substitution)
         else:
             return False
 
@@ -126,14 +131,14 @@ def forward_composition(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
 
-    pattern = ('a/b', 'b/c')
-    unified_pair = unification(
-        copy.deepcopy(x.tag), copy.deepcopy(y.tag), pattern
-    )
+    unified = forward_composition_pattern.unify(x.tag, y.tag)
 
-    if unified_pair:
-        result = copy.deepcopy(y.tag) if _is_modifier(x.tag) else Functor(
-            unified_pair[0].left, '/', unified_pair[1].right
+    if unified:
+        unified_x, unified_y, substitution = unified
+        result = Category.intern(y.tag) if _is_modifier(x.tag) else Category.make_functor(
+            build_category(node_left(unified_x), substitution),
+            '/',
+            build_category(node_right(unified_y), substitution)
         )
         return ConstituentNode(
             tag=result,
@@ -148,16 +153,16 @@ def backward_crossing_composition(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
 
-    pattern = ('b/c', 'a\\b')
-    unified_pair = unification(
-        copy.deepcopy(x.tag), copy.deepcopy(y.tag), pattern
-    )
+    unified = backward_crossing_composition_pattern.unify(x.tag, y.tag)
 
-    if unified_pair:
-        if unified_pair[0].left in [Category.parse('N'), Category.parse('NP')]:
+    if unified:
+        unified_x, unified_y, substitution = unified
+        if build_category(node_left(unified_x), substitution) in [N, NP]:
             return False
-        result = copy.deepcopy(x.tag) if _is_modifier(y.tag) else Functor(
-            unified_pair[1].left, '/', unified_pair[0].right
+        result = Category.intern(x.tag) if _is_modifier(y.tag) else Category.make_functor(
+            build_category(node_left(unified_y), substitution),
+            '/',
+            build_category(node_right(unified_x), substitution)
         )
         return ConstituentNode(
             tag=result,
@@ -172,17 +177,17 @@ def generalized_forward_composition(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
 
-    pattern_0 = ('a/b', '(b/c)/$')
-    pattern_1 = ('a/b', '(b/c)\\$')
-
-    unified_pair = unification(
-        copy.deepcopy(x.tag), copy.deepcopy(y.tag), pattern_0
-    )
-    if unified_pair:
-        result = copy.deepcopy(y.tag) if _is_modifier(x.tag) else Functor(
-            Functor(
-                unified_pair[0].left, '/', unified_pair[1].left.right
-            ), '/', unified_pair[1].right
+    unified = generalized_forward_composition_pattern_0.unify(x.tag, y.tag)
+    if unified:
+        unified_x, unified_y, substitution = unified
+        result = Category.intern(y.tag) if _is_modifier(x.tag) else Category.make_functor(
+            Category.make_functor(
+                build_category(node_left(unified_x), substitution),
+                '/',
+                build_category(node_right(node_left(unified_y)), substitution)
+            ),
+            '/',
+            build_category(node_right(unified_y), substitution)
         )
         return ConstituentNode(
             tag=result,
@@ -191,14 +196,17 @@ def generalized_forward_composition(
             head_is_left=True
         )
     else:
-        unified_pair = unification(
-            copy.deepcopy(x.tag), copy.deepcopy(y.tag), pattern_1
-        )
-        if unified_pair:
-            result = copy.deepcopy(y.tag) if _is_modifier(x.tag) else Functor(
-                Functor(
-                    unified_pair[0].left, '/', unified_pair[1].left.right
-                ), '\\', unified_pair[1].right
+        unified = generalized_forward_composition_pattern_1.unify(x.tag, y.tag)
+        if unified:
+            unified_x, unified_y, substitution = unified
+            result = Category.intern(y.tag) if _is_modifier(x.tag) else Category.make_functor(
+                Category.make_functor(
+                    build_category(node_left(unified_x), substitution),
+                    '/',
+                    build_category(node_right(node_left(unified_y)), substitution)
+                ),
+                '\\',
+                build_category(node_right(unified_y), substitution)
             )
             return ConstituentNode(
                 tag=result,
@@ -213,21 +221,19 @@ def generalized_backward_crossing_composition(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
 
-    pattern_0 = ('(b/c)/$', 'a\\b')
-    pattern_1 = ('(b/c)\\$', 'a\\b')
-
-    unified_pair = unification(
-        copy.deepcopy(x.tag), copy.deepcopy(y.tag), pattern_0
-    )
-    if unified_pair:
-        if unified_pair[1].right in [
-            Category.parse('N'), Category.parse('NP')
-        ]:
+    unified = generalized_backward_crossing_composition_pattern_0.unify(x.tag, y.tag)
+    if unified:
+        unified_x, unified_y, substitution = unified
+        if build_category(node_right(unified_y), substitution) in [N, NP]:
             return False
-        result = copy.deepcopy(x.tag) if _is_modifier(y.tag) else Functor(
-            Functor(
-                unified_pair[1].left, '/', unified_pair[0].left.right
-            ), '/', unified_pair[0].right
+        result = Category.intern(x.tag) if _is_modifier(y.tag) else Category.make_functor(
+            Category.make_functor(
+                build_category(node_left(unified_y), substitution),
+                '/',
+                build_category(node_right(node_left(unified_x)), substitution)
+            ),
+            '/',
+            build_category(node_right(unified_x), substitution)
         )
         return ConstituentNode(
             tag=result,
@@ -236,18 +242,19 @@ def generalized_backward_crossing_composition(
             head_is_left=True
         )
     else:
-        unified_pair = unification(
-            copy.deepcopy(x.tag), copy.deepcopy(y.tag), pattern_1
-        )
-        if unified_pair:
-            if unified_pair[1].right in [
-                Category.parse('N'), Category.parse('NP')
-            ]:
+        unified = generalized_backward_crossing_composition_pattern_1.unify(x.tag, y.tag)
+        if unified:
+            unified_x, unified_y, substitution = unified
+            if build_category(node_right(unified_y), substitution) in [N, NP]:
                 return False
-            result = copy.deepcopy(x.tag) if _is_modifier(y.tag) else Functor(
-                Functor(
-                    unified_pair[1].left, '/', unified_pair[0].left.right
-                ), '\\', unified_pair[0].right
+            result = Category.intern(x.tag) if _is_modifier(y.tag) else Category.make_functor(
+                Category.make_functor(
+                    build_category(node_left(unified_y), substitution),
+                    '/',
+                    build_category(node_right(node_left(unified_x)), substitution)
+                ),
+                '\\',
+                build_category(node_right(unified_x), substitution)
             )
             return ConstituentNode(
                 tag=result,
@@ -265,9 +272,9 @@ def conjunction(
         not _is_punct(y.tag)
         and not _is_type_raised(y.tag)
         and str(x.tag) in (',', ';', 'conj')
-        and not (y.tag ^ Category.parse('NP\\NP'))
+        and not (y.tag ^ NP_modifier)
     ):
-        result = Functor(copy.deepcopy(y.tag), '\\', copy.deepcopy(y.tag))
+        result = Category.make_functor(y.tag, '\\', y.tag)
         return ConstituentNode(
             tag=result,
             children=[x, y],
@@ -280,8 +287,8 @@ def conjunction(
 def conjunction2(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
-    if str(x.tag) == 'conj' and y.tag == Category.parse('NP\\NP'):
-        result = copy.deepcopy(y.tag)
+    if str(x.tag) == 'conj' and y.tag == NP_modifier:
+        result = Category.intern(y.tag)
         return ConstituentNode(
             tag=result,
             children=[x, y],
@@ -295,7 +302,7 @@ def remove_punctuation1(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
     if _is_punct(x.tag):
-        result = copy.deepcopy(y.tag)
+        result = Category.intern(y.tag)
         return ConstituentNode(
             tag=result,
             children=[x, y],
@@ -309,7 +316,7 @@ def remove_punctuation2(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
     if _is_punct(y.tag):
-        result = copy.deepcopy(x.tag)
+        result = Category.intern(x.tag)
         return ConstituentNode(
             tag=result,
             children=[x, y],
@@ -323,7 +330,7 @@ def remove_punctuation_left(
     x: ConstituentNode, y: ConstituentNode
 ) -> Union[ConstituentNode, FALSE]:
     if str(x.tag) in ('LQU', 'LRB'):
-        result = Functor(copy.deepcopy(y.tag), '\\', copy.deepcopy(y.tag))
+        result = Category.make_functor(y.tag, '\\', y.tag)
         return ConstituentNode(
             tag=result,
             children=[x, y],
@@ -1,4 +1,4 @@
-from typing import Tuple, Union, TypeVar
+from typing import Tuple, Union, TypeVar, Callable, Dict, List, Optional
 from base import Category, Atom, Functor
 
 
@@ -6,181 +6,318 @@ Y = TypeVar('Y')
 FALSE = TypeVar('False')
 Pair = Tuple[Y, Y]
 
+# During matching, the two input categories are never modified.
+# A (partially) unified category is represented as a node, which is either
+#   (origin, category) - a sub-category taken as it is from input `origin`
+#                        (0 for x and 1 for y), or
+#   (left, slash, right) - a functor rebuilt from two nodes.
+# All X features of one input category are one variable, whose binding is
+# kept in the substitution map `substitution[origin]` and substituted only when
+# the categories needed by a rule are built.
+Node = Tuple
+Substitution = List[Optional[str]]  # the X feature bound to each input (or None)
 
-def unification(
-    x: Category, y: Category, pattern: Pair[str]
-) -> Union[Pair[Category], FALSE]:
-    # return the unified category pair or False if failed
-    meta_x, meta_y = pattern
-    meta_x = Category.parse(meta_x)
-    meta_y = Category.parse(meta_y)
-
-    def _check(cat: Category, meta_cat: Category) -> bool:
-        # to check if x and y are respectively consistent
-        # with the pattern strings
-        if isinstance(meta_cat, Atom):
-            return True
-        elif isinstance(cat, Atom):
-            return False
-        else:
+
+def _is_functor(node: Node) -> bool:
+    return len(node) == 3 or isinstance(node[1], Functor)
+
+
+def node_left(node: Node) -> Node:
+    # the node of the left part of one functor node
+    if len(node) == 3:
+        return node[0]
+    return (node[0], node[1].left)
+
+
+def _slash(node: Node) -> str:
+    if len(node) == 3:
+        return node[1]
+    return node[1].slash
+
+
+def node_right(node: Node) -> Node:
+    # the node of the right part of one functor node
+    if len(node) == 3:
+        return node[2]
+    return (node[0], node[1].right)
+
+
+def _feature(node: Node, substitution: Substitution) -> Optional[str]:
+    # the feature of one atom node after applying the substitution
+    feature = node[1].feature.feature[0]
+    if feature == 'X' and substitution[node[0]] is not None:
+        return substitution[node[0]]
+    return feature
+
+
+def _is_ignorable(feature: Optional[str]) -> bool:
+    # 'nb' is treated as non-existing after combination
+    return feature is None or feature == 'nb'
+
+
+def _unify_atoms(x: Node, y: Node, substitution: Substitution) -> Union[Pair[Node], FALSE]:
+    # return the unified atom pair or False (if failed)
+    if x[1].tag == y[1].tag:
+        x_feature = _feature(x, substitution)
+        y_feature = _feature(y, substitution)
+        if (
+            _is_ignorable(y_feature) if _is_ignorable(x_feature)
+            else x_feature == y_feature
+        ):
+            return (x, y)
+        elif _is_ignorable(x_feature) and (not _is_ignorable(y_feature)):
+            return (y, y)
+        elif (not _is_ignorable(x_feature)) and _is_ignorable(y_feature):
+            return (x, x)
+        elif (not _is_ignorable(x_feature)) and y_feature == 'X':
+            substitution[y[0]] = x_feature
+            return (x, y)
+        elif (not _is_ignorable(y_feature)) and x_feature == 'X':
+            substitution[x[0]] = y_feature
+            return (x, y)
+    return False
+
+
+def _unify_functors(x: Node, y: Node, substitution: Substitution) -> Union[Pair[Node], FALSE]:
+    # return the unified functor pair or False (if failed)
+    if _is_functor(x) != _is_functor(y):
+        return False
+    elif not _is_functor(x):
+        return _unify_atoms(x, y, substitution)
+    elif _slash(x) != _slash(y):
+        return False
+    else:
+        left_unified = _unify_functors(node_left(x), node_left(y), substitution)
+        right_unified = _unify_functors(node_right(x), node_right(y), substitution)
+        if left_unified and right_unified:
             return (
-                _check(cat.left, meta_cat.left)
-                and (cat.slash == meta_cat.slash)
-                and _check(cat.right, meta_cat.right)
+                (left_unified[0], _slash(x), right_unified[0]),
+                (left_unified[1], _slash(x), right_unified[1])
             )
-
-    if (not _check(x, meta_x)) or (not _check(y, meta_y)):
-        # fail in consistency with the pattern strings,
-        # e.g. S\NP is not consistent with the pattern string a/b
         return False
 
-    def _unify_atoms(x: Atom, y: Atom) -> Union[Pair[Atom], FALSE]:
-        # return the unified atom pair or False (if failed)
-        if x.tag == y.tag:
-            if x.feature == y.feature:
-                return (x, y)
-            elif x.feature.is_ignorable and (not y.feature.is_ignorable):
-                return (y, y)
-            elif (not x.feature.is_ignorable) and y.feature.is_ignorable:
-                return (x, x)
-            elif (not x.feature.is_ignorable) and repr(y.feature) == 'X':
-                y.feature.feature[0] = x.feature.feature[0]
-                return (x, y)
-            elif (not y.feature.is_ignorable) and repr(x.feature) == 'X':
-                x.feature.feature[0] = y.feature.feature[0]
-                return (x, y)
-        return False
 
-    def _unify_functors(x: Functor, y: Functor) -> Union[Pair[Functor], FALSE]:
-        # return the unified functor pair or False (if failed)
-        if type(x) != type(y):
-            return False
-        elif isinstance(x, Atom) and isinstance(y, Atom):
-            return _unify_atoms(x, y)
-        elif x.slash != y.slash:
-            return False
-        else:
-            left_unified = _unify_functors(x.left, y.left)
-            right_unified = _unify_functors(x.right, y.right)
-            if left_unified and right_unified:
-                return (
-                    Functor(left_unified[0], x.slash, right_unified[0]),
-                    Functor(left_unified[1], x.slash, right_unified[1])
-                )
-
-    def _assign(
-        cat_1: Category,
-        meta_cat_1: Category,
-        cat_2: Category,
-        meta_cat_2: Category
-    ) -> Union[Pair[Category], FALSE]:
-        # return the unified category pair or False (if failed)
-
-        if isinstance(meta_cat_1, Atom) and isinstance(meta_cat_2, Atom):
-            if meta_cat_1 == meta_cat_2:
-                if type(cat_1) != type(cat_2):
-                    return False
-                elif isinstance(cat_1, Atom):
-                    return _unify_atoms(cat_1, cat_2)
-                else:
-                    return _unify_functors(cat_1, cat_2)
-            return False
+def _substitute_X(category: Category, feature: str) -> Category:
+    # return the category with all its X features replaced by the given one
+    if isinstance(category, Atom):
+        if category.contain_X_feature:
+            return Category.intern(f'{category.tag}[{feature}]')
+        return category
+    left = _substitute_X(category.left, feature)
+    right = _substitute_X(category.right, feature)
+    if left is category.left and right is category.right:
+        return category
+    return Category.make_functor(left, category.slash, right)
+
+
+def build_category(node: Node, substitution: Substitution) -> Category:
+    # build the canonical category of one node,
+    # only the functors not seen before are allocated
+    if len(node) == 3:
+        return Category.make_functor(
+            build_category(node[0], substitution),
+            node[1],
+            build_category(node[2], substitution)
+        )
+    origin, category = node
+    if substitution[origin] is None:
+        return category
+    return _substitute_X(category, substitution[origin])
+
+
+Assign = Callable[[Node, Node, Substitution], Union[Pair[Node], FALSE]]
+
+
+def _compile_assign(meta_cat_1: Category, meta_cat_2: Category) -> Optional[Assign]:
+    # compile the assignment of two categories to a pair of meta categories
+    # into a function returning the unified node pair or False (if failed),
+    # or None if the meta categories can never be assigned
+
+    if isinstance(meta_cat_1, Atom) and isinstance(meta_cat_2, Atom):
+        if meta_cat_1 == meta_cat_2:
+            return _unify_functors
+        return None
 
-        elif isinstance(meta_cat_1, Functor) and isinstance(meta_cat_2, Atom):
-            assigned_left = _assign(
-                cat_1.left, meta_cat_1.left, cat_2, meta_cat_2)
-            if assigned_left:
-                return (
-                    Functor(
-                        left=assigned_left[0],
-                        slash=cat_1.slash,
-                        right=cat_1.right
-                    ),
-                    assigned_left[1]
-                )
-            else:
-                assigned_right = _assign(
-                    cat_1.right, meta_cat_1.right, cat_2, meta_cat_2)
+    elif isinstance(meta_cat_1, Functor) and isinstance(meta_cat_2, Atom):
+        assign_left = _compile_assign(meta_cat_1.left, meta_cat_2)
+        assign_right = _compile_assign(meta_cat_1.right, meta_cat_2)
+        if assign_left is None and assign_right is None:
+            return None
+
+        def _assign(cat_1: Node, cat_2: Node, substitution: Substitution):
+            if assign_left is not None:
+                assigned_left = assign_left(node_left(cat_1), cat_2, substitution)
+                if assigned_left:
+                    return (
+                        (assigned_left[0], _slash(cat_1), node_right(cat_1)),
+                        assigned_left[1]
+                    )
+            if assign_right is not None:
+                assigned_right = assign_right(node_right(cat_1), cat_2, substitution)
                 if assigned_right:
                     return (
-                        Functor(
-                            left=cat_1.left,
-                            slash=cat_1.slash,
-                            right=assigned_right[0]
-                        ),
+                        (node_left(cat_1), _slash(cat_1), assigned_right[0]),
                         assigned_right[1]
                     )
-                else:
-                    return False
-
-        elif isinstance(meta_cat_1, Atom) and isinstance(meta_cat_2, Functor):
-            assigned_left = _assign(
-                cat_1, meta_cat_1, cat_2.left, meta_cat_2.left)
-            if assigned_left:
-                return (
-                    assigned_left[0],
-                    Functor(
-                        left=assigned_left[1],
-                        slash=cat_2.slash,
-                        right=cat_2.right
+            return False
+        return _assign
+
+    elif isinstance(meta_cat_1, Atom) and isinstance(meta_cat_2, Functor):
+        assign_left = _compile_assign(meta_cat_1, meta_cat_2.left)
+        assign_right = _compile_assign(meta_cat_1, meta_cat_2.right)
+        if assign_left is None and assign_right is None:
+            return None
+
+        def _assign(cat_1: Node, cat_2: Node, substitution: Substitution):
+            if assign_left is not None:
+                assigned_left = assign_left(cat_1, node_left(cat_2), substitution)
+                if assigned_left:
+                    return (
+                        assigned_left[0],
+                        (assigned_left[1], _slash(cat_2), node_right(cat_2))
                     )
-                )
-            else:
-                assigned_right = _assign(
-                    cat_1, meta_cat_1, cat_2.right, meta_cat_2.right)
+            if assign_right is not None:
+                assigned_right = assign_right(cat_1, node_right(cat_2), substitution)
                 if assigned_right:
                     return (
                         assigned_right[0],
-                        Functor(
-                            left=cat_2.left,
-                            slash=cat_2.slash,
-                            right=assigned_right[1]
-                        )
+                        (node_left(cat_2), _slash(cat_2), assigned_right[1])
                     )
-                else:
-                    return False
+            return False
+        return _assign
 
-        else:
+    else:
+        assign_left_left = _compile_assign(meta_cat_1.left, meta_cat_2.left)
+        assign_left_right = _compile_assign(meta_cat_1.left, meta_cat_2.right)
+        assign_right_left = _compile_assign(meta_cat_1.right, meta_cat_2.left)
+        assign_right_right = _compile_assign(meta_cat_1.right, meta_cat_2.right)
+        if (
+            assign_left_left is None and assign_left_right is None
+            and assign_right_left is None and assign_right_right is None
+        ):
+            return None
+
+        def _assign(cat_1: Node, cat_2: Node, substitution: Substitution):
             is_assigned = False
 
-            assigned_left_left = _assign(
-                cat_1.left, meta_cat_1.left, cat_2.left, meta_cat_2.left)
-            cat_1, cat_2, is_assigned = (
-                Functor(assigned_left_left[0], cat_1.slash, cat_1.right),
-                Functor(assigned_left_left[1], cat_2.slash, cat_2.right),
-                True
-            ) if assigned_left_left else (cat_1, cat_2, is_assigned)
-
-            assigned_left_right = _assign(
-                cat_1.left, meta_cat_1.left, cat_2.right, meta_cat_2.right)
-            cat_1, cat_2, is_assigned = (
-                Functor(assigned_left_right[0], cat_1.slash, cat_1.right),
-                Functor(cat_2.left, cat_2.slash, assigned_left_right[1]),
-                True
-            ) if assigned_left_right else (cat_1, cat_2, is_assigned)
-
-            assigned_right_left = _assign(
-                cat_1.right, meta_cat_1.right, cat_2.left, meta_cat_2.left)
-            cat_1, cat_2, is_assigned = (
-                Functor(cat_1.left, cat_1.slash, assigned_right_left[0]),
-                Functor(assigned_right_left[1], cat_2.slash, cat_2.right),
-                True
-            ) if assigned_right_left else (cat_1, cat_2, is_assigned)
-
-            assigned_right_right = _assign(
-                cat_1.right, meta_cat_1.right, cat_2.right, meta_cat_2.right)
-            cat_1, cat_2, is_assigned = (
-                Functor(cat_1.left, cat_1.slash, assigned_right_right[0]),
-                Functor(cat_2.left, cat_2.slash, assigned_right_right[1]),
-                True
-            ) if assigned_right_right else (cat_1, cat_2, is_assigned)
+            if assign_left_left is not None:
+                assigned = assign_left_left(node_left(cat_1), node_left(cat_2), substitution)
+                if assigned:
+                    cat_1 = (assigned[0], _slash(cat_1), node_right(cat_1))
+                    cat_2 = (assigned[1], _slash(cat_2), node_right(cat_2))
+                    is_assigned = True
+
+            if assign_left_right is not None:
+                assigned = assign_left_right(node_left(cat_1), node_right(cat_2), substitution)
+                if assigned:
+                    cat_1 = (assigned[0], _slash(cat_1), node_right(cat_1))
+                    cat_2 = (node_left(cat_2), _slash(cat_2), assigned[1])
+                    is_assigned = True
+
+            if assign_right_left is not None:
+                assigned = assign_right_left(node_right(cat_1), node_left(cat_2), substitution)
+                if assigned:
+                    cat_1 = (node_left(cat_1), _slash(cat_1), assigned[0])
+                    cat_2 = (assigned[1], _slash(cat_2), node_right(cat_2))
+                    is_assigned = True
+
+            if assign_right_right is not None:
+                assigned = assign_right_right(node_right(cat_1), node_right(cat_2), substitution)
+                if assigned:
+                    cat_1 = (node_left(cat_1), _slash(cat_1), assigned[0])
+                    cat_2 = (node_left(cat_2), _slash(cat_2), assigned[1])
+                    is_assigned = True
 
             if is_assigned:
                 return (cat_1, cat_2)
-            else:
-                return False
+            return False
+        return _assign
+
+
+def _check(cat: Category, meta_cat: Category) -> bool:
+    # to check if one category is consistent with its pattern string
+    if isinstance(meta_cat, Atom):
+        return True
+    elif isinstance(cat, Atom):
+        return False
+    else:
+        return (
+            _check(cat.left, meta_cat.left)
+            and (cat.slash == meta_cat.slash)
+            and _check(cat.right, meta_cat.right)
+        )
 
-    return _assign(x, meta_x, y, meta_y)
+
+class UnificationPattern:
+
+    def __init__(self, pattern: Pair[str]):
+        """
+        Params:
+            pattern - the pair of pattern strings, e.g. ('a/b', 'b'),
+                      parsed and compiled once into a matcher
+        """
+        self.pattern = pattern
+        self.meta_x = Category.parse(pattern[0])
+        self.meta_y = Category.parse(pattern[1])
+        self._assign = _compile_assign(self.meta_x, self.meta_y)
+
+    def __repr__(self) -> str:
+        return f'UnificationPattern({self.pattern})'
+
+    def unify(
+        self, x: Category, y: Category
+    ) -> Union[Tuple[Node, Node, Substitution], FALSE]:
+        """
+        Input:
+            x, y - the two categories to unify, which are left untouched
+        Output:
+            the unified node pair along with the substitution map of X features,
+            or False if failed; no category is built, so that one rule can
+            build (with build_category) only the parts its result needs
+        """
+        if (
+            self._assign is None
+            or not _check(x, self.meta_x)
+            or not _check(y, self.meta_y)
+        ):
+            # fail in consistency with the pattern strings,
+            # e.g. S\NP is not consistent with the pattern string a/b
+            return False
+
+        substitution = [None, None]
+        unified_pair = self._assign(
+            (0, Category.intern(x)), (1, Category.intern(y)), substitution
+        )
+        if not unified_pair:
+            return False
+        return unified_pair[0], unified_pair[1], substitution
+
+    def match(self, x: Category, y: Category) -> Union[Pair[Category], FALSE]:
+        # return the unified (canonical) category pair or False if failed,
+        # x and y are left untouched
+        unified = self.unify(x, y)
+        if not unified:
+            return False
+        unified_x, unified_y, substitution = unified
+        return (
+            build_category(unified_x, substitution),
+            build_category(unified_y, substitution)
+        )
+
+
+_compiled_patterns: Dict[Pair[str], UnificationPattern] = dict()
+
+
+def unification(
+    x: Category, y: Category, pattern: Pair[str]
+) -> Union[Pair[Category], FALSE]:
+    # return the unified category pair or False if failed,
+    # each pattern is compiled only once
+    compiled_pattern = _compiled_patterns.get(pattern)
+    if compiled_pattern is None:
+        compiled_pattern = UnificationPattern(pattern)
+        _compiled_patterns[pattern] = compiled_pattern
+    return compiled_pattern.match(x, y)
 
 
 if __name__ == '__main__':
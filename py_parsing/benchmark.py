@@ -0,0 +1,865 @@
+"""
+benchmarks for the data structures and decoders used in parsing
+"""
+
+from typing import *
+import gc
+import sys
+import json
+import time
+import bisect
+import random
+import argparse
+import tracemalloc
+import torch
+
+from decoders.decoder import CellItem, Chart, intern_rule
+from decoders.ccg_base_decoder import CCGBaseDecoder
+from decoders.ccg_tensor_decoder import CCGTensorDecoder
+from decoders.ccg_a_star_decoder import AStarCellItem, Agenda, CCGAStarDecoder
+
+sys.path.append('..')
+from base import Token, Category, Atom, ConstituentNode
+from data_loader import DataItem, load_auto_file
+from tools import to_auto
+
+
+def _measure_memory(build: Callable[[int], Any], n_items: int) -> float:
+    # return the averaged number of bytes allocated for one item built by `build`
+    items = [None] * n_items
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(n_items):
+        items[i] = build(i)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / n_items
+
+
+def measure_item_memory(n_items: int = 100000) -> Dict[str, float]:
+    """
+    Input:
+        n_items - the number of items built for each measurement
+    Output:
+        a dictionary mapping each kind of chart item to the averaged number of bytes
+        it takes (not counting the categories, which are shared canonical objects,
+        or the children, which are counted as items of their own)
+    """
+    tag = Category.parse('(S[dcl]\\NP)/NP')
+    token = Token(contents='like', tag=tag)
+    leaf = ConstituentNode(tag=tag, children=[token])
+
+    return {
+        'Token': _measure_memory(
+            lambda i: Token(contents='like', tag=tag), n_items
+        ),
+        'ConstituentNode (leaf)': _measure_memory(
+            lambda i: ConstituentNode(tag=tag, children=[token]), n_items
+        ),
+        'ConstituentNode (binary)': _measure_memory(
+            lambda i: ConstituentNode(tag=tag, children=[leaf, leaf], used_rule='FA'),
+            n_items
+        ),
+        'CellItem': _measure_memory(
+            lambda i: CellItem(score=i * 0.5, tag=tag, left=token, start_end=(i, i + 1)),
+            n_items
+        ),
+        'AStarCellItem': _measure_memory(
+            lambda i: AStarCellItem(
+                start_end=(i, i + 1),
+                inside_score=i * 0.5,
+                outside_score=i * 0.25,
+                tag=tag,
+                left=token
+            ),
+            n_items
+        )
+    }
+
+
+def run_item_memory(args):
+    results = measure_item_memory(args.n_items)
+    print(f'======== memory per item (averaged over {args.n_items} items) ========')
+    for name, n_bytes in results.items():
+        print(f'{name}: {n_bytes:.1f} bytes')
+
+
+class _ListAgenda:
+    # the former agenda kept as a sorted list, as the reference of Agenda
+
+    def __init__(self):
+        self.cell_items = list()
+        # whether the list is still sorted, i.e. no cell item has been replaced
+        # in place by an equal one whose lower cost belongs before its position
+        self.is_sorted = True
+        self.n_replaced = 0
+
+    @property
+    def _is_empty(self):
+        return self.cell_items == []
+
+    def insert(self, cell_item: AStarCellItem):
+        try:
+            idx = self.cell_items.index(cell_item)
+            if self.cell_items[idx].score > cell_item.score:
+                self.cell_items[idx] = cell_item
+                self.n_replaced += 1
+                if idx > 0 and self.cell_items[idx - 1].score > cell_item.score:
+                    self.is_sorted = False
+        except ValueError:
+            bisect.insort(self.cell_items, cell_item, key=lambda x: x.score)
+
+    def pop(self) -> AStarCellItem:
+        to_pop_idx = 0
+        for idx in range(len(self.cell_items)):
+            if self.cell_items[idx].score > self.cell_items[to_pop_idx].score:
+                break
+            if self.cell_items[idx].score == self.cell_items[to_pop_idx].score:
+                if self.cell_items[idx].dep_length < self.cell_items[to_pop_idx].score:
+                    to_pop_idx = idx
+        return self.cell_items.pop(to_pop_idx)
+
+
+def _sample_agenda_operations(
+    n_operations: int, n_spans: int, allow_replacements: bool, seed: int
+) -> List[Optional[AStarCellItem]]:
+    # sample a sequence of cell items to insert, None for popping,
+    # scores are drawn from a few values so that ties are frequent
+    rng = random.Random(seed)
+    token = Token(contents='like', tag=Category.parse('NP'))
+    derivations = list()  # (category, left, right, rule id)
+    for category_str in ['NP', 'NP[nb]', 'N', 'S[dcl]', 'S[dcl]\\NP', 'NP/N']:
+        tag = Category.parse(category_str)
+        leaf = AStarCellItem(
+            start_end=(0, 1), inside_score=0.0, outside_score=0.0, tag=tag, left=token
+        )
+        derivations.append((tag, token, None, 0))  # the dependency length is 0
+        derivations.append((tag, leaf, leaf, intern_rule('FA')))  # the dependency length is 1
+
+    operations = list()
+    highest_scores = dict()
+    for _ in range(n_operations):
+        if rng.random() < 0.35:
+            operations.append(None)
+            continue
+        start = rng.randrange(n_spans)
+        tag, left, right, rule_id = rng.choice(derivations)
+        score = rng.choice([0.5, 1.0, 1.5, 2.0, 2.5])
+        key = ((start, start + 1), tag.equivalent_id)
+        if not allow_replacements:
+            # never insert an equal cell item with a lower score,
+            # which the former agenda replaced without moving it
+            score = max(score, highest_scores.get(key, score))
+            highest_scores[key] = score
+        operations.append(
+            AStarCellItem(
+                start_end=(start, start + 1),
+                inside_score=score,
+                outside_score=0.0,
+                tag=tag,
+                left=left,
+                right=right,
+                rule_id=rule_id
+            )
+        )
+    return operations
+
+
+def _check_agenda_run(operations: List[Optional[AStarCellItem]]) -> Dict[str, int]:
+    # run the operations (followed by popping all cell items) on both Agenda
+    # and the former list agenda, raising an error once they pop different cell items,
+    # and stop comparing once the list agenda is no longer sorted (see Agenda.insert)
+    reference = _ListAgenda()
+    agenda = Agenda(tokens=[])
+    n_pops = 0
+    for cell_item in operations + [None] * len(operations):
+        if cell_item is not None:
+            agenda.insert(cell_item)
+            reference.insert(cell_item)
+            if not reference.is_sorted:
+                break
+            continue
+        if reference._is_empty != agenda._is_empty:
+            raise RuntimeError('Please check the agenda!!!')
+        if reference._is_empty:
+            continue
+        if reference.pop() is not agenda.pop():
+            raise RuntimeError('Please check the agenda!!!')
+        n_pops += 1
+    return {
+        'pops': n_pops,
+        'replacements': reference.n_replaced - (not reference.is_sorted),
+        'unsorted': int(not reference.is_sorted)
+    }
+
+
+def check_agenda_parity(
+    n_trials: int = 1000, n_operations: int = 200, n_spans: int = 4
+) -> Dict[str, Dict[str, int]]:
+    """
+    Input:
+        n_trials - the number of random operation sequences
+        n_operations - the number of insertions and pops in each sequence
+        n_spans - the number of spans cell items are drawn from
+    Output:
+        for sequences without and with replacements (of a cell item in the agenda
+        by an equal one with a lower cost), the numbers of pops and replacements compared
+        and of sequences after which the former list agenda is no longer sorted,
+        an error being raised once Agenda and the former list agenda pop different cell items
+        or a sequence without replacements is not compared to its end
+    """
+    results = dict()
+    for allow_replacements in [False, True]:
+        result = {'pops': 0, 'replacements': 0, 'unsorted': 0}
+        for seed in range(n_trials):
+            operations = _sample_agenda_operations(
+                n_operations, n_spans, allow_replacements, seed
+            )
+            for key, value in _check_agenda_run(operations).items():
+                result[key] += value
+        name = 'with replacements' if allow_replacements else 'without replacements'
+        results[name] = result
+    if results['without replacements']['unsorted'] != 0 \
+        or results['with replacements']['replacements'] == 0:
+        raise RuntimeError('Please check the agenda!!!')
+    return results
+
+
+def measure_agenda_time(n_items: int = 100000) -> Dict[str, float]:
+    """
+    Input:
+        n_items - the number of cell items inserted (and then half of them popped)
+    Output:
+        a dictionary mapping each agenda to the seconds taken
+    """
+    operations = _sample_agenda_operations(
+        n_items, n_spans=n_items, allow_replacements=True, seed=0
+    )
+    results = dict()
+    for name, agenda in [('list agenda', _ListAgenda()), ('Agenda', Agenda(tokens=[]))]:
+        start_time = time.time()
+        for cell_item in operations:
+            if cell_item is not None:
+                agenda.insert(cell_item)
+            elif not agenda._is_empty:
+                agenda.pop()
+        results[name] = time.time() - start_time
+    return results
+
+
+def run_agenda(args):
+    results = check_agenda_parity(args.n_trials)
+    print(f'======== pop sequences checked ({args.n_trials} for each) ========')
+    for name, result in results.items():
+        print(
+            f'{name}: {result["pops"]} pops and {result["replacements"]} replacements compared, '
+            f'{result["unsorted"]} sequences compared until the list agenda is no longer sorted'
+        )
+    results = measure_agenda_time(args.n_items)
+    print(f'======== agenda time ({args.n_items} operations) ========')
+    for name, seconds in results.items():
+        print(f'{name}: {seconds:.2f}s')
+
+
+def _simulate_representations(
+    data_item: DataItem, category2idx: Dict[str, int], seed: int
+) -> torch.Tensor:
+    # supertagging probabilities without a supertagging model:
+    # weak random noise, with the golden category of each word
+    # being the best one in 4 out of 5 words and the second best one (after a random one) otherwise
+    generator = torch.Generator().manual_seed(seed)
+    representations = torch.rand(len(data_item.tokens), len(category2idx), generator=generator) ** 8 * 0.3
+    is_second = torch.rand(len(data_item.tokens), generator=generator) >= 0.8
+    wrong_ids = torch.randint(len(category2idx), (len(data_item.tokens),), generator=generator)
+    for i, token in enumerate(data_item.tokens):
+        if is_second[i]:
+            representations[i, wrong_ids[i]] = 1.0
+        if str(token.tag) in category2idx:
+            representations[i, category2idx[str(token.tag)]] = 0.5 if is_second[i] else 1.0
+    return representations
+
+
+def _get_labelled_spans(constituent: ConstituentNode, start: int = 0) -> Set[Tuple[int, int, str]]:
+    # the (start, end, category) of all constituents in a parse
+    spans = {(start, start + constituent.length, str(constituent.tag))}
+    for child in constituent.children:
+        if isinstance(child, ConstituentNode):
+            spans |= _get_labelled_spans(child, start)
+            start += child.length
+    return spans
+
+
+def _check_merged_chart(decoder: CCGBaseDecoder, chart: Chart):
+    # raise an error unless each cell keeps one cell item for each category and normal-form state,
+    # each merged cell item being no better than the kept one of the same constituent
+    for start in range(chart.l):
+        for end, cell_items in chart.cells_starting_at(start):
+            kept_items = dict()
+            for cell_item in cell_items:
+                key = (cell_item.tag.id, decoder._get_normal_form_state(cell_item.rule_id))
+                if key in kept_items:
+                    raise RuntimeError('Please check the Viterbi merging!!!')
+                kept_items[key] = cell_item
+            for cell_item in chart.get_merged_items(start, end) or list():
+                key = (cell_item.tag.id, decoder._get_normal_form_state(cell_item.rule_id))
+                if key not in kept_items or kept_items[key].score < cell_item.score:
+                    raise RuntimeError('Please check the Viterbi merging!!!')
+
+
+def measure_viterbi_merging(
+    data_items: List[DataItem],
+    decoders: Dict[str, CCGBaseDecoder],
+    category2idx: Dict[str, int],
+    possible_roots: List[str]
+) -> Dict[str, Dict[str, float]]:
+    """
+    Input:
+        data_items - the sentences to decode along with their golden parses
+        decoders - a dictionary mapping a name to a decoder to compare
+        category2idx - a dictionary mapping a category string to its index
+        possible_roots - allowable categories at the root of each parse
+    Output:
+        a dictionary mapping each decoder to the seconds taken,
+        the labelled F1 of constituents against the golden parses and the number of null parses,
+        an error being raised once a chart decoded with Viterbi merging
+        keeps more than one cell item of the same category and normal-form state in a cell
+    """
+    batch_representations = [
+        _simulate_representations(data_item, category2idx, seed)
+        for seed, data_item in enumerate(data_items)
+    ]
+
+    results = dict()
+    for name, decoder in decoders.items():
+        n_correct, n_predicted, n_golden, n_null_parses = 0, 0, 0, 0
+        seconds = 0.0
+        for data_item, representations in zip(data_items, batch_representations):
+            start_time = time.time()
+            chart = decoder.decode(
+                [token.contents for token in data_item.tokens], representations.clone()
+            )
+            seconds += time.time() - start_time
+            if chart is not None and decoder.apply_viterbi_merging:
+                _check_merged_chart(decoder, chart)
+
+            parse = None
+            if chart is not None:
+                for cell_item in chart.chart[0][-1].cell_items or list():
+                    if isinstance(cell_item.tag, Atom) \
+                        and str(cell_item.tag) in possible_roots:
+                        parse = cell_item.constituent
+                        break
+
+            golden_spans = _get_labelled_spans(data_item.tree_root)
+            n_golden += len(golden_spans)
+            if parse is None:
+                n_null_parses += 1
+                continue
+            predicted_spans = _get_labelled_spans(parse)
+            n_predicted += len(predicted_spans)
+            n_correct += len(predicted_spans & golden_spans)
+
+        results[name] = {
+            'seconds': seconds,
+            'labelled F1': 2 * n_correct / max(n_predicted + n_golden, 1),
+            'null parses': n_null_parses
+        }
+    return results
+
+
+def _load_base_decoders(
+    args, settings: Dict[str, Tuple[Type[CCGBaseDecoder], Dict[str, Any]]]
+) -> Dict[str, CCGBaseDecoder]:
+    # build one decoder for each (decoder class, extra arguments) setting
+    # with the rules and the decoding arguments given to the benchmark
+    with open(args.lexical_category2idx_dir, 'r', encoding='utf8') as f:
+        category2idx = json.load(f)
+    idx2category = {idx: cat for cat, idx in category2idx.items()}
+    with open(args.instantiated_unary_rules_dir, 'r', encoding='utf8') as f:
+        instantiated_unary_rules = json.load(f)
+    with open(args.instantiated_binary_rules_dir, 'r', encoding='utf8') as f:
+        instantiated_binary_rules = json.load(f)
+
+    decoders = dict()
+    for name, (decoder_class, kwargs) in settings.items():
+        decoder = decoder_class(
+            beam_width=args.beam_width,
+            idx2tag=idx2category,
+            cat_dict=None,
+            top_k=args.top_k_supertags,
+            beta=args.beta,
+            timeout=float('inf'),
+            possible_roots=args.possible_roots.split('|'),
+            **kwargs
+        )
+        decoder._get_instantiated_unary_rules(instantiated_unary_rules)
+        decoder._get_instantiated_binary_rules(instantiated_binary_rules)
+        decoders[name] = decoder
+    return decoders
+
+
+def run_viterbi_merging(args):
+    with open(args.lexical_category2idx_dir, 'r', encoding='utf8') as f:
+        category2idx = json.load(f)
+    data_items, _ = load_auto_file(args.sample_data_dir)
+    possible_roots = args.possible_roots.split('|')
+
+    decoders = _load_base_decoders(
+        args,
+        {
+            'without merging': (CCGBaseDecoder, {'apply_viterbi_merging': False}),
+            'with merging': (CCGBaseDecoder, {'apply_viterbi_merging': True})
+        }
+    )
+    results = measure_viterbi_merging(data_items, decoders, category2idx, possible_roots)
+    print(
+        f'======== base decoder ({len(data_items)} sentences, beam width {args.beam_width}) ========'
+    )
+    for name, result in results.items():
+        print(
+            f'{name}: {result["seconds"]:.2f}s, labelled F1 {result["labelled F1"]:.4f}, '
+            f'null parses {result["null parses"]}'
+        )
+
+
+def _is_chart_diverged(
+    reference_chart: Optional[List[Tuple[List, Set]]],
+    chart: Optional[List[Tuple[List, Set]]],
+    merged_as_subset: bool
+) -> bool:
+    # whether the (cell items, merged cell items) of all cells differ,
+    # the merged ones only needing to be among the reference ones if merged_as_subset
+    if reference_chart is None or chart is None:
+        return reference_chart is not chart
+    for (reference_items, reference_merged), (cell_items, merged) in zip(reference_chart, chart):
+        if reference_items != cell_items:
+            return True
+        if merged_as_subset and not merged <= reference_merged:
+            return True
+        if not merged_as_subset and merged != reference_merged:
+            return True
+    return False
+
+
+def measure_tensor_cky(
+    data_items: List[DataItem],
+    decoders: Dict[str, CCGBaseDecoder],
+    category2idx: Dict[str, int]
+) -> Dict[str, Dict[str, float]]:
+    """
+    Input:
+        data_items - the sentences to decode
+        decoders - a dictionary mapping a name to a decoder to compare,
+                   the first one being the reference
+        category2idx - a dictionary mapping a category string to its index
+    Output:
+        a dictionary mapping each decoder to the seconds taken
+        and the number of sentences whose charts differ from those of the reference
+        in any cell item (its derivation or its score), an error being raised if any,
+        the cell items merged by Viterbi merging being compared as well
+        except that cube pruning only keeps those no worse than the lowest one in the beam
+    """
+    batch_representations = [
+        _simulate_representations(data_item, category2idx, seed)
+        for seed, data_item in enumerate(data_items)
+    ]
+
+    results = dict()
+    reference_charts = None
+    for name, decoder in decoders.items():
+        decoder.decode(  # to build the rule tables (if any) before timing
+            [token.contents for token in data_items[0].tokens], batch_representations[0].clone()
+        )
+        charts = list()
+        seconds = 0.0
+        for data_item, representations in zip(data_items, batch_representations):
+            start_time = time.time()
+            chart = decoder.decode(
+                [token.contents for token in data_item.tokens], representations.clone()
+            )
+            seconds += time.time() - start_time
+            charts.append(
+                None if chart is None else [
+                    (
+                        [
+                            (to_auto(cell_item.constituent), cell_item.score)
+                            for cell_item in chart.get_cell_items(i, k) or list()
+                        ],
+                        {
+                            (to_auto(cell_item.constituent), cell_item.score)
+                            for cell_item in chart.get_merged_items(i, k) or list()
+                        }
+                    )
+                    for i in range(chart.l) for k in range(i + 1, chart.l + 1)
+                ]
+            )
+        if reference_charts is None:
+            reference_charts = charts
+        results[name] = {
+            'seconds': seconds,
+            'diverged charts': sum(
+                _is_chart_diverged(x, y, decoder.apply_cube_pruning)
+                for x, y in zip(reference_charts, charts)
+            )
+        }
+    if any(result['diverged charts'] for result in results.values()):
+        raise RuntimeError('Please check the decoders!!!')
+    return results
+
+
+def run_tensor_cky(args):
+    with open(args.lexical_category2idx_dir, 'r', encoding='utf8') as f:
+        category2idx = json.load(f)
+    data_items, _ = load_auto_file(args.sample_data_dir)
+
+    for apply_viterbi_merging in [False, True]:
+        kwargs = {'apply_viterbi_merging': apply_viterbi_merging}
+        decoders = _load_base_decoders(
+            args,
+            {
+                'CCGBaseDecoder': (CCGBaseDecoder, kwargs),
+                'CCGBaseDecoder (cube pruning)': (CCGBaseDecoder, {'apply_cube_pruning': True, **kwargs}),
+                'CCGTensorDecoder': (CCGTensorDecoder, kwargs)
+            }
+        )
+        results = measure_tensor_cky(data_items, decoders, category2idx)
+        print(
+            f'======== base decoders ({len(data_items)} sentences, beam width {args.beam_width}, '
+            f'{"with" if apply_viterbi_merging else "without"} merging) ========'
+        )
+        for name, result in results.items():
+            print(f'{name}: {result["seconds"]:.2f}s, diverged charts {result["diverged charts"]}')
+
+
+def measure_parse_results(
+    data_items: List[DataItem],
+    decoder: CCGBaseDecoder,
+    category2idx: Dict[str, int],
+    n_best: int = 1
+) -> Dict[str, Dict[str, float]]:
+    """
+    Input:
+        data_items - the sentences to decode as one batch
+        decoder - the decoder to decode them
+        category2idx - a dictionary mapping a category string to its index
+        n_best - the number of derivations extracted for each sentence
+    Output:
+        a dictionary mapping each way of decoding the batch to the peak number of bytes
+        and the seconds taken, either keeping the charts of the batch
+        until the derivations are extracted or keeping only the parse results,
+        an error being raised unless both extract the same derivations
+    """
+    pretokenized_sents = [[token.contents for token in data_item.tokens] for data_item in data_items]
+    batch_representations = [
+        _simulate_representations(data_item, category2idx, seed)
+        for seed, data_item in enumerate(data_items)
+    ]
+
+    def _with_charts():
+        charts = decoder.batch_decode(
+            pretokenized_sents, [representations.clone() for representations in batch_representations]
+        )
+        return [decoder.get_parse_result(chart, n_best=n_best) for chart in charts]
+
+    def _with_results():
+        return decoder.batch_parse(
+            pretokenized_sents,
+            [representations.clone() for representations in batch_representations],
+            n_best=n_best
+        )
+
+    results = dict()
+    reference_derivations = None
+    for name, parse in [('charts', _with_charts), ('parse results', _with_results)]:
+        gc.collect()
+        tracemalloc.start()
+        start_time = time.time()
+        parse_results = parse()
+        seconds = time.time() - start_time
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {
+            'peak bytes': peak,
+            'seconds': seconds,
+            'null parses': sum(result.derivation is None for result in parse_results)
+        }
+
+        derivations = [
+            (
+                None if result.derivation is None else to_auto(result.derivation),
+                result.score,
+                [(cost, to_auto(derivation)) for cost, derivation in result.k_best]
+            )
+            for result in parse_results
+        ]
+        if reference_derivations is None:
+            reference_derivations = derivations
+        elif derivations != reference_derivations:
+            raise RuntimeError('Please check the parse results!!!')
+    return results
+
+
+def run_parse_results(args):
+    with open(args.lexical_category2idx_dir, 'r', encoding='utf8') as f:
+        category2idx = json.load(f)
+    data_items, _ = load_auto_file(args.sample_data_dir)
+
+    decoders = _load_base_decoders(args, {'CCGBaseDecoder': (CCGBaseDecoder, dict())})
+    results = measure_parse_results(
+        data_items, decoders['CCGBaseDecoder'], category2idx, args.n_best
+    )
+    print(
+        f'======== base decoder ({len(data_items)} sentences as one batch, '
+        f'beam width {args.beam_width}, {args.n_best} best) ========'
+    )
+    for name, result in results.items():
+        print(
+            f'keeping {name}: peak {result["peak bytes"] / 1024:.1f} KiB, '
+            f'{result["seconds"]:.2f}s, null parses {result["null parses"]}'
+        )
+
+
+def _get_phrases(data_item: DataItem, category_str: str) -> List[DataItem]:
+    # the constituents of one category (with more than one token) in the golden parse
+    # as data items of their own
+    phrases = list()
+
+    def _collect(node: ConstituentNode, start: int):
+        if str(node.tag) == category_str and node.length > 1:
+            phrases.append(
+                DataItem(
+                    id=f'{data_item.id}[{start}:{start + node.length}]',
+                    tokens=data_item.tokens[start:start + node.length],
+                    tree_root=node
+                )
+            )
+        for child in node.children:
+            if isinstance(child, ConstituentNode):
+                _collect(child, start)
+                start += child.length
+            else:
+                start += 1
+
+    _collect(data_item.tree_root, 0)
+    return phrases
+
+
+def measure_a_star_caps(
+    data_items: List[DataItem],
+    decoders: Dict[str, CCGAStarDecoder],
+    category2idx: Dict[str, int]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Input:
+        data_items - the sentences to decode
+        decoders - a dictionary mapping a name to a decoder to compare,
+                   the first one being the reference without caps
+        category2idx - a dictionary mapping a category string to its index
+    Output:
+        a dictionary mapping each decoder to the seconds taken,
+        the number of sentences stopped for each reason and of cell items evicted
+        (from the statistics collected by the decoder), and the number of sentences
+        parsed by the reference but not by the decoder
+    """
+    pretokenized_sents = [[token.contents for token in data_item.tokens] for data_item in data_items]
+    batch_representations = [
+        _simulate_representations(data_item, category2idx, seed)
+        for seed, data_item in enumerate(data_items)
+    ]
+
+    results = dict()
+    reference_stop_reasons = None
+    for name, decoder in decoders.items():
+        start_time = time.time()
+        decoder.batch_decode(
+            pretokenized_sents, [representations.clone() for representations in batch_representations]
+        )
+        seconds = time.time() - start_time
+
+        stop_reasons = [stats['stop_reason'] for stats in decoder.stats]
+        if reference_stop_reasons is None:
+            reference_stop_reasons = stop_reasons
+        stop_reason_counts = dict()
+        for stop_reason in stop_reasons:
+            stop_reason_counts[stop_reason] = stop_reason_counts.get(stop_reason, 0) + 1
+        results[name] = {
+            'seconds': seconds,
+            'stop reasons': stop_reason_counts,
+            'evicted items': sum(stats['n_evicted_items'] for stats in decoder.stats),
+            'lost parses': sum(
+                x == 'goal' and y != 'goal'
+                for x, y in zip(reference_stop_reasons, stop_reasons)
+            )
+        }
+    return results
+
+
+def run_a_star_caps(args):
+    with open(args.lexical_category2idx_dir, 'r', encoding='utf8') as f:
+        category2idx = json.load(f)
+    idx2category = {idx: cat for cat, idx in category2idx.items()}
+    with open(args.instantiated_unary_rules_dir, 'r', encoding='utf8') as f:
+        instantiated_unary_rules = json.load(f)
+    with open(args.instantiated_binary_rules_dir, 'r', encoding='utf8') as f:
+        instantiated_binary_rules = json.load(f)
+    data_items, _ = load_auto_file(args.sample_data_dir)
+
+    decoders = dict()
+    for max_cell_items in [None, 2, 1]:
+        decoder = CCGAStarDecoder(
+            idx2tag=idx2category,
+            cat_dict=None,
+            top_k=args.top_k_supertags,
+            beta=args.beta,
+            timeout=float('inf'),
+            apply_cat_filtering=False,
+            possible_roots=args.possible_roots.split('|'),
+            max_cell_items=max_cell_items
+        )
+        decoder._get_instantiated_unary_rules(instantiated_unary_rules)
+        decoder._get_instantiated_binary_rules(instantiated_binary_rules)
+        decoders[f'max_cell_items {max_cell_items}'] = decoder
+
+    # the noun phrases reach their root NP only by the unary rule N -> NP
+    # after N fills the whole-sentence span, so the cap must not drop NP there
+    noun_phrases = [
+        phrase for data_item in data_items for phrase in _get_phrases(data_item, 'N')
+    ]
+    for name, items in [('sentences', data_items), ('noun phrases', noun_phrases)]:
+        results = measure_a_star_caps(items, decoders, category2idx)
+        print(f'======== A* decoder ({len(items)} {name}) ========')
+        for decoder_name, result in results.items():
+            stop_reasons = ', '.join(
+                f'{stop_reason} {count}' for stop_reason, count in result['stop reasons'].items()
+            )
+            print(
+                f'{decoder_name}: {result["seconds"]:.2f}s, {stop_reasons}, '
+                f'evicted items {result["evicted items"]}, lost parses {result["lost parses"]}'
+            )
+
+
+def run_parity(args):
+    # run all the checks raising an error once the outputs differ,
+    # those on the sample data at several beam widths
+    check_agenda_parity(args.n_trials)
+    print(f'======== agenda: {args.n_trials} pop sequences checked for each ========')
+    for beam_width in sorted({1, 2, 8, args.beam_width}):
+        beam_args = argparse.Namespace(**{**vars(args), 'beam_width': beam_width})
+        run_viterbi_merging(beam_args)
+        run_tensor_cky(beam_args)
+        run_parse_results(beam_args)
+    print('======== all checks passed ========')
+
+
+class _DenseCell:
+    # the former cell, as the reference of Cell
+
+    def __init__(self):
+        self.span_representation = None
+        self.cell_items = None
+
+
+class _DenseChart:
+    # the former chart allocating the cells of all spans at once, as the reference of Chart
+
+    def __init__(self, l_sent: int, idx2tag: Dict[int, Any]):
+        self.l = l_sent
+        self.chart = [[_DenseCell() for _ in range(l_sent + 1)] for _ in range(l_sent)]
+        self.idx2tag = idx2tag
+
+
+def measure_chart_memory(
+    l_sents: List[int], fill_ratio: float = 0.1, n_charts: int = 10
+) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """
+    Input:
+        l_sents - the sentence lengths to measure
+        fill_ratio - the ratio of spans whose cells are filled,
+                     as A* decoding fills only a small part of the chart
+        n_charts - the number of charts built for each measurement
+    Output:
+        a dictionary mapping each sentence length to the averaged number of bytes
+        and seconds taken by each chart to be built and filled
+        (not counting the cell items, which are shared by all cells)
+    """
+    cell_items = [CellItem(score=0.0)]
+    results = dict()
+    for l_sent in l_sents:
+        spans = [(i, k) for i in range(l_sent) for k in range(i + 1, l_sent + 1)]
+        filled_spans = random.Random(l_sent).sample(spans, int(len(spans) * fill_ratio))
+
+        def _build(chart_class):
+            chart = chart_class(l_sent, idx2tag=None)
+            for i, k in filled_spans:
+                chart.chart[i][k].cell_items = cell_items
+            return chart
+
+        results[l_sent] = dict()
+        for name, chart_class in [('dense chart', _DenseChart), ('Chart', Chart)]:
+            start_time = time.time()
+            for _ in range(n_charts):
+                _build(chart_class)
+            seconds = (time.time() - start_time) / n_charts
+            results[l_sent][name] = {
+                'bytes': _measure_memory(lambda i: _build(chart_class), n_charts),
+                'seconds': seconds
+            }
+    return results
+
+
+def run_chart_memory(args):
+    results = measure_chart_memory([20, 80, 150], args.chart_fill_ratio)
+    print(f'======== memory per chart ({args.chart_fill_ratio:.0%} of the spans filled) ========')
+    for l_sent, result in results.items():
+        for name, measures in result.items():
+            print(
+                f'{l_sent} tokens, {name}: {measures["bytes"] / 1024:.1f} KiB, '
+                f'{measures["seconds"] * 1000:.2f}ms'
+            )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark parsing')
+
+    parser.add_argument('--n_items', type=int, default=100000)
+    parser.add_argument('--n_trials', type=int, default=1000)
+    parser.add_argument('--sample_data_dir', type=str, default='../data/ccg-sample.auto')
+    parser.add_argument('--lexical_category2idx_dir', type=str,
+                        default='../data/lexical_category2idx_cutoff.json')
+    parser.add_argument('--instantiated_unary_rules_dir', type=str,
+                        default='../data/instantiated_unary_rules_with_X.json')
+    parser.add_argument('--instantiated_binary_rules_dir', type=str,
+                        default='../data/instantiated_seen_binary_rules.json')
+    parser.add_argument('--possible_roots', type=str, default='S[dcl]|NP|S[wq]|S[q]|S[qem]|S[b]\\NP')
+    parser.add_argument('--beam_width', type=int, default=4)
+    parser.add_argument('--top_k_supertags', type=int, default=5)
+    parser.add_argument('--beta', type=float, default=0.0005)
+    parser.add_argument('--chart_fill_ratio', type=float, default=0.1)
+    parser.add_argument('--n_best', type=int, default=1)
+
+    parser.add_argument('--mode', type=str, default='item_memory',
+                        choices=['item_memory', 'agenda', 'viterbi_merging', 'tensor_cky', 'chart_memory', 'parse_results',
+                                 'a_star_caps', 'parity'])
+
+    args = parser.parse_args()
+
+    if args.mode == 'item_memory':
+        run_item_memory(args)
+    elif args.mode == 'agenda':
+        run_agenda(args)
+    elif args.mode == 'viterbi_merging':
+        run_viterbi_merging(args)
+    elif args.mode == 'tensor_cky':
+        run_tensor_cky(args)
+    elif args.mode == 'chart_memory':
+        run_chart_memory(args)
+    elif args.mode == 'parse_results':
+        run_parse_results(args)
+    elif args.mode == 'a_star_caps':
+        run_a_star_caps(args)
+    elif args.mode == 'parity':
+        run_parity(args)
+    else:
+        raise RuntimeError('Please check the mode of the benchmark!!!')
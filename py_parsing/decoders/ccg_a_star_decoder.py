@@ -1,48 +1,64 @@
 import sys
-import time
-from typing import TypeVar, Tuple, List, Dict, Any
+from typing import Tuple, List, Dict, Any, Optional, FrozenSet, Union
+import itertools
 import torch
 import bisect
+import heapq
 import numpy as np
 
 sys.path.append('..')
 from ccg_parsing_models import SupertaggingRepresentations
-from decoders.decoder import CellItem, Chart, Decoder
+from decoders.decoder import (
+    CellItem, Chart, Decoder, CategoryId, RuleId, WorkBudget, _NO_PARTNERS,
+    build_category_filters, apply_category_filters
+)
 sys.path.append('../..')
-from base import Token, Category, ConstituentNode
-
-
-CategoryStr = TypeVar('CategoryStr')
-RuleName = TypeVar('RuleName')
-InstantiatedUnaryRule = Tuple[CategoryStr, CategoryStr, RuleName]
-InstantiatedBinaryRule = Tuple[CategoryStr, CategoryStr, List[Tuple[CategoryStr, RuleName]]]
+from base import Atom, Token, Category
 
 
 class AStarCellItem(CellItem):
 
+    __slots__ = ('inside_score', 'outside_score', 'dep_length')
+
     def __init__(
         self,
         start_end: Tuple[int, int],  # start and end positions
         inside_score: float,  # the definite A* score inside the constituent
         outside_score: float,  # the estimated A* score outside the constituent
-        constituent: ConstituentNode
+        tag: Category,
+        left: Union['AStarCellItem', Token],  # the left (or only) child, or the token
+        right: Optional['AStarCellItem'] = None,  # the right child of binary rules
+        rule_id: RuleId = 0  # the id of the rule building it, 0 for supertags
     ):
         self.inside_score = inside_score
         self.outside_score = outside_score
+        # the head first dependency length defined by depccg (for English),
+        # the same as ConstituentNode.dep_length of the constituent
+        if isinstance(left, Token):
+            self.dep_length = 0
+        elif right is None:
+            self.dep_length = left.dep_length
+        else:
+            self.dep_length = (
+                left.start_end[1] - left.start_end[0] + left.dep_length + right.dep_length
+            )
         super().__init__(
             score=inside_score + outside_score,
-            start_end=start_end,
-            constituent=constituent
+            tag=tag,
+            left=left,
+            right=right,
+            rule_id=rule_id,
+            start_end=start_end
         )
 
     def __repr__(self) -> str:
-        return str([str(self.constituent), self.score])
+        return str([str(self.tag), self.score])
 
     def __eq__(self, other) -> bool:
         if isinstance(other, AStarCellItem):
             return (
                 self.start_end == other.start_end
-                and self.constituent == other.constituent
+                and self.tag == other.tag
             )
         return False
 
@@ -51,75 +67,148 @@ class Agenda:
 
     def __init__(
         self,
-        tokens: List[List[Dict[str, Any]]]
+        tokens: List[List[Dict[str, Any]]],
+        max_size: Optional[int] = None
     ):  # l_sent * C
+        """
+        Params:
+            tokens - the ktop categories along with their scores of each word
+            max_size - the number of cell items the agenda is trimmed back to (the best ones)
+                       whenever its heap (with the entries of replaced cell items)
+                       grows to twice this size, so that fewer than 2 * max_size cell items
+                       are kept at any time, None for no limit
+        """
 
         self.tokens = tokens
         # tokens along with their ktop categories and scores
 
         self.minimun_costs = np.array([ktop[0]['score'] for ktop in tokens])
         # calculate and store the best category in advance
-
-        self.cell_items = list()  # a cell_item is a partial parse for a span
+        self.prefix_costs = np.concatenate(([0.0], np.cumsum(self.minimun_costs))).tolist()
+        self.suffix_costs = np.concatenate(
+            (np.cumsum(self.minimun_costs[::-1])[::-1], [0.0])
+        ).tolist()
+        # the sums of best category scores before and after each position,
+        # so that the outside score of any span is looked up in constant time
+
+        # a binary heap of (score, tie-break, cell_item)
+        # where a cell_item is a partial parse for a span,
+        # entries of replaced cell items are left in the heap and skipped when popped
+        self.heap = list()
+        # (span, category) -> the cell item in the agenda,
+        # categories equal (i.e. ignoring 'nb' features) share one entry
+        self.best_cell_items: Dict[Tuple[Tuple[int, int], CategoryId], AStarCellItem] = dict()
+        self.n_pushed = 0
+        self.max_size = max_size
+        self.n_evicted = 0
         self.initialize_cell_items()
 
     def __repr__(self) -> str:
         # for printing out the agenda
         return str(
             [
-                [str(cell_item.constituent), cell_item.score]
+                [str(cell_item.tag), cell_item.score]
                 for cell_item in self.cell_items
             ]
         )
 
+    @property
+    def cell_items(self) -> List[AStarCellItem]:
+        # the cell items in the agenda in the order of being popped, for printing only
+        return [
+            entry[-1] for entry in sorted(self.heap)
+            if self.best_cell_items.get(self._key(entry[-1])) is entry[-1]
+        ]
+
+    def __len__(self) -> int:
+        return len(self.best_cell_items)
+
     @property
     def _is_empty(self):
-        return self.cell_items == []
+        return not self.best_cell_items
+
+    @staticmethod
+    def _key(cell_item: AStarCellItem) -> Tuple[Tuple[int, int], CategoryId]:
+        return (cell_item.start_end, cell_item.tag.equivalent_id)
+
+    def get_outside_score(self, start: int, end: int) -> float:
+        # the estimated score outside the span, i.e. the sum of best category scores
+        return self.prefix_costs[start] + self.suffix_costs[end]
 
     def initialize_cell_items(self):
         # initialize with topk supertags of all words
-
-        for idx, ktop in enumerate(self.tokens):
-            for token in ktop:
-                outside_score = sum(
-                    np.concatenate(
-                        (self.minimun_costs[:idx], self.minimun_costs[idx + 1:])
-                    )
-                )
-                cell_item = AStarCellItem(
-                    start_end=(idx, idx + 1),
-                    inside_score=token['score'],
-                    outside_score=outside_score,
-                    constituent=ConstituentNode(
-                        tag=token['token'].tag,
-                        children=[token['token']]
-                    )
-                )
-                self.insert(cell_item)
+        self._insert_token_cell_items(self.tokens)
+
+    def insert_tokens(self, tokens: List[List[Dict[str, Any]]]):
+        # insert more categories of each word, never better than the ones already inserted
+        for ktop, new_ktop in zip(self.tokens, tokens):
+            ktop.extend(new_ktop)
+        self._insert_token_cell_items(tokens)
+
+    def _insert_token_cell_items(self, tokens: List[List[Dict[str, Any]]]):
+        # the outside scores of all (word, category) pairs are calculated at once
+        positions = np.array(
+            [idx for idx, ktop in enumerate(tokens) for _ in ktop], dtype=np.int64
+        )
+        outside_scores = (
+            np.array(self.prefix_costs)[positions] + np.array(self.suffix_costs)[positions + 1]
+        ).tolist()
+
+        tokens = (token for ktop in tokens for token in ktop)
+        for idx, token, outside_score in zip(positions.tolist(), tokens, outside_scores):
+            cell_item = AStarCellItem(
+                start_end=(idx, idx + 1),
+                inside_score=token['score'],
+                outside_score=outside_score,
+                tag=token['token'].tag,
+                left=token['token']
+            )
+            self.insert(cell_item)
 
     def insert(self, cell_item: AStarCellItem):
-        try:
-            # replace the cell_item in the agenda
-            # with the same span and category but higher cost
-            idx = self.cell_items.index(cell_item)
-            if self.cell_items[idx].score > cell_item.score:
-                self.cell_items[idx] = cell_item
-        except:
-            # insert the new cell_item in low-to-high order
-            bisect.insort(self.cell_items, cell_item, key=lambda x: x.score)
+        # replace the cell_item in the agenda
+        # with the same span and category but higher cost,
+        # the new one being popped by its own (lower) cost as the lowest-cost cell item
+        # must always be popped first in A* decoding, whereas the former sorted-list agenda
+        # put it at the position of the replaced one, which left the list out of order
+        # whenever the new cost is lower than that of the cell item before it
+        # (otherwise both pop in the same order, see benchmark.check_agenda_parity)
+        key = self._key(cell_item)
+        in_agenda = self.best_cell_items.get(key)
+        if in_agenda is not None and in_agenda.score <= cell_item.score:
+            return
+        self.best_cell_items[key] = cell_item
+
+        # among lowest-cost cell items, pop the last inserted one
+        # whose dependency length is less than its cost, otherwise the first inserted one
+        self.n_pushed += 1
+        if cell_item.dep_length < cell_item.score:
+            tie_break = (0, -self.n_pushed)
+        else:
+            tie_break = (1, self.n_pushed)
+        heapq.heappush(self.heap, (cell_item.score, tie_break, cell_item))
+        if self.max_size is not None and len(self.heap) >= 2 * self.max_size:
+            self._evict()
+
+    def _evict(self):
+        # keep only the best max_size cell items, dropping replaced entries as well,
+        # a sorted list being a valid heap
+        entries = sorted(
+            entry for entry in self.heap
+            if self.best_cell_items.get(self._key(entry[-1])) is entry[-1]
+        )
+        for entry in entries[self.max_size:]:
+            del self.best_cell_items[self._key(entry[-1])]
+        self.n_evicted += max(len(entries) - self.max_size, 0)
+        self.heap = entries[:self.max_size]
 
     def pop(self) -> AStarCellItem:
-        # pop the one with longest dependency length
-        # among lowest-cost cell items
-        to_pop_idx = 0
-        for idx in range(len(self.cell_items)):
-            if self.cell_items[idx].score > self.cell_items[to_pop_idx].score:
-                break
-            if self.cell_items[idx].score == self.cell_items[to_pop_idx].score:
-                if self.cell_items[idx].constituent.dep_length < self.cell_items[to_pop_idx].score:
-                    to_pop_idx = idx
-
-        return self.cell_items.pop(to_pop_idx)
+        while True:
+            cell_item = heapq.heappop(self.heap)[-1]
+            key = self._key(cell_item)
+            if self.best_cell_items.get(key) is cell_item:
+                del self.best_cell_items[key]
+                return cell_item
 
 
 class AStarChart(Chart):
@@ -130,70 +219,67 @@ class AStarChart(Chart):
         idx2tag: Dict[int, Any]
     ):
         super().__init__(l_sent, idx2tag)
+        # the cell items of the spans starting (ending) at each position,
+        # bucketed by the key ids of their categories,
+        # each entry being (end (start), position in its cell, cell item),
+        # which never compares the cell items as (end (start), position) is unique
+        self.items_starting_at = [dict() for _ in range(l_sent + 1)]
+        self.items_ending_at = [dict() for _ in range(l_sent + 1)]
+        self.n_items = 0  # the total number of cell items in the chart
 
     @property
     def _is_completed(self):
-        return not self.chart[0][self.l]._is_null
+        return self.get_cell_items(0, self.l) is not None
 
     def _print_cell_items(self):
         # for printing out the cell items in the chart
         for i in range(self.l):
-            for j in range(i + 1, self.l + 1):
-                if not self.chart[i][j]._is_null:
-                    print(
-                        f'span[{i}][{j}]',
-                        [
-                            str(cell_item.constituent)
-                            for cell_item in self.chart[i][j].cell_items
-                        ]
-                    )
+            for j, cell_items in self.cells_starting_at(i):
+                print(
+                    f'span[{i}][{j}]',
+                    [str(cell_item.tag) for cell_item in cell_items]
+                )
+
+    def n_cell_items(self, start: int, end: int) -> int:
+        cell_items = self.get_cell_items(start, end)
+        return 0 if cell_items is None else len(cell_items)
 
     def insert(self, cell_item: AStarCellItem):  # used for A* decoding
+        self.n_items += 1
         start, end = cell_item.start_end
-        if self.chart[start][end].cell_items is None:
-            self.chart[start][end].cell_items = [cell_item]
+        cell = self.chart[start][end]
+        if cell.cell_items is None:
+            cell.cell_items = [cell_item]
         else:
-            self.chart[start][end].cell_items.append(cell_item)
-
-
-def _binarize(ids, length):  # to assign 0 to all designated positions
-    result = np.ones(length, dtype=np.bool)
-    result[ids] = 0
-    return result
-
-
-def apply_category_filters(
-    pretokenized_sents: List[List[str]],
-    batch_representations: List[SupertaggingRepresentations],
-    category2idx: Dict[str, int],
-    category_dict: Dict[str, List[str]]
-) -> List[SupertaggingRepresentations]:
-    """
-    Input:
-        pretokenized_sents - a list of pretokenized sentences, each of which is a list of strings
-        batch_representations - a list of tensors, each of shape l_sent * C
-        category2idx - a dictionary mapping a category string to its index
-        category_dict - a dictionary mapping a word to its allowed categories
-    Output:
-        filtered batch_representations
-        (apply the category filter to pretokenized_sents so that for each word, 
-        only categories allowed for this word in the category_dict
-        keep their scores in batch_representations)
-    """
-    category_dict = {
-        word: _binarize(
-            [category2idx[cat] for cat in cats],
-            batch_representations[0].shape[1]
+            cell.cell_items.append(cell_item)
+        position = len(cell.cell_items) - 1
+        key_id = cell_item.tag.key_id
+        # keep each bucket in the order of scanning the chart cell by cell
+        bisect.insort(
+            self.items_starting_at[start].setdefault(key_id, list()),
+            (end, position, cell_item)
+        )
+        bisect.insort(
+            self.items_ending_at[end].setdefault(key_id, list()),
+            (start, position, cell_item)
         )
-        for word, cats in category_dict.items()
-    }
 
-    for tokens, representations in zip(pretokenized_sents, batch_representations):
-        for index, token in enumerate(tokens):
-            if token in category_dict:
-                representations[index, category_dict[token]] = 0
 
-    return batch_representations
+def _join(
+    buckets: Dict[CategoryId, List[Tuple[int, int, AStarCellItem]]],
+    partners: Optional[FrozenSet[CategoryId]]
+) -> List[Tuple[int, int, AStarCellItem]]:
+    # hash join the bucketed cell items with the partner category ids (all if None),
+    # keeping the order of scanning the chart cell by cell
+    if partners is None:
+        matched = list(buckets.values())
+    else:
+        matched = [buckets[key_id] for key_id in buckets.keys() & partners]
+    if not matched:
+        return []
+    elif len(matched) == 1:
+        return matched[0]
+    return sorted(itertools.chain.from_iterable(matched))
 
 
 class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
@@ -201,17 +287,29 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
     def __init__(
         self,
         idx2tag: Dict[int, str],
-        cat_dict: Dict[str, List[str]],
+        cat_dict: Optional[Dict[str, List[str]]],
         top_k: int = 10,
         apply_supertagging_pruning: bool = True,
         beta: float = 0.00001,
         timeout: float = 4.0,
-        apply_cat_filtering: bool = True
+        apply_cat_filtering: bool = True,
+        apply_binary_rule_fallback: bool = False,
+        binary_rule_cache_size: int = 2**16,
+        binary_rule_cache_dir: Optional[str] = None,
+        possible_roots: Optional[List[str]] = None,
+        apply_reachability_pruning: bool = False,
+        max_agenda_size: Optional[int] = None,
+        max_cell_items: Optional[int] = None,
+        max_chart_items: Optional[int] = None,
+        max_pops: Optional[int] = None,
+        max_combinations: Optional[int] = None,
+        supertagging_levels: Optional[List[Tuple[float, int]]] = None
     ):
         """
         Params:
             idx2tag - a dictionary mapping an index to a category string
-            cat_dict - a dictionary mapping a word to its allowed categories
+            cat_dict - a dictionary mapping a word to its allowed categories,
+                       None if loaded from a compiled grammar (see _load_grammar)
             top_k - maximum number of categories allowed for each word
             apply_supertagging_pruning - used for beta
             beta - cut all categories whose probabilities
@@ -219,116 +317,95 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
                    this speed up parsing substantially
             timeout - maximum time allowable for each parse, otherwise return a null parse
             apply_cat_filtering - used for category filtering
+            apply_binary_rule_fallback - whether to apply the binary rules on the fly
+                                         to category pairs unseen in the instantiated rules
+            binary_rule_cache_size - maximum number of unseen pairs whose results are cached
+            binary_rule_cache_dir - the file to load the cache from (if existing)
+                                    and to save it to, not persisted if None
+            possible_roots - allowable categories at the root of each parse,
+                             decoding goes on until a parse of the whole sentence
+                             has an atomic one among them at its root (as in parser.run),
+                             the first parse of the whole sentence is returned if None
+            apply_reachability_pruning - whether to discard cell items whose categories
+                                         can never reach possible_roots from their positions
+            max_agenda_size - the number of cell items the agenda of each sentence
+                              is trimmed back to by evicting the worst ones,
+                              once it grows to twice this size (see Agenda), None for no limit
+            max_cell_items - maximum number of cell items in each chart cell,
+                             beyond which popped cell items of the span are dropped
+                             (as they are never better than the ones in the cell),
+                             except for the whole-sentence span, None for no limit,
+                             small values dropping cell items the best parse is built from
+                             and so changing or losing parses
+            max_chart_items - maximum number of cell items in the chart for each sentence,
+                              beyond which a null parse is returned, None for no limit
+            max_pops - maximum number of cell items popped from the agenda for each sentence,
+                       otherwise return a null parse, None for no limit (see WorkBudget)
+            max_combinations - maximum number of cell item pairs tried with binary rules
+                               for each sentence, otherwise return a null parse,
+                               None for no limit (see WorkBudget)
+            supertagging_levels - (beta, top_k) pairs from the tightest to the loosest one
+                                  for adaptive supertagging, used instead of
+                                  apply_supertagging_pruning, beta and top_k:
+                                  once the agenda is exhausted without a parse,
+                                  the categories admitted by the next level are added to it
+                                  and decoding goes on with the chart kept,
+                                  so the parse found is not guaranteed to be the best one
+                                  under the loosest level, None for not applied
         """
         super().__init__(
             top_k=top_k,
-            idx2tag=idx2tag
+            idx2tag=idx2tag,
+            apply_binary_rule_fallback=apply_binary_rule_fallback,
+            binary_rule_cache_size=binary_rule_cache_size,
+            binary_rule_cache_dir=binary_rule_cache_dir,
+            possible_roots=possible_roots,
+            apply_reachability_pruning=apply_reachability_pruning
         )
         self.cat_dict = cat_dict
         self.apply_supertagging_pruning = apply_supertagging_pruning
         self.beta = beta
         self.timeout = timeout
         self.apply_cat_filtering = apply_cat_filtering
-
-    def _get_instantiated_unary_rules(
-        self,
-        instantiated_unary_rules: List[InstantiatedUnaryRule]
-    ):
-        # get instantiated_unary_rules from a specific file
-        self.apply_instantiated_unary_rules = dict()
-        for instantiated_unary_rule in instantiated_unary_rules:
-            initial_cat = Category.parse(instantiated_unary_rule[0])
-            final_cat = Category.parse(instantiated_unary_rule[1])
-            if initial_cat not in self.apply_instantiated_unary_rules:
-                self.apply_instantiated_unary_rules[initial_cat] = list()
-            self.apply_instantiated_unary_rules[initial_cat].append(
-                {
-                    'result_cat': final_cat,
-                    'used_rule': instantiated_unary_rule[2]
-                }
-            )
-
-    def _get_instantiated_binary_rules(
-        self,
-        instantiated_binary_rules: List[InstantiatedBinaryRule]
-    ):
-        # get instantiated_binary_rules from a specific file
-        self.apply_instantiated_binary_rules = dict()
-        for instantiated_binary_rule in instantiated_binary_rules:
-            left_cat = Category.parse(instantiated_binary_rule[0])
-            if left_cat not in self.apply_instantiated_binary_rules:
-                self.apply_instantiated_binary_rules[left_cat] = dict()
-            right_cat = Category.parse(instantiated_binary_rule[1])
-            if right_cat not in self.apply_instantiated_binary_rules[left_cat]:
-                self.apply_instantiated_binary_rules[left_cat][right_cat] = list()
-            for result in instantiated_binary_rule[2]:
-                self.apply_instantiated_binary_rules[left_cat][right_cat].append(
-                    {
-                        'result_cat': Category.parse(result[0]),
-                        'used_rule': result[1]
-                    }
-                )
+        self.max_agenda_size = max_agenda_size
+        self.max_cell_items = max_cell_items
+        self.max_chart_items = max_chart_items
+        self.max_pops = max_pops
+        self.max_combinations = max_combinations
+        self.supertagging_levels = supertagging_levels
 
     def _get_ktop_sorted_scores_for_possible_cats(
         self,
         pretokenized_sent: List[str],
         representations: SupertaggingRepresentations
-    ) -> List[List[Tuple[Category, 'log_p']]]:
-        # get ktop categories and their negative log probabilities for each word
+    ) -> List[List[Tuple[CategoryId, 'log_p']]]:
+        # get ktop category ids and their negative log probabilities for each word
         # (only keep categories whose probabilities are greater than 0)
         # after applying supertagging pruning (beta)
-        if self.apply_supertagging_pruning:
-            representations = self._prune_supertagging_results(representations)
-
-        results = list()
-        for i in range(len(pretokenized_sent)):
-
-            topk_ps, topk_ids = torch.topk(representations[i], self.top_k)
-            topk_ids = topk_ids[topk_ps > 0]
-            topk_ps = topk_ps[topk_ps > 0]
-
-            sorted_possible_cats_with_scores = [
-                [
-                    Category.parse(self.idx2tag[int(idx.item())]),
-                    -np.log(float(p))
-                ]
-                for (p, idx) in zip(topk_ps, topk_ids)
-            ]
-            results.append(sorted_possible_cats_with_scores)
-
-        return results
-
-    def _prune_supertagging_results(
-        self, representations: SupertaggingRepresentations
-    ) -> SupertaggingRepresentations:
-
-        for i in range(representations.shape[0]):
-            top_p = torch.topk(representations[i], 1)[0]
-            binarized = (representations[i] > self.beta * top_p)
-            representations[i] = representations[i] * binarized
-
-        return representations
+        return [
+            list(zip(category_ids.tolist(), (-np.log(ps)).tolist()))
+            for (category_ids, ps) in self._get_ktop_category_ids_with_probs(representations)
+        ]
 
-    def batch_decode(
+    def _prepare_batch(
         self,
         pretokenized_sents: List[List[str]],
         batch_representations: List[SupertaggingRepresentations]
-    ) -> List[Chart]:
+    ) -> List[SupertaggingRepresentations]:
 
+        self.stats = list()
         if self.apply_cat_filtering:
+            if self.category_filters is None:
+                self.category_filters = build_category_filters(
+                    category2idx=self.tag2idx,
+                    category_dict=self.cat_dict
+                )
             batch_representations = apply_category_filters(
                 pretokenized_sents=pretokenized_sents,
                 batch_representations=batch_representations,
-                category2idx=self.tag2idx,
-                category_dict=self.cat_dict
+                category_filters=self.category_filters
             )  # to assign 0 to probabilities of all impossible categories for each word
-
-        charts = list()
-        for i in range(len(pretokenized_sents)):
-            charts.append(
-                self.decode(pretokenized_sents[i], batch_representations[i])
-            )
-        return charts
+        return batch_representations
 
     def decode(
         self,
@@ -336,50 +413,170 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
         representations: SupertaggingRepresentations
     ) -> Chart:
 
-        t0 = time.time()
+        budget = WorkBudget(
+            timeout=self.timeout,
+            max_pops=self.max_pops,
+            max_combinations=self.max_combinations
+        )
+        stats = {
+            'n_supertagging_levels': 0,
+            'n_pops': 0,
+            'n_combinations': 0,
+            'peak_agenda_size': 0,
+            'peak_cell_items': 0,
+            'n_chart_items': 0,
+            'n_evicted_items': 0,
+            'stop_reason': None
+        }
+        self.stats.append(stats)
+
+        agenda = None
+        chart = None
+        for tokens in self._get_tokens_of_supertagging_levels(pretokenized_sent, representations):
+            # initialization
+            tokens = self._prune_tokens(tokens)
+            if tokens is None:
+                stats['stop_reason'] = 'unreachable'
+                continue
+            if agenda is None:
+                agenda = Agenda(tokens, max_size=self.max_agenda_size)
+                chart = AStarChart(
+                    l_sent=len(pretokenized_sent),
+                    idx2tag=self.idx2tag
+                )
+            else:
+                # extend the agenda with the newly admitted categories only,
+                # which never lowers the best category score of any word,
+                # while the chart is kept as it is
+                agenda.insert_tokens(
+                    [
+                        ktop[len(admitted):]
+                        for ktop, admitted in zip(tokens, agenda.tokens)
+                    ]
+                )
+            stats['n_supertagging_levels'] += 1
+            stats['peak_agenda_size'] = max(stats['peak_agenda_size'], len(agenda))
+
+            stats['stop_reason'] = self._search(agenda, chart, budget, stats)
+            if stats['stop_reason'] != 'exhausted':
+                break
 
-        ktop_sorted_cats_with_scores = self._get_ktop_sorted_scores_for_possible_cats(
-            pretokenized_sent, representations
+        stats['n_pops'] = budget.n_pops
+        stats['n_combinations'] = budget.n_combinations
+        if agenda is not None:
+            stats['n_chart_items'] = chart.n_items
+            stats['n_evicted_items'] += agenda.n_evicted
+        if stats['stop_reason'] == 'goal':
+            return chart
+        return None
+
+    def _get_tokens_of_supertagging_levels(
+        self,
+        pretokenized_sent: List[str],
+        representations: SupertaggingRepresentations
+    ) -> List[List[List[Dict[str, Any]]]]:
+        # get the tokens along with their ktop categories and scores of each word
+        # for each supertagging level, from the tightest to the loosest one,
+        # the categories of each level extending those of the previous one
+        if self.supertagging_levels is None:
+            ktop_sorted_cats_with_scores = self._get_ktop_sorted_scores_for_possible_cats(
+                pretokenized_sent, representations
+            )
+            return [
+                [
+                    [
+                        {
+                            'token': Token(contents=word, tag=Category.from_id(cat_with_score[0])),
+                            'score': cat_with_score[1]
+                        }
+                        for cat_with_score in ktop
+                    ]
+                    for (word, ktop) in zip(pretokenized_sent, ktop_sorted_cats_with_scores)
+                ]
+            ]
+
+        max_k = min(
+            max(top_k for _, top_k in self.supertagging_levels), representations.shape[1]
         )
-        tokens = [
+        topk_ps, topk_ids = torch.topk(representations, max_k, dim=1)
+        topk_ps = topk_ps.cpu().numpy().astype(np.float64)
+        topk_category_ids = self.idx2category_id[topk_ids.cpu().numpy()]
+        with np.errstate(divide='ignore'):
+            topk_scores = -np.log(topk_ps)
+
+        loosest_tokens = [
             [
                 {
-                    'token': Token(contents=word, tag=cat_with_score[0]),
-                    'score': cat_with_score[1]
+                    'token': Token(contents=word, tag=Category.from_id(category_id)),
+                    'score': score
                 }
-                for cat_with_score in ktop
+                for category_id, score in zip(category_ids, scores)
             ]
-            for (word, ktop) in zip(pretokenized_sent, ktop_sorted_cats_with_scores)
+            for (word, category_ids, scores) in zip(
+                pretokenized_sent, topk_category_ids.tolist(), topk_scores.tolist()
+            )
         ]
 
-        # initialization
-        agenda = Agenda(tokens)
-        chart = AStarChart(
-            l_sent=len(pretokenized_sent),
-            idx2tag=self.idx2tag
-        )
+        levels = list()
+        for beta, top_k in self.supertagging_levels:
+            # the number of categories kept for each word,
+            # i.e. those within top_k whose probabilities are greater than beta of the best one
+            n_kept = np.minimum(
+                (topk_ps > beta * topk_ps[:, :1]).sum(axis=1), top_k
+            ).tolist()
+            levels.append(
+                [ktop[:n] for ktop, n in zip(loosest_tokens, n_kept)]
+            )
+        return levels
 
-        # A* parsing
+    def _search(
+        self,
+        agenda: Agenda,
+        chart: AStarChart,
+        budget: WorkBudget,
+        stats: Dict[str, Any]
+    ) -> str:
+        # A* parsing until the goal is found or the agenda is exhausted,
+        # return the reason for stopping
         while True:
-            # print(agenda)
-            if (time.time() - t0) >= self.timeout:
-                return None
-
             if agenda._is_empty:
-                return None
+                return 'exhausted'
+
+            if not budget.spend_pop():
+                return budget.stop_reason
 
             current = agenda.pop()
+            # the whole-sentence span is never capped,
+            # so that non-root items filling it first never shut out the goal
+            if (
+                self.max_cell_items is not None
+                and current.start_end != (0, chart.l)
+                and chart.n_cell_items(*current.start_end) >= self.max_cell_items
+            ):
+                stats['n_evicted_items'] += 1
+                continue
             chart.insert(current)
-            if chart._is_completed:
-                return chart
+            stats['peak_cell_items'] = max(
+                stats['peak_cell_items'], chart.n_cell_items(*current.start_end)
+            )
+            if self._is_goal(chart, current):
+                return 'goal'
+            if self.max_chart_items is not None and chart.n_items >= self.max_chart_items:
+                return 'max_chart_items'
 
             results = list()
             results.extend(self._apply_unary_rules(current))
-            results.extend(self._forward_fundamental(agenda, chart, current))
-            results.extend(self._backward_fundamental(agenda, chart, current))
+            results.extend(self._forward_fundamental(agenda, chart, current, budget))
+            results.extend(self._backward_fundamental(agenda, chart, current, budget))
+            if budget._is_exhausted:
+                return budget.stop_reason
 
             for new_cell_item in results:
-                agenda.insert(new_cell_item)
+                if self._is_reachable(
+                    new_cell_item.tag, *new_cell_item.start_end, chart.l
+                ):
+                    agenda.insert(new_cell_item)
+            stats['peak_agenda_size'] = max(stats['peak_agenda_size'], len(agenda))
 
     def sanity_check(
         self,
@@ -397,13 +594,16 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
             [{
                 'token': Token(
                     contents=token,
-                    tag=Category.parse(golden_supertag)
+                    tag=Category.intern(golden_supertag)
                 ),
                 'score': 0.0
             }]
             for (token, golden_supertag) in zip(pretokenized_sent, golden_supertags)
         ]
 
+        tokens = self._prune_tokens(tokens)
+        if tokens is None:
+            return None
         agenda = Agenda(tokens)
         chart = AStarChart(
             l_sent=len(pretokenized_sent),
@@ -419,7 +619,7 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
             chart.insert(current)
             if print_cell_items:
                 chart._print_cell_items()
-            if chart._is_completed:
+            if self._is_goal(chart, current):
                 return chart
 
             results = list()
@@ -428,7 +628,7 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
             if print_cell_items:
                 print(
                     'unary',
-                    [str(result.constituent) for result in results]
+                    [str(result.tag) for result in results]
                 )
 
             results.extend(self._forward_fundamental(agenda, chart, current))
@@ -436,7 +636,7 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
             if print_cell_items:
                 print(
                     'forward',
-                    [str(result.constituent) for result in results]
+                    [str(result.tag) for result in results]
                 )
 
             results.extend(self._backward_fundamental(agenda, chart, current))
@@ -444,35 +644,69 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
             if print_cell_items:
                 print(
                     'backward',
-                    [str(result.constituent) for result in results]
+                    [str(result.tag) for result in results]
                 )
 
             for new_cell_item in results:
-                agenda.insert(new_cell_item)
+                if self._is_reachable(
+                    new_cell_item.tag, *new_cell_item.start_end, chart.l
+                ):
+                    agenda.insert(new_cell_item)
 
             if print_cell_items:
                 print(
                     'agenda',
-                    [str(cell_item.constituent) for cell_item in agenda.cell_items],
+                    [str(cell_item.tag) for cell_item in agenda.cell_items],
                     '\n'
                 )
 
+    def _prune_tokens(
+        self, tokens: List[List[Dict[str, Any]]]
+    ) -> Optional[List[List[Dict[str, Any]]]]:
+        # discard the categories of each word which can never reach possible roots,
+        # None if no category is left for some word
+        if self.reachability is None:
+            return tokens
+        pruned_tokens = list()
+        for idx, ktop in enumerate(tokens):
+            ktop = [
+                token for token in ktop
+                if self._is_reachable(token['token'].tag, idx, idx + 1, len(tokens))
+            ]
+            if not ktop:
+                return None
+            pruned_tokens.append(ktop)
+        return pruned_tokens
+
+    @staticmethod
+    def _get_leaf_cost(cell_item: AStarCellItem) -> float:
+        # the inside scores of leaf cell items are already negative log probabilities
+        return cell_item.inside_score
+
+    def _is_goal(self, chart: AStarChart, current: AStarCellItem) -> bool:
+        # whether the current cell item just inserted completes the parse
+        if self.possible_root_ids is None:
+            return chart._is_completed
+        return (
+            current.start_end == (0, chart.l)
+            and isinstance(current.tag, Atom)
+            and current.tag.id in self.possible_root_ids
+        )
+
     def _apply_unary_rules(self, current: AStarCellItem):
         results = list()
-        if current.constituent.tag in self.apply_instantiated_unary_rules:
+        if current.tag.key_id in self.apply_instantiated_unary_rules:
             results.extend(
                 [
                     AStarCellItem(
                         start_end=current.start_end,
                         inside_score=current.inside_score,
                         outside_score=current.outside_score,
-                        constituent=ConstituentNode(
-                            tag=tag['result_cat'],
-                            children=[current.constituent],
-                            used_rule=tag['used_rule']
-                        )
+                        tag=tag['result_cat'],
+                        left=current,
+                        rule_id=tag['rule_id']
                     )
-                    for tag in self.apply_instantiated_unary_rules[current.constituent.tag]
+                    for tag in self.apply_instantiated_unary_rules[current.tag.key_id]
                 ]
             )
         return results
@@ -481,82 +715,83 @@ class CCGAStarDecoder(Decoder):  # for testing directly, no need to train
         self,
         agenda: Agenda,
         chart: Chart,
-        current: AStarCellItem
+        current: AStarCellItem,
+        budget: Optional[WorkBudget] = None
     ):
         # find all combinable cell items
         # starting with the end of the current cell item
         # and return the combined results
         results = list()
         start, end = current.start_end
-        for j in range(end + 1, chart.l + 1):
-            if chart.chart[end][j].cell_items is not None:
-                for to_combined in chart.chart[end][j].cell_items:
-                    if current.constituent.tag in self.apply_instantiated_binary_rules:
-                        if to_combined.constituent.tag in self.apply_instantiated_binary_rules[current.constituent.tag]:
-                            for result in self.apply_instantiated_binary_rules[current.constituent.tag][to_combined.constituent.tag]:
-                                if self._check_constraints(current.constituent, to_combined.constituent, result['used_rule']):
-                                    inside_score, outside_score = self._get_score(
-                                        current, to_combined, agenda.minimun_costs
-                                    )
-                                    new_item = AStarCellItem(
-                                        start_end=(start, j),
-                                        inside_score=inside_score,
-                                        outside_score=outside_score,
-                                        constituent=ConstituentNode(
-                                            tag=result['result_cat'],
-                                            children=[
-                                                current.constituent,
-                                                to_combined.constituent
-                                            ],
-                                            used_rule=result['used_rule']
-                                        )
-                                    )
-                                    results.append(new_item)
+        partners = self._get_partners(self.right_partners, current)
+        if partners is not None and not partners:
+            return results
+        for j, _, to_combined in _join(chart.items_starting_at[end], partners):
+            if budget is not None and not budget.spend_combination():
+                break
+            for result in self._get_binary_rule_results(current, to_combined):
+                inside_score, outside_score = self._get_score(
+                    current, to_combined, agenda
+                )
+                new_item = AStarCellItem(
+                    start_end=(start, j),
+                    inside_score=inside_score,
+                    outside_score=outside_score,
+                    tag=result['result_cat'],
+                    left=current,
+                    right=to_combined,
+                    rule_id=result['rule_id']
+                )
+                results.append(new_item)
         return results
 
     def _backward_fundamental(
         self,
         agenda: Agenda,
         chart: Chart,
-        current: AStarCellItem
+        current: AStarCellItem,
+        budget: Optional[WorkBudget] = None
     ):
         # find all combinable cell items
         # ending with the start of the current cell item
         # and return the combined results
         results = list()
         start, end = current.start_end
-        for i in range(0, start):
-            if chart.chart[i][start].cell_items is not None:
-                for to_combined in chart.chart[i][start].cell_items:
-                    if to_combined.constituent.tag in self.apply_instantiated_binary_rules:
-                        if current.constituent.tag in self.apply_instantiated_binary_rules[to_combined.constituent.tag]:
-                            for result in self.apply_instantiated_binary_rules[to_combined.constituent.tag][current.constituent.tag]:
-                                if self._check_constraints(to_combined.constituent, current.constituent, result['used_rule']):
-                                    inside_score, outside_score = self._get_score(
-                                        to_combined, current, agenda.minimun_costs
-                                    )
-                                    new_item = AStarCellItem(
-                                        start_end=(i, end),
-                                        inside_score=inside_score,
-                                        outside_score=outside_score,
-                                        constituent=ConstituentNode(
-                                            tag=result['result_cat'],
-                                            children=[
-                                                to_combined.constituent,
-                                                current.constituent
-                                            ],
-                                            used_rule=result['used_rule']
-                                        )
-                                    )
-                                    results.append(new_item)
+        partners = self._get_partners(self.left_partners, current)
+        if partners is not None and not partners:
+            return results
+        for i, _, to_combined in _join(chart.items_ending_at[start], partners):
+            if budget is not None and not budget.spend_combination():
+                break
+            for result in self._get_binary_rule_results(to_combined, current):
+                inside_score, outside_score = self._get_score(
+                    to_combined, current, agenda
+                )
+                new_item = AStarCellItem(
+                    start_end=(i, end),
+                    inside_score=inside_score,
+                    outside_score=outside_score,
+                    tag=result['result_cat'],
+                    left=to_combined,
+                    right=current,
+                    rule_id=result['rule_id']
+                )
+                results.append(new_item)
         return results
 
+    def _get_partners(
+        self,
+        partners: Dict[CategoryId, FrozenSet[CategoryId]],
+        current: AStarCellItem
+    ) -> Optional[FrozenSet[CategoryId]]:
+        # the key ids of the categories the current one can combine with,
+        # or None for all categories if binary rules are applied on the fly to unseen pairs
+        if self.apply_binary_rule_fallback:
+            return None
+        return partners.get(current.tag.key_id, _NO_PARTNERS)
+
     @staticmethod
-    def _get_score(left: AStarCellItem, right: AStarCellItem, minimum_costs: np.array) -> Tuple[float, float]:
+    def _get_score(left: AStarCellItem, right: AStarCellItem, agenda: Agenda) -> Tuple[float, float]:
         inside_score = left.inside_score + right.inside_score
-        outside_score = sum(
-            np.concatenate(
-                (minimum_costs[:left.start_end[0]], minimum_costs[right.start_end[1]:])
-            )
-        )
+        outside_score = agenda.get_outside_score(left.start_end[0], right.start_end[1])
         return inside_score, outside_score
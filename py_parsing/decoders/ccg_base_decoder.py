@@ -1,63 +1,19 @@
 import sys
 import time
-from typing import TypeVar, List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional, Iterator
 import torch
 import numpy as np
-import bisect
+import heapq
 
 sys.path.append('..')
 from ccg_parsing_models import SupertaggingRepresentations
-from decoders.decoder import Decoder, Chart, CellItem
+from decoders.decoder import (
+    Decoder, Chart, CellItem, CategoryId, WorkBudget, _NO_PARTNERS,
+    build_category_filters, apply_category_filters
+)
 
 sys.path.append('../..')
-from base import Token, Category, ConstituentNode
-import ccg_rules
-
-
-CategoryStr = TypeVar('CategoryStr')
-RuleName = TypeVar('RuleName')
-InstantiatedUnaryRule = Tuple[CategoryStr, CategoryStr, RuleName]
-InstantiatedBinaryRule = Tuple[CategoryStr, CategoryStr, List[Tuple[CategoryStr, RuleName]]]
-
-
-def _binarize(ids, length):  # to assign 0 to all designated positions
-    result = np.ones(length, dtype=np.bool)
-    result[ids] = 0
-    return result
-
-
-def apply_category_filters(
-    pretokenized_sents: List[List[str]],
-    batch_representations: List[SupertaggingRepresentations],
-    category2idx: Dict[str, int],
-    category_dict: Dict[str, List[str]]
-) -> List[SupertaggingRepresentations]:
-    """
-    Input:
-        pretokenized_sents - a list of pretokenized sentences, each of which is a list of strings
-        batch_representations - a list of tensors, each of shape l_sent * C
-        category2idx - a dictionary mapping a category string to its index
-        category_dict - a dictionary mapping a word to its allowed categories
-    Output:
-        filtered batch_representations
-        (apply the category filter to pretokenized_sents so that for each word, 
-        only categories allowed for this word in the category_dict
-        keep their scores in batch_representations)
-    """
-    category_dict = {
-        word: _binarize(
-            [category2idx[cat] for cat in cats],
-            batch_representations[0].shape[1]
-        )
-        for word, cats in category_dict.items()
-    }
-
-    for tokens, representations in zip(pretokenized_sents, batch_representations):
-        for index, token in enumerate(tokens):
-            if token in category_dict:
-                representations[index, category_dict[token]] = 0
-
-    return batch_representations
+from base import Token, Category
 
 
 class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
@@ -66,18 +22,27 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
         self,
         beam_width: int,
         idx2tag: Dict[int, str],
-        cat_dict: Dict[str, List[str]],
+        cat_dict: Optional[Dict[str, List[str]]],
         top_k: int = 3,
         apply_supertagging_pruning: bool = True,
         beta: float = 0.00001,
         timeout: float = 4.0,
-        apply_cat_filtering: bool = False
+        apply_cat_filtering: bool = False,
+        apply_binary_rule_fallback: bool = False,
+        binary_rule_cache_size: int = 2**16,
+        binary_rule_cache_dir: Optional[str] = None,
+        possible_roots: Optional[List[str]] = None,
+        apply_reachability_pruning: bool = False,
+        max_combinations: Optional[int] = None,
+        apply_viterbi_merging: bool = False,
+        apply_cube_pruning: bool = False
     ):
         """
         Params:
             beam_width - set the beam width during beam decoding
             idx2tag - a dictionary mapping an index to a category string
-            cat_dict - a dictionary mapping a word to its allowed categories
+            cat_dict - a dictionary mapping a word to its allowed categories,
+                       None if loaded from a compiled grammar (see _load_grammar)
             top_k - maximum number of categories allowed for each word
             apply_supertagging_pruning - used for beta
             beta - cut all categories whose probabilities
@@ -85,10 +50,36 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
                    this speed up parsing substantially
             timeout - maximum time allowable for each parse, otherwise return a null parse
             apply_cat_filtering - used for category filtering
+            apply_binary_rule_fallback - whether to apply the binary rules on the fly
+                                         to category pairs unseen in the instantiated rules
+            binary_rule_cache_size - maximum number of unseen pairs whose results are cached
+            binary_rule_cache_dir - the file to load the cache from (if existing)
+                                    and to save it to, not persisted if None
+            possible_roots - allowable categories at the root of each parse,
+                             only used for reachability pruning
+            apply_reachability_pruning - whether to discard cell items whose categories
+                                         can never reach possible_roots from their positions
+            max_combinations - maximum number of cell item pairs tried with binary rules
+                               for each sentence, otherwise return a null parse,
+                               None for no limit (see WorkBudget)
+            apply_viterbi_merging - whether to keep only the best cell item
+                                    of each category and normal-form state in each cell,
+                                    so that items differing only in derivation
+                                    never take up the beam, the others being kept
+                                    only as backpointers (see Cell.merged_items)
+            apply_cube_pruning - whether to try the cell item pairs of each span
+                                 from the highest summed score and stop once the beam is full,
+                                 which gives the same cell items as trying all pairs
+                                 as the score of a new cell item is the sum of its children's
         """
         super().__init__(
             top_k=top_k,
-            idx2tag=idx2tag
+            idx2tag=idx2tag,
+            apply_binary_rule_fallback=apply_binary_rule_fallback,
+            binary_rule_cache_size=binary_rule_cache_size,
+            binary_rule_cache_dir=binary_rule_cache_dir,
+            possible_roots=possible_roots,
+            apply_reachability_pruning=apply_reachability_pruning
         )
         self.beam_width = beam_width
         self.cat_dict = cat_dict
@@ -96,95 +87,42 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
         self.beta = beta
         self.timeout = timeout
         self.apply_cat_filtering = apply_cat_filtering
-
-    def _get_instantiated_unary_rules(
-        self,
-        instantiated_unary_rules: List[InstantiatedUnaryRule]
-    ):
-        # get instantiated_unary_rules from a specific file
-        self.apply_instantiated_unary_rules = dict()
-        for instantiated_unary_rule in instantiated_unary_rules:
-            initial_cat = Category.parse(instantiated_unary_rule[0])
-            final_cat = Category.parse(instantiated_unary_rule[1])
-            if initial_cat not in self.apply_instantiated_unary_rules:
-                self.apply_instantiated_unary_rules[initial_cat] = list()
-            self.apply_instantiated_unary_rules[initial_cat].append(
-                {
-                    'result_cat': final_cat,
-                    'used_rule': instantiated_unary_rule[2]
-                }
-            )
-
-    def _get_instantiated_binary_rules(
-        self,
-        instantiated_binary_rules: List[InstantiatedBinaryRule]
-    ):
-        # get instantiated_binary_rules from a specific file
-        self.apply_instantiated_binary_rules = dict()
-        for instantiated_binary_rule in instantiated_binary_rules:
-            left_cat = Category.parse(instantiated_binary_rule[0])
-            if left_cat not in self.apply_instantiated_binary_rules:
-                self.apply_instantiated_binary_rules[left_cat] = dict()
-            right_cat = Category.parse(instantiated_binary_rule[1])
-            if right_cat not in self.apply_instantiated_binary_rules[left_cat]:
-                self.apply_instantiated_binary_rules[left_cat][right_cat] = list()
-            for result in instantiated_binary_rule[2]:
-                self.apply_instantiated_binary_rules[left_cat][right_cat].append(
-                    {
-                        'result_cat': Category.parse(result[0]),
-                        'used_rule': result[1]
-                    }
-                )
+        self.max_combinations = max_combinations
+        self.apply_viterbi_merging = apply_viterbi_merging
+        self.apply_cube_pruning = apply_cube_pruning
 
     def _get_ktop_sorted_scores_for_possible_cats(
         self,
         pretokenized_sent: List[str],
         representations: SupertaggingRepresentations
-    ) -> List[List[Tuple[Category, 'log_p']]]:
-        # get ktop categories and their log probabilities for each word
+    ) -> List[List[Tuple[CategoryId, 'log_p']]]:
+        # get ktop category ids and their log probabilities for each word
         # (only keep categories whose probabilities are greater than 0)
         # after applying supertagging pruning (beta)
-        if self.apply_supertagging_pruning:
-            representations = self._prune_supertagging_results(representations)
-
-        results = list()
-        for i in range(len(pretokenized_sent)):
-
-            topk_ps, topk_ids = torch.topk(representations[i], self.top_k)
-            topk_ids = topk_ids[topk_ps > 0]
-            topk_ps = topk_ps[topk_ps > 0]
-
-            sorted_possible_cats_with_scores = [
-                [
-                    Category.parse(self.idx2tag[idx.item()]),
-                    np.log(float(p))
-                ]
-                for (p, idx) in zip(topk_ps, topk_ids)
-            ]
-            results.append(sorted_possible_cats_with_scores)
-
-        return results
+        return [
+            list(zip(category_ids.tolist(), (np.log(ps)).tolist()))
+            for (category_ids, ps) in self._get_ktop_category_ids_with_probs(representations)
+        ]
 
-    def batch_decode(
+    def _prepare_batch(
         self,
         pretokenized_sents: List[List[str]],
         batch_representations: List[SupertaggingRepresentations]
-    ) -> List[Chart]:
+    ) -> List[SupertaggingRepresentations]:
 
+        self.stats = list()
         if self.apply_cat_filtering:
+            if self.category_filters is None:
+                self.category_filters = build_category_filters(
+                    category2idx=self.tag2idx,
+                    category_dict=self.cat_dict
+                )
             batch_representations = apply_category_filters(
                 pretokenized_sents=pretokenized_sents,
                 batch_representations=batch_representations,
-                category2idx=self.tag2idx,
-                category_dict=self.cat_dict
+                category_filters=self.category_filters
             )  # to assign 0 to probabilities of all impossible categories for each word
-
-        charts = list()
-        for i in range(len(pretokenized_sents)):
-            charts.append(
-                self.decode(pretokenized_sents[i], batch_representations[i])
-            )
-        return charts
+        return batch_representations
 
     def decode(
         self,
@@ -192,7 +130,9 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
         representations: SupertaggingRepresentations
     ) -> Chart:
 
-        t0 = time.time()
+        budget = WorkBudget(timeout=self.timeout, max_combinations=self.max_combinations)
+        stats = {'n_combinations': 0, 'stop_reason': None}
+        self.stats.append(stats)
         chart = Chart(
             l_sent=len(pretokenized_sent),
             idx2tag=self.idx2tag
@@ -205,7 +145,7 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
         tokens = [
             [
                 {
-                    'token': Token(contents=word, tag=cat_with_score[0]),
+                    'token': Token(contents=word, tag=Category.from_id(cat_with_score[0])),
                     'score': cat_with_score[1]
                 }
                 for cat_with_score in ktop
@@ -218,14 +158,22 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
             self._apply_token_ops(chart, tokens, i)
             # apply rules to span[i][i+1]
 
-            if (time.time() - t0) >= self.timeout:
-                return None
+            if not budget.check_deadline():
+                break
 
             for k in range(i - 1, -1, -1):
                 # t0 = time.time()
-                self._apply_span_ops(chart, k, i + 1)  # apply rules to [k][i+1]
+                self._apply_span_ops(chart, k, i + 1, budget)  # apply rules to [k][i+1]
                 # print(f'applying binary rules - span[{k}][{i+1}]: {time.time()-t0}s')
-
+                if budget._is_exhausted:
+                    break
+            if budget._is_exhausted:
+                break
+
+        stats['n_combinations'] = budget.n_combinations
+        stats['stop_reason'] = budget.stop_reason or 'completed'
+        if budget._is_exhausted:
+            return None
         return chart
 
     def sanity_check(
@@ -249,7 +197,7 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
             [{
                 'token': Token(
                     contents=token,
-                    tag=Category.parse(golden_supertag)
+                    tag=Category.intern(golden_supertag)
                 ),
                 'score': 0.0
             }]
@@ -262,7 +210,7 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
                 print(
                     f'span[{i}][{i+1}]',
                     [
-                        str(cell_item.constituent.tag)
+                        str(cell_item.tag)
                         for cell_item in chart.chart[i][i+1].cell_items
                     ]
                 )
@@ -273,7 +221,7 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
                     print(
                         f'span[{k}][{i+1}]',
                         [
-                            str(cell_item.constituent.tag)
+                            str(cell_item.tag)
                             for cell_item in chart.chart[k][i+1].cell_items
                         ]
                     )
@@ -288,95 +236,210 @@ class CCGBaseDecoder(Decoder):  # for testing directly, no need to train
 
         results = [
             CellItem(
-                constituent=ConstituentNode(
-                    tag=tokens[i][j]['token'].tag,
-                    children=[tokens[i][j]['token']]
-                ),
+                tag=tokens[i][j]['token'].tag,
+                left=tokens[i][j]['token'],
                 score=tokens[i][j]['score']
             )
             for j in range(len(tokens[i]))
+            if self._is_reachable(tokens[i][j]['token'].tag, i, i + 1, chart.l)
         ]
 
-        results.extend(self._apply_unary_rules(results))
+        results.extend(
+            result for result in self._apply_unary_rules(results)
+            if self._is_reachable(result.tag, i, i + 1, chart.l)
+        )
+        if self.apply_viterbi_merging:
+            results, chart.chart[i][i + 1].merged_items = self._merge_equivalent_items(results)
         chart.chart[i][i + 1].cell_items = results
 
     # i - start position, k - end position
-    def _apply_span_ops(self, chart: Chart, i: int, k: int):
+    def _apply_span_ops(self, chart: Chart, i: int, k: int, budget: Optional[WorkBudget] = None):
         if not chart.chart[i][k]._is_null:
             raise ValueError(f'Cell[{i}][{k}] has been taken up, please check!')
-        results = list()
-
-        for j in range(i + 1, k):
-            for left in chart.chart[i][j].cell_items:
-                for right in chart.chart[j][k].cell_items:
-                    for new_item in self._apply_binary_rules(left, right):
-                        bisect.insort(results, new_item, key=lambda x: x.score)
-
-        if len(results)-1-self.beam_width >= 0:
-            results = results[-1: len(results)-1-self.beam_width: -1]
+        # a min-heap of (score, order, cell item) keeping the best beam_width cell items,
+        # the later ones (in the order of enumerating all pairs) coming first among equal scores,
+        # so that a new cell item below the lowest score in a full beam is never built
+        beam = list()
+        results = list()  # (score, order, cell item) of all cell items, only kept for Viterbi merging
+        merged_ids = set()  # the constituents found, only kept for Viterbi merging with cube pruning
+        min_score = -float('inf')  # no more cell items below it can enter the beam
+
+        if self.apply_cube_pruning:
+            pairs = self._get_pairs_best_first(chart, i, k)
+        else:
+            pairs = self._get_pairs(chart, i, k)
+        for pair_order, left, right in pairs:
+            if self.apply_cube_pruning and left.score + right.score < min_score:
+                break  # all the pairs left have lower scores
+            if budget is not None and not budget.spend_combination():
+                return  # the cell is left empty as decoding stops
+            if left.score + right.score < min_score:
+                continue
+            for idx, new_item in enumerate(self._apply_binary_rules(left, right, i, k, chart.l)):
+                if self.apply_viterbi_merging:
+                    results.append((new_item.score, (pair_order, idx), new_item))
+                    if self.apply_cube_pruning and len(merged_ids) < self.beam_width:
+                        # as pairs come from the highest score, the score of
+                        # the beam_width-th distinct constituent is the lowest in the beam
+                        merged_ids.add(
+                            (
+                                new_item.tag.id,
+                                self._get_normal_form_state(new_item.rule_id)
+                            )
+                        )
+                        if len(merged_ids) == self.beam_width:
+                            min_score = new_item.score
+                elif len(beam) < self.beam_width:
+                    heapq.heappush(beam, (new_item.score, (pair_order, idx), new_item))
+                    if len(beam) == self.beam_width:
+                        min_score = beam[0][0]
+                elif (new_item.score, (pair_order, idx)) > beam[0][:2]:
+                    heapq.heapreplace(beam, (new_item.score, (pair_order, idx), new_item))
+                    min_score = beam[0][0]
+
+        if self.apply_viterbi_merging:
+            # merge all cell items before taking the best beam_width ones of distinct constituents
+            results, merged_items = self._merge_equivalent_items(
+                [cell_item for _, _, cell_item in sorted(results, key=lambda x: x[:2], reverse=True)],
+                self.beam_width
+            )
         else:
-            results = results[-1::-1]
+            results = [cell_item for _, _, cell_item in sorted(beam, key=lambda x: x[:2], reverse=True)]
 
-        results.extend(self._apply_unary_rules(results))
+        results.extend(
+            result for result in self._apply_unary_rules(results)
+            if self._is_reachable(result.tag, i, k, chart.l)
+        )
+        if self.apply_viterbi_merging:
+            results, unary_merged_items = self._merge_equivalent_items(results)
+            chart.chart[i][k].merged_items = unary_merged_items + merged_items
         chart.chart[i][k].cell_items = results
 
+    @staticmethod
+    def _get_pairs(chart: Chart, i: int, k: int) -> Iterator[Tuple[int, CellItem, CellItem]]:
+        # (order, left, right) of all cell item pairs over all split positions of span[i][k]
+        order = 0
+        for _, left_items, right_items in chart.iter_splits(i, k):
+            for left in left_items:
+                for right in right_items:
+                    yield order, left, right
+                    order += 1
+
+    def _get_pairs_best_first(
+        self, chart: Chart, i: int, k: int
+    ) -> Iterator[Tuple[int, CellItem, CellItem]]:
+        # (order, left, right) of the cell item pairs over all split positions of span[i][k]
+        # from the highest summed score, with the same order as _get_pairs,
+        # exploring the grid of each split position (i.e. cube pruning)
+        # from its best pair through a shared priority queue,
+        # where each pair is reached only from the one above it (or on its left in the first row),
+        # leaving out the cell items combinable with none on the other side
+        grids = list()
+        queue = list()  # (-score, grid index, left rank, right rank)
+        offset = 0
+        for _, left_items, right_items in chart.iter_splits(i, k):
+            lefts = list(enumerate(left_items))
+            rights = list(enumerate(right_items))
+            n_pairs = len(lefts) * len(rights)
+            if not self.apply_binary_rule_fallback:
+                left_key_ids = {cell_item.tag.key_id for _, cell_item in lefts}
+                right_key_ids = {cell_item.tag.key_id for _, cell_item in rights}
+                lefts = [
+                    (idx, cell_item) for idx, cell_item in lefts
+                    if not self.right_partners.get(
+                        cell_item.tag.key_id, _NO_PARTNERS
+                    ).isdisjoint(right_key_ids)
+                ]
+                rights = [
+                    (idx, cell_item) for idx, cell_item in rights
+                    if not self.left_partners.get(
+                        cell_item.tag.key_id, _NO_PARTNERS
+                    ).isdisjoint(left_key_ids)
+                ]
+            lefts.sort(key=lambda x: x[1].score, reverse=True)
+            rights.sort(key=lambda x: x[1].score, reverse=True)
+            if lefts and rights:
+                grids.append(
+                    (
+                        lefts, rights,
+                        [cell_item.score for _, cell_item in lefts],
+                        [cell_item.score for _, cell_item in rights],
+                        offset,
+                        len(right_items)
+                    )
+                )
+                queue.append((-lefts[0][1].score - rights[0][1].score, len(grids) - 1, 0, 0))
+            offset += n_pairs
+        heapq.heapify(queue)
+
+        while queue:
+            _, g, a, b = heapq.heappop(queue)
+            lefts, rights, left_scores, right_scores, offset, n_rights = grids[g]
+            yield offset + lefts[a][0] * n_rights + rights[b][0], lefts[a][1], rights[b][1]
+            if a + 1 < len(lefts):
+                heapq.heappush(queue, (-left_scores[a + 1] - right_scores[b], g, a + 1, b))
+            if a == 0 and b + 1 < len(rights):
+                heapq.heappush(queue, (-left_scores[0] - right_scores[b + 1], g, 0, b + 1))
+
+    def _merge_equivalent_items(
+        self, cell_items: List[CellItem], max_n_items: Optional[int] = None
+    ) -> Tuple[List[CellItem], List[CellItem]]:
+        # keep one cell item for each category and normal-form state,
+        # the one with the highest score (the earliest among equal ones)
+        # at the position of the earliest one, for at most max_n_items constituents (None for all),
+        # and return the others of the kept constituents as well,
+        # being only other derivations of them kept as backpointers for decoders.k_best
+        keys = [
+            (cell_item.tag.id, self._get_normal_form_state(cell_item.rule_id))
+            for cell_item in cell_items
+        ]
+        best_items = dict()
+        for key, cell_item in zip(keys, cell_items):
+            best_item = best_items.get(key)
+            if best_item is None or best_item.score < cell_item.score:
+                best_items[key] = cell_item
+        kept_items = {key: best_items[key] for key in list(best_items)[:max_n_items]}
+        merged_items = [
+            cell_item for key, cell_item in zip(keys, cell_items)
+            if key in kept_items and kept_items[key] is not cell_item
+        ]
+        return list(kept_items.values()), merged_items
+
     def _apply_unary_rules(self, cell_items: List[CellItem]) -> List[CellItem]:
         results = list()
         for cell_item in cell_items:
-            if cell_item.constituent.tag in self.apply_instantiated_unary_rules:
+            if cell_item.tag.key_id in self.apply_instantiated_unary_rules:
                 results.extend(
                     [
                         CellItem(
-                            constituent=ConstituentNode(
-                                tag=tag['result_cat'],
-                                children=[cell_item.constituent],
-                                used_rule=tag['used_rule']
-                            ),
+                            tag=tag['result_cat'],
+                            left=cell_item,
+                            rule_id=tag['rule_id'],
                             score=cell_item.score
                         )
-                        for tag in self.apply_instantiated_unary_rules[cell_item.constituent.tag]
+                        for tag in self.apply_instantiated_unary_rules[cell_item.tag.key_id]
                     ]
                 )
         return results
 
-    def _apply_binary_rules(self, left: CellItem, right: CellItem) -> List[CellItem]:
+    def _apply_binary_rules(
+        self, left: CellItem, right: CellItem, start: int, end: int, l_sent: int
+    ) -> List[CellItem]:
         results = list()
         # apply instantiated rules first,
-        # otherwise search for binary rules
-        # if one of the two constituents contains the X feature (disabled for now),
-        # otherwise no results
-        if left.constituent.tag in self.apply_instantiated_binary_rules:
-            if right.constituent.tag in self.apply_instantiated_binary_rules[left.constituent.tag]:
-                for result in self.apply_instantiated_binary_rules[left.constituent.tag][right.constituent.tag]:
-                    if self._check_constraints(left.constituent, right.constituent, result['used_rule']):
-                        new_item = CellItem(
-                            constituent=ConstituentNode(
-                                tag=result['result_cat'],
-                                children=[left.constituent, right.constituent],
-                                used_rule=result['used_rule']
-                            ),
-                            score=left.score + right.score
-                        )
-                        results.append(new_item)
-        #     else:
-        #         if left.constituent.tag.contain_X_feature or right.constituent.tag.contain_X_feature:
-        #             for binary_rule in ccg_rules.binary_rules:
-        #                 result = binary_rule(left.constituent, right.constituent)
-        #                 if result:
-        #                     new_item = CellItem(
-        #                         constituent = result,
-        #                         score = left.score + right.score
-        #                     )
-        #                     results.append(new_item)
-        # else:
-        #     if left.constituent.tag.contain_X_feature or right.constituent.tag.contain_X_feature:
-        #         for binary_rule in ccg_rules.binary_rules:
-        #             result = binary_rule(left.constituent, right.constituent)
-        #             if result:
-        #                 new_item = CellItem(
-        #                     constituent = result,
-        #                     score = left.score + right.score
-        #                 )
-        #                 results.append(new_item)
+        # otherwise apply binary rules on the fly (if enabled),
+        # otherwise no results,
+        # only building cell items which can reach the possible roots from span[start][end]
+        # (the results forbidden by the normal-form constraints are never looked up)
+        for result in self._get_binary_rule_results(left, right):
+            if self._is_reachable(result['result_cat'], start, end, l_sent):
+                new_item = CellItem(
+                    tag=result['result_cat'],
+                    left=left,
+                    right=right,
+                    rule_id=result['rule_id'],
+                    score=left.score + right.score
+                )
+                results.append(new_item)
 
         return results
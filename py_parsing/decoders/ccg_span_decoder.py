@@ -30,7 +30,7 @@ class CCGSpanDecoder(CCGBaseDecoder):
         
         tokens = data_item.tokens
         golden_tree = data_item.tree_root
-        golden_chart = Chart(l_sent = len(tokens), idx2tag = self.idx2tag)
+        golden_chart = SpanChart(l_sent = len(tokens), idx2tag = self.idx2tag)
         for i in range(golden_chart.l):
             for j in range(i + 1, golden_chart.l + 1):
                 golden_chart.chart[i][j].span_representation = representations[i, j]
@@ -144,7 +144,7 @@ class CCGSpanDecoder(CCGBaseDecoder):
             raise ValueError('Please specify the mode of CCGSpanDecoder!')
 
         # initialize the chart
-        chart = Chart(
+        chart = SpanChart(
             l_sent = len(pretokenized_sent),
             idx2tag = self.idx2tag
         )
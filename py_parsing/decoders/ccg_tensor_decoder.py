@@ -0,0 +1,567 @@
+import sys
+from typing import List, Tuple, Dict, Optional
+import numpy as np
+
+sys.path.append('..')
+from ccg_parsing_models import SupertaggingRepresentations
+from decoders.decoder import (
+    Chart, CellItem, CategoryId, WorkBudget,
+    _rule_names, _left_contexts, _right_contexts, _RIGHT_CONTEXT_RULES,
+    _allowed_rules, _normal_form_states
+)
+from decoders.ccg_base_decoder import CCGBaseDecoder
+
+sys.path.append('../..')
+from base import Token, Category
+
+
+# the split_ids of cell items not built by binary rules (whose split positions are positive)
+_LEXICAL = 0
+_UNARY = -1
+_ALL_REACHABLE = 15  # all bits of the reachability (see grammar.compute_reachability)
+
+
+class ArrayCell:
+
+    __slots__ = (
+        'category_ids', 'rule_ids', 'scores', 'split_ids', 'left_ids', 'right_ids',
+        'order', 'key_ids', 'visible_rule_ids', 'visible_scores'
+    )
+
+    def __init__(
+        self,
+        category_ids: np.ndarray,
+        rule_ids: np.ndarray,
+        scores: np.ndarray,
+        split_ids: np.ndarray,
+        left_ids: np.ndarray,
+        right_ids: np.ndarray,
+        order: np.ndarray,
+        key_ids: np.ndarray
+    ):
+        """
+        Params:
+            category_ids - the category ids of all cell items built in the cell
+            rule_ids - the ids of the rules used at their tops (0 for supertags)
+            scores - their scores, i.e. the sums of log probabilities of their supertags
+            split_ids - their split positions if built by binary rules,
+                        _UNARY if built by unary rules and _LEXICAL for supertags
+            left_ids - the left children in span[start][split] if built by binary rules,
+                       the children in the same cell if built by unary rules,
+                       and the indices among the categories of the word for supertags
+            right_ids - the right children in span[split][end] if built by binary rules
+            order - the cell items kept in the cell in order, as those merged by
+                    Viterbi merging can still be the children of unary results
+                    or other derivations of the kept ones (see Cell.merged_items)
+            key_ids - the key ids of the categories of all cell items
+        """
+        self.category_ids = category_ids
+        self.rule_ids = rule_ids
+        self.scores = scores
+        self.split_ids = split_ids
+        self.left_ids = left_ids
+        self.right_ids = right_ids
+        self.order = order
+        # the cell items kept in the cell, used to combine with other cells
+        self.key_ids = key_ids[order]
+        self.visible_rule_ids = rule_ids[order]
+        self.visible_scores = scores[order]
+
+    def __len__(self):
+        return len(self.order)
+
+
+class ArrayChartCell:
+    # a cell of ArrayChart, whose cell items are built only at the first access
+
+    __slots__ = ('chart', 'start', 'end', '_cell_items', '_merged_items')
+
+    def __init__(self, chart: 'ArrayChart', start: int, end: int):
+        self.chart = chart
+        self.start = start
+        self.end = end
+        self._cell_items = None
+        self._merged_items = None
+
+    def __repr__(self) -> str:
+        return str([repr(cell_item) for cell_item in self.cell_items])
+
+    @property
+    def _is_null(self):
+        return False
+
+    @property
+    def cell_items(self) -> List[CellItem]:
+        if self._cell_items is None:
+            array_cell = self.chart.array_cells[self.start][self.end]
+            self._cell_items = [
+                self.chart.get_item(self.start, self.end, idx) for idx in array_cell.order.tolist()
+            ]
+        return self._cell_items
+
+    @property
+    def merged_items(self) -> Optional[List[CellItem]]:
+        # the other cell items of the cell, only kept with Viterbi merging (see Cell.merged_items)
+        if not self.chart.apply_viterbi_merging:
+            return None
+        if self._merged_items is None:
+            array_cell = self.chart.array_cells[self.start][self.end]
+            is_merged = np.ones(len(array_cell.category_ids), dtype=bool)
+            is_merged[array_cell.order] = False
+            self._merged_items = [
+                self.chart.get_item(self.start, self.end, idx)
+                for idx in np.flatnonzero(is_merged).tolist()
+            ]
+        return self._merged_items
+
+
+class ArrayChart(Chart):
+
+    def __init__(
+        self,
+        pretokenized_sent: List[str],
+        idx2tag: Dict[int, str],
+        array_cells: List[List[Optional[ArrayCell]]],
+        apply_viterbi_merging: bool = False
+    ):
+        """
+        Params:
+            pretokenized_sent - the tokens of the sentence
+            idx2tag - a dictionary mapping an index to its supertag
+            array_cells - the cells decoded by CCGTensorDecoder, indexed by start and end positions
+            apply_viterbi_merging - whether the cells are decoded with Viterbi merging
+
+        The chart of CCGTensorDecoder, keeping the arrays of all cells
+        but building a CellItem object only when it (or a cell item built from it) is accessed,
+        so that extracting the best derivation builds only the cell items it is built from.
+        """
+        super().__init__(l_sent=len(pretokenized_sent), idx2tag=idx2tag)
+        self.pretokenized_sent = pretokenized_sent
+        self.array_cells = array_cells
+        self.apply_viterbi_merging = apply_viterbi_merging
+        # the cell items of each cell built so far, indexed as in its ArrayCell
+        self.items: List[List[Optional[List[Optional[CellItem]]]]] = \
+            [[None] * (self.l + 1) for _ in range(self.l)]
+        for i in range(self.l):
+            for k in range(i + 1, self.l + 1):
+                cell = ArrayChartCell(self, i, k)
+                self.chart[i][k] = cell
+                self.chart_by_end[k][i] = cell
+
+    def _get_items(self, start: int, end: int) -> List[Optional[CellItem]]:
+        items = self.items[start][end]
+        if items is None:
+            items = [None] * len(self.array_cells[start][end].category_ids)
+            self.items[start][end] = items
+        return items
+
+    def get_item(self, start: int, end: int, idx: int) -> CellItem:
+        # the cell item of the given index in the ArrayCell of span[start][end],
+        # built after its children (iteratively, as derivations can be deep)
+        stack = [(start, end, idx)]
+        while stack:
+            i, k, idx = stack[-1]
+            items = self._get_items(i, k)
+            if items[idx] is not None:
+                stack.pop()
+                continue
+            array_cell = self.array_cells[i][k]
+            split_id = int(array_cell.split_ids[idx])
+            left_id = int(array_cell.left_ids[idx])
+            tag = Category.from_id(int(array_cell.category_ids[idx]))
+            right = None
+            if split_id == _LEXICAL:
+                left = Token(contents=self.pretokenized_sent[i], tag=tag)
+            elif split_id == _UNARY:
+                left = items[left_id]
+                if left is None:
+                    stack.append((i, k, left_id))
+                    continue
+            else:
+                right_id = int(array_cell.right_ids[idx])
+                left = self._get_items(i, split_id)[left_id]
+                right = self._get_items(split_id, k)[right_id]
+                if left is None or right is None:
+                    if left is None:
+                        stack.append((i, split_id, left_id))
+                    if right is None:
+                        stack.append((split_id, k, right_id))
+                    continue
+            items[idx] = CellItem(
+                score=float(array_cell.scores[idx]),
+                tag=tag,
+                left=left,
+                right=right,
+                rule_id=int(array_cell.rule_ids[idx])
+            )
+            stack.pop()
+        return self.items[start][end][idx]
+
+
+class CCGTensorDecoder(CCGBaseDecoder):
+
+    def __init__(
+        self,
+        beam_width: int,
+        idx2tag: Dict[int, str],
+        cat_dict: Optional[Dict[str, List[str]]],
+        top_k: int = 3,
+        apply_supertagging_pruning: bool = True,
+        beta: float = 0.00001,
+        timeout: float = 4.0,
+        apply_cat_filtering: bool = False,
+        possible_roots: Optional[List[str]] = None,
+        apply_reachability_pruning: bool = False,
+        max_combinations: Optional[int] = None,
+        apply_viterbi_merging: bool = False
+    ):
+        """
+        Params:
+            the same as those of CCGBaseDecoder
+
+        The CKY algorithm of CCGBaseDecoder over integer category ids,
+        where each cell is kept as arrays (see ArrayCell),
+        the scores of the cell item pairs of all split positions of one span are combined
+        and the instantiated binary rules are looked up for all of them at once
+        in a sparse table of (left key id, right key id) pairs.
+        The cell items are the same as those of CCGBaseDecoder,
+        and are built as CellItem objects only when accessed once the chart is completed
+        (see ArrayChart).
+        Binary rules are never applied on the fly to unseen category pairs.
+        """
+        super().__init__(
+            beam_width=beam_width,
+            idx2tag=idx2tag,
+            cat_dict=cat_dict,
+            top_k=top_k,
+            apply_supertagging_pruning=apply_supertagging_pruning,
+            beta=beta,
+            timeout=timeout,
+            apply_cat_filtering=apply_cat_filtering,
+            possible_roots=possible_roots,
+            apply_reachability_pruning=apply_reachability_pruning,
+            max_combinations=max_combinations,
+            apply_viterbi_merging=apply_viterbi_merging
+        )
+        self._rule_tables_source = None  # the rules and categories the rule tables are built from
+
+    def _build_rule_tables(self):
+        # build the array-based rule tables from the instantiated rules
+        categories = Category._id2category
+        n_categories = len(categories)
+        self.n_categories = n_categories
+        self.category_key_ids = np.array(
+            [category.key_id for category in categories], dtype=np.int64
+        )
+
+        # the normal-form constraints as the table of (context, result rule)
+        # shared by all decoders (see decoders.decoder.intern_rule)
+        self.n_rules = len(_rule_names)
+        self.left_contexts = np.array(_left_contexts, dtype=np.int64) * len(_RIGHT_CONTEXT_RULES)
+        self.right_contexts = np.array(_right_contexts, dtype=np.int64)
+        self.allowed_rules = np.array(_allowed_rules, dtype=bool)
+        self.normal_form_states = np.array(_normal_form_states, dtype=np.int64)
+
+        # the binary rules as a sparse table, where the results of the pair_keys[i]-th pair
+        # (left key id * n_categories + right key id) are those from pair_offsets[i]
+        # to pair_offsets[i + 1] in result_ids and result_rule_ids
+        pairs = sorted(
+            (left_key_id * n_categories + right_key_id, results)
+            for left_key_id, rules in self.apply_instantiated_binary_rules.items()
+            for right_key_id, results in rules.items()
+            if results
+        )
+        self.pair_keys = np.array([pair_key for pair_key, _ in pairs], dtype=np.int64)
+        self.pair_offsets = np.cumsum(
+            [0] + [len(results) for _, results in pairs], dtype=np.int64
+        )
+        self.result_ids = np.array(
+            [result['result_cat'].id for _, results in pairs for result in results],
+            dtype=np.int64
+        )
+        self.result_rule_ids = np.array(
+            [result['rule_id'] for _, results in pairs for result in results],
+            dtype=np.int64
+        )
+        self.max_n_results = max([len(results) for _, results in pairs], default=1)
+
+        self.unary_rule_table: Dict[CategoryId, List[Tuple[int, int, int]]] = {
+            key_id: [
+                (result['result_cat'].id, result['result_cat'].key_id, result['rule_id'])
+                for result in results
+            ]
+            for key_id, results in self.apply_instantiated_unary_rules.items()
+        }
+
+        # the reachability bits of each key id
+        self.reachability_bits = np.full(n_categories, _ALL_REACHABLE, dtype=np.uint8)
+        if self.reachability is not None:
+            self.reachability_bits[:] = 0
+            for key_id, bits in self.reachability.items():
+                if key_id < n_categories:
+                    self.reachability_bits[key_id] = bits
+
+        self._rule_tables_source = self._get_rule_tables_source()
+
+    def _get_rule_tables_source(self) -> Tuple[int, int, int, int, int]:
+        return (
+            id(self.apply_instantiated_unary_rules),
+            id(self.apply_instantiated_binary_rules),
+            id(self.reachability),
+            len(Category._id2category),
+            len(_rule_names)
+        )
+
+    def decode(
+        self,
+        pretokenized_sent: List[str],
+        representations: SupertaggingRepresentations
+    ) -> Chart:
+
+        if self._rule_tables_source != self._get_rule_tables_source():
+            self._build_rule_tables()
+
+        budget = WorkBudget(timeout=self.timeout, max_combinations=self.max_combinations)
+        stats = {'n_combinations': 0, 'stop_reason': None}
+        self.stats.append(stats)
+        l_sent = len(pretokenized_sent)
+
+        ktop_sorted_cats_with_scores = self._get_ktop_sorted_scores_for_possible_cats(
+            pretokenized_sent, representations
+        )
+
+        # CKY algorithm
+        cells = [[None] * (l_sent + 1) for _ in range(l_sent)]
+        for i in range(l_sent):
+            cells[i][i + 1] = self._get_token_cell(ktop_sorted_cats_with_scores[i], i, l_sent)
+            # apply rules to span[i][i+1]
+
+            if not budget.check_deadline():
+                break
+
+            for k in range(i - 1, -1, -1):
+                cells[k][i + 1] = self._get_span_cell(cells, k, i + 1, l_sent, budget)
+                if budget._is_exhausted:
+                    break
+            if budget._is_exhausted:
+                break
+
+        stats['n_combinations'] = budget.n_combinations
+        stats['stop_reason'] = budget.stop_reason or 'completed'
+        if budget._is_exhausted:
+            return None
+        return self._build_chart(pretokenized_sent, ktop_sorted_cats_with_scores, cells)
+
+    def _get_token_cell(
+        self, ktop: List[Tuple[CategoryId, float]], i: int, l_sent: int
+    ) -> ArrayCell:
+        category_ids = np.array([category_id for category_id, _ in ktop], dtype=np.int64)
+        scores = np.array([score for _, score in ktop], dtype=np.float64)
+        token_ids = np.arange(len(ktop), dtype=np.int64)
+        keep = self.reachability_bits[self.category_key_ids[category_ids]] \
+            & self._get_position(i, i + 1, l_sent) > 0
+        return self._finish_cell(
+            category_ids=category_ids[keep],
+            rule_ids=np.zeros(keep.sum(), dtype=np.int64),
+            scores=scores[keep],
+            split_ids=np.full(keep.sum(), _LEXICAL, dtype=np.int64),
+            left_ids=token_ids[keep],
+            right_ids=np.zeros(keep.sum(), dtype=np.int64),
+            start=i,
+            end=i + 1,
+            l_sent=l_sent
+        )
+
+    def _get_span_cell(
+        self,
+        cells: List[List[Optional[ArrayCell]]],
+        i: int,
+        k: int,
+        l_sent: int,
+        budget: WorkBudget
+    ) -> Optional[ArrayCell]:
+        # i - start position, k - end position
+        position = self._get_position(i, k, l_sent)
+        n_categories = self.n_categories
+
+        # the keys of all pairs of all split positions in the order of enumerating them
+        split_positions = [j for j in range(i + 1, k) if len(cells[i][j]) and len(cells[j][k])]
+        if not budget.spend_combinations(
+            sum(len(cells[i][j]) * len(cells[j][k]) for j in split_positions)
+        ):
+            return None  # the cell is left empty as decoding stops
+        if not split_positions or len(self.pair_keys) == 0:
+            return self._finish_cell(*self._get_empty_arrays(), start=i, end=k, l_sent=l_sent)
+        pair_keys = np.concatenate(
+            [
+                (cells[i][j].key_ids[:, None] * n_categories + cells[j][k].key_ids[None, :]).ravel()
+                for j in split_positions
+            ]
+        )
+        n_lefts = np.array([len(cells[i][j]) for j in split_positions], dtype=np.int64)
+        n_rights = np.array([len(cells[j][k]) for j in split_positions], dtype=np.int64)
+        pair_offsets = np.cumsum(n_lefts * n_rights) - n_lefts * n_rights
+        left_offsets = np.cumsum(n_lefts) - n_lefts
+        right_offsets = np.cumsum(n_rights) - n_rights
+
+        # look up the results of all pairs at once
+        table_ids = np.searchsorted(self.pair_keys, pair_keys)
+        table_ids[table_ids == len(self.pair_keys)] = 0
+        pair_ids = np.flatnonzero(self.pair_keys[table_ids] == pair_keys)
+        starts = self.pair_offsets[table_ids[pair_ids]]
+        n_results = self.pair_offsets[table_ids[pair_ids] + 1] - starts
+        pair_ids = np.repeat(pair_ids, n_results)
+        result_idx = np.arange(len(pair_ids)) - np.repeat(np.cumsum(n_results) - n_results, n_results)
+        entries = np.repeat(starts, n_results) + result_idx
+        result_ids = self.result_ids[entries]
+        result_rule_ids = self.result_rule_ids[entries]
+
+        # the split position and the children of each result
+        split_idx = np.searchsorted(pair_offsets, pair_ids, side='right') - 1
+        local_ids = pair_ids - pair_offsets[split_idx]
+        left_ids = left_offsets[split_idx] + local_ids // n_rights[split_idx]
+        right_ids = right_offsets[split_idx] + local_ids % n_rights[split_idx]
+        left_rule_ids, left_scores, left_orders = [
+            np.concatenate([getattr(cells[i][j], name) for j in split_positions])
+            for name in ['visible_rule_ids', 'visible_scores', 'order']
+        ]
+        right_rule_ids, right_scores, right_orders = [
+            np.concatenate([getattr(cells[j][k], name) for j in split_positions])
+            for name in ['visible_rule_ids', 'visible_scores', 'order']
+        ]
+
+        contexts = self.left_contexts[left_rule_ids[left_ids]] \
+            + self.right_contexts[right_rule_ids[right_ids]]
+        keep = self.allowed_rules[contexts, result_rule_ids] \
+            & (self.reachability_bits[self.category_key_ids[result_ids]] & position > 0)
+        left_ids, right_ids, pair_ids, result_idx, split_idx = \
+            left_ids[keep], right_ids[keep], pair_ids[keep], result_idx[keep], split_idx[keep]
+        category_ids = result_ids[keep]
+        rule_ids = result_rule_ids[keep]
+        scores = left_scores[left_ids] + right_scores[right_ids]
+        orders = pair_ids * self.max_n_results + result_idx  # the order of enumerating all results
+        split_ids = np.array(split_positions, dtype=np.int64)[split_idx]
+        left_ids = left_orders[left_ids]
+        right_ids = right_orders[right_ids]
+
+        # the best beam_width cell items, the later ones coming first among equal scores
+        ranks = np.lexsort((-orders, -scores))
+        merged = None
+        if self.apply_viterbi_merging:
+            # merge all cell items before taking the best beam_width ones of distinct constituents,
+            # the others of the kept constituents being kept as their other derivations
+            merge_keys = category_ids[ranks] * self.n_rules \
+                + self.normal_form_states[rule_ids[ranks]]
+            _, first_ids = np.unique(merge_keys, return_index=True)
+            kept_ids = np.sort(first_ids)[:self.beam_width]
+            is_merged = np.isin(merge_keys, merge_keys[kept_ids])
+            is_merged[kept_ids] = False
+            merged_ranks = ranks[is_merged]
+            merged = tuple(
+                values[merged_ranks]
+                for values in [category_ids, rule_ids, scores, split_ids, left_ids, right_ids]
+            )
+            ranks = ranks[kept_ids]
+        ranks = ranks[:self.beam_width]
+
+        return self._finish_cell(
+            category_ids=category_ids[ranks],
+            rule_ids=rule_ids[ranks],
+            scores=scores[ranks],
+            split_ids=split_ids[ranks],
+            left_ids=left_ids[ranks],
+            right_ids=right_ids[ranks],
+            start=i,
+            end=k,
+            l_sent=l_sent,
+            merged=merged
+        )
+
+    @staticmethod
+    def _get_empty_arrays() -> Tuple[np.ndarray, ...]:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float64), empty, empty, empty
+
+    def _finish_cell(
+        self,
+        category_ids: np.ndarray,
+        rule_ids: np.ndarray,
+        scores: np.ndarray,
+        split_ids: np.ndarray,
+        left_ids: np.ndarray,
+        right_ids: np.ndarray,
+        start: int,
+        end: int,
+        l_sent: int,
+        merged: Optional[Tuple[np.ndarray, ...]] = None
+    ) -> ArrayCell:
+        # apply unary rules to the cell items (and merge all of them) as CCGBaseDecoder does,
+        # merged being the arrays of the cell items already merged into them (if any),
+        # which are only kept after all others as their other derivations
+        position = self._get_position(start, end, l_sent)
+        key_ids = self.category_key_ids[category_ids]
+        unary_results = list()
+        for idx, key_id in enumerate(key_ids.tolist()):
+            for result_id, result_key_id, rule_id in self.unary_rule_table.get(key_id, ()):
+                if self.reachability_bits[result_key_id] & position:
+                    unary_results.append((result_id, result_key_id, rule_id, idx))
+
+        if unary_results:
+            result_ids, result_key_ids, result_rule_ids, child_ids = [
+                np.array(values, dtype=np.int64) for values in zip(*unary_results)
+            ]
+            category_ids = np.concatenate([category_ids, result_ids])
+            key_ids = np.concatenate([key_ids, result_key_ids])
+            rule_ids = np.concatenate([rule_ids, result_rule_ids])
+            scores = np.concatenate([scores, scores[child_ids]])
+            split_ids = np.concatenate([split_ids, np.full(len(child_ids), _UNARY, dtype=np.int64)])
+            left_ids = np.concatenate([left_ids, child_ids])
+            right_ids = np.concatenate([right_ids, np.zeros(len(child_ids), dtype=np.int64)])
+
+        if self.apply_viterbi_merging:
+            # keep the cell item with the highest score (the earliest among equal ones)
+            # for each category and normal-form state at the position of the earliest one
+            best_ids = dict()
+            states = self.normal_form_states[rule_ids].tolist()
+            scores_list = scores.tolist()
+            for idx, category_id in enumerate(category_ids.tolist()):
+                key = (category_id, states[idx])
+                best_idx = best_ids.get(key)
+                if best_idx is None or scores_list[best_idx] < scores_list[idx]:
+                    best_ids[key] = idx
+            order = np.array(list(best_ids.values()), dtype=np.int64)
+        else:
+            order = np.arange(len(category_ids), dtype=np.int64)
+
+        if merged is not None:
+            category_ids, rule_ids, scores, split_ids, left_ids, right_ids = [
+                np.concatenate([values, merged_values]) for values, merged_values in zip(
+                    [category_ids, rule_ids, scores, split_ids, left_ids, right_ids], merged
+                )
+            ]
+            key_ids = np.concatenate([key_ids, self.category_key_ids[merged[0]]])
+
+        return ArrayCell(
+            category_ids=category_ids,
+            rule_ids=rule_ids,
+            scores=scores,
+            split_ids=split_ids,
+            left_ids=left_ids,
+            right_ids=right_ids,
+            order=order,
+            key_ids=key_ids
+        )
+
+    def _build_chart(
+        self,
+        pretokenized_sent: List[str],
+        ktop_sorted_cats_with_scores: List[List[Tuple[CategoryId, float]]],
+        cells: List[List[Optional[ArrayCell]]]
+    ) -> Chart:
+        # the cell items are built from the arrays of the cells only when accessed (see ArrayChart)
+        return ArrayChart(
+            pretokenized_sent=pretokenized_sent,
+            idx2tag=self.idx2tag,
+            array_cells=cells,
+            apply_viterbi_merging=self.apply_viterbi_merging
+        )
@@ -1,17 +1,190 @@
+import os
 import sys
+import time
+import json
 import torch
-from typing import Optional, Tuple, Dict, Any, List
+import numpy as np
+from collections import OrderedDict
+from typing import TypeVar, Optional, Tuple, Dict, Any, List, FrozenSet, Iterator, Union
 
 sys.path.append('..')
-from base import Token, Category, ConstituentNode
+from base import Atom, Token, Category, ConstituentNode
+from tools import to_X_features
+import ccg_rules
+from grammar import (
+    compute_reachability,
+    REACHABLE_INSIDE, REACHABLE_AT_START, REACHABLE_AT_END, REACHABLE_AS_WHOLE
+)
+
+
+CategoryStr = TypeVar('CategoryStr')
+CategoryId = TypeVar('CategoryId')
+RuleName = TypeVar('RuleName')
+RuleId = TypeVar('RuleId')
+InstantiatedUnaryRule = Tuple[CategoryStr, CategoryStr, RuleName]
+InstantiatedBinaryRule = Tuple[CategoryStr, CategoryStr, List[Tuple[CategoryStr, RuleName]]]
+BinaryRuleResult = Dict[str, Any]  # {'result_cat': Category, 'rule_id': RuleId}
+
+_NO_RESULTS: Tuple[BinaryRuleResult, ...] = tuple()
+# the used rules of children checked by _check_constraints
+_CONSTRAINED_RULES = frozenset(['FC', 'FT', 'BX', 'BT'])
+_NO_PARTNERS: FrozenSet[CategoryId] = frozenset()
+
+# the names of the rules indexed by their integer ids (see intern_rule),
+# shared by all decoders, the id 0 standing for no rule (i.e. supertags)
+_rule_names: List[Optional[RuleName]] = [None]
+_rule_ids: Dict[Optional[RuleName], RuleId] = {None: 0}
+
+# the normal-form constraints precompiled over the rule ids,
+# which depend only on whether the left child is built by FC or FT
+# and whether the right child is built by BX or BT,
+# i.e. the context (left context * 3 + right context) of a combination
+_LEFT_CONTEXT_RULES = (None, 'FC', 'FT')
+_RIGHT_CONTEXT_RULES = (None, 'BX', 'BT')
+_N_CONTEXTS = len(_LEFT_CONTEXT_RULES) * len(_RIGHT_CONTEXT_RULES)
+_left_contexts: List[int] = [0]  # rule id -> the left context of a child built by it
+_right_contexts: List[int] = [0]  # rule id -> the right context of a child built by it
+_normal_form_states: List[RuleId] = [0]  # rule id -> the rule id of its normal-form state
+# context -> rule id -> whether the results of the rule are allowed in the context
+_allowed_rules: List[List[bool]] = [[True] for _ in range(_N_CONTEXTS)]
+
+
+def _check_constraints(
+    left_used_rule: Optional[RuleName],
+    right_used_rule: Optional[RuleName],
+    result_used_rule: Optional[RuleName]
+) -> bool:
+
+    # Eisner constraints
+    if left_used_rule == 'FC' and (
+        result_used_rule == 'FA' or result_used_rule == 'FC'
+    ):
+        return False
+    elif right_used_rule == 'BX' and (
+        result_used_rule == 'BA' or result_used_rule == 'BX'
+    ):
+        return False
+
+    # Julia and Bisk's Constraint 5
+    elif left_used_rule == 'FT' and result_used_rule == 'FA':
+        return False
+    elif right_used_rule == 'BT' and result_used_rule == 'BA':
+        return False
+    else:
+        return True
+
+
+def intern_rule(rule_name: Optional[RuleName]) -> RuleId:
+    # the integer id of a rule, extending the precompiled constraints to the rules first seen
+    rule_id = _rule_ids.get(rule_name)
+    if rule_id is None:
+        rule_id = len(_rule_names)
+        _rule_names.append(rule_name)
+        _rule_ids[rule_name] = rule_id
+        _left_contexts.append(
+            _LEFT_CONTEXT_RULES.index(rule_name) if rule_name in _LEFT_CONTEXT_RULES else 0
+        )
+        _right_contexts.append(
+            _RIGHT_CONTEXT_RULES.index(rule_name) if rule_name in _RIGHT_CONTEXT_RULES else 0
+        )
+        _normal_form_states.append(rule_id if rule_name in _CONSTRAINED_RULES else 0)
+        for context, allowed in enumerate(_allowed_rules):
+            allowed.append(
+                _check_constraints(
+                    _LEFT_CONTEXT_RULES[context // len(_RIGHT_CONTEXT_RULES)],
+                    _RIGHT_CONTEXT_RULES[context % len(_RIGHT_CONTEXT_RULES)],
+                    rule_name
+                )
+            )
+    return rule_id
+
+
+def get_rule_name(rule_id: RuleId) -> Optional[RuleName]:
+    return _rule_names[rule_id]
+
+
+def _get_context(left_rule_id: RuleId, right_rule_id: RuleId) -> int:
+    # the context of combining the children built by the two rules
+    return _left_contexts[left_rule_id] * len(_RIGHT_CONTEXT_RULES) + _right_contexts[right_rule_id]
+
+
+def _fuse_constraints(
+    results: List[BinaryRuleResult]
+) -> Tuple[Tuple[BinaryRuleResult, ...], ...]:
+    # the results of one category pair allowed in each context,
+    # so that the results forbidden by the constraints are never looked up,
+    # the contexts allowing all results sharing one tuple
+    results = tuple(results)
+    fused = list()
+    for allowed in _allowed_rules:
+        allowed_results = tuple(result for result in results if allowed[result['rule_id']])
+        if len(allowed_results) == len(results):
+            fused.append(results)
+        else:
+            fused.append(allowed_results or _NO_RESULTS)
+    return tuple(fused)
+
+
+def _binarize(ids, length):  # to assign 0 to all designated positions
+    result = np.ones(length, dtype=np.bool)
+    result[ids] = 0
+    return result
+
+
+def build_category_filters(
+    category2idx: Dict[str, int],
+    category_dict: Dict[str, List[str]]
+) -> Dict[str, np.ndarray]:
+    # map each word to a boolean array assigning 1 to all categories not allowed for it
+    return {
+        word: _binarize(
+            [category2idx[cat] for cat in cats],
+            len(category2idx)
+        )
+        for word, cats in category_dict.items()
+    }
+
+
+def apply_category_filters(
+    pretokenized_sents: List[List[str]],
+    batch_representations: List[torch.Tensor],
+    category_filters: Dict[str, np.ndarray]
+) -> List[torch.Tensor]:
+    """
+    Input:
+        pretokenized_sents - a list of pretokenized sentences, each of which is a list of strings
+        batch_representations - a list of tensors, each of shape l_sent * C
+        category_filters - a dictionary mapping a word to the boolean array
+                           assigning 1 to all categories not allowed for it
+                           (see build_category_filters)
+    Output:
+        filtered batch_representations
+        (apply the category filter to pretokenized_sents so that for each word, 
+        only categories allowed for this word in the category dictionary
+        keep their scores in batch_representations)
+    """
+    for tokens, representations in zip(pretokenized_sents, batch_representations):
+        for index, token in enumerate(tokens):
+            if token in category_filters:
+                representations[index, category_filters[token]] = 0
+
+    return batch_representations
 
 
 class CellItem:
 
+    __slots__ = (
+        'tag', 'left', 'right', 'rule_id', 'start_end',
+        'span_tag_idx', 'span_split_position', 'score'
+    )
+
     def __init__(
         self,
         score,
-        constituent: Optional[ConstituentNode] = None,
+        tag: Optional[Category] = None,
+        left: Union['CellItem', Token, None] = None,
+        right: Optional['CellItem'] = None,
+        rule_id: RuleId = 0,
         start_end: Optional[Tuple[int, int]] = None,
         span_tag_idx: Optional[int] = None,
         span_split_position: Optional[Tuple[int, int, int]] = None
@@ -19,20 +192,46 @@ class CellItem:
         """
         Params:
             score - the score for this cell item
-            constituent - the ConsituentNode of this cell item,
-                          used for base and A* decoding
+            tag - the category of this cell item,
+                  used for base and A* decoding
+            left - the backpointer to the left (or only) child cell item,
+                   or the token for a cell item of a supertag
+            right - the backpointer to the right child cell item, None if not binary
+            rule_id - the id of the rule building this cell item (see intern_rule),
+                      0 for supertags
             start_end - the start and end position of the cell item
             span_tag_idx - the index for the tag of this span,
                            used for span-based decoding, not used for now
             span_split_position - k, left, right, for span-based decoding,
                                   not used for now
         """
-        self.constituent = constituent
+        self.tag = tag
+        self.left = left
+        self.right = right
+        self.rule_id = rule_id
         self.start_end = start_end
         self.span_tag_idx = span_tag_idx
         self.span_split_position = span_split_position
         self.score = score
 
+    @property
+    def used_rule(self) -> Optional[RuleName]:
+        return _rule_names[self.rule_id]
+
+    @property
+    def constituent(self) -> Optional[ConstituentNode]:
+        # the derivation of this cell item, built from the backpointers at each access,
+        # so that only the derivations output are ever built as trees
+        if self.tag is None:
+            return None
+        if isinstance(self.left, Token):
+            children = [self.left]
+        elif self.right is None:
+            children = [self.left.constituent]
+        else:
+            children = [self.left.constituent, self.right.constituent]
+        return ConstituentNode(tag=self.tag, children=children, used_rule=self.used_rule)
+
     def build_tree(
         self,
         chart: 'Chart',
@@ -62,57 +261,623 @@ class CellItem:
 
 class Cell:
 
+    __slots__ = ('cell_items', 'merged_items')
+
     def __init__(
         self,
-        span_representation: torch.Tensor = None,
-        cell_items: List[CellItem] = None
+        cell_items: List[CellItem] = None,
+        merged_items: List[CellItem] = None
     ):
-        self.span_representation = span_representation
+        """
+        Params:
+            cell_items - the cell items of the span
+            merged_items - the cell items merged into those of the same constituent
+                           (see CCGBaseDecoder.apply_viterbi_merging), never combined further
+                           but kept only as other derivations for decoders.k_best,
+                           None if not merged
+        """
         self.cell_items = cell_items
+        self.merged_items = merged_items
 
     def __repr__(self) -> str:
         return str([repr(cell_item) for cell_item in self.cell_items])
 
+    @property
+    def _is_null(self):
+        return self.cell_items is None
+
+
+class SpanCell(Cell):  # for span-based decoding, not used for now
+
+    __slots__ = ('span_representation',)
+
+    def __init__(
+        self,
+        span_representation: torch.Tensor = None,
+        cell_items: List[CellItem] = None
+    ):
+        self.span_representation = span_representation
+        super().__init__(cell_items=cell_items)
+
     @property
     def _is_null(self):
         return self.span_representation is None and self.cell_items is None
 
 
+class ChartRow(dict):
+    # the cells of the spans starting at one position, keyed by their end positions,
+    # each of which is created at its first access,
+    # so that chart.chart[start][end] works as with a list of all cells
+
+    __slots__ = ('chart', 'start')
+
+    def __init__(self, chart: 'Chart', start: int):
+        super().__init__()
+        self.chart = chart
+        self.start = start
+
+    def __missing__(self, end: int) -> Cell:
+        n_ends = len(self.chart.chart_by_end)
+        if end < 0:
+            end += n_ends
+            if end in self:
+                return dict.__getitem__(self, end)
+        if not 0 <= end < n_ends:
+            raise IndexError('chart index out of range')
+        cell = self.chart.cell_class()
+        self[end] = cell
+        self.chart.chart_by_end[end][self.start] = cell
+        return cell
+
+
 class Chart:
 
+    cell_class = Cell
+
     def __init__(
         self,
         l_sent: int,
         idx2tag: Dict[int, Any]
     ):
         self.l = l_sent
-        self.chart = [None] * l_sent
-        for i in range(l_sent):
-            self.chart[i] = [Cell() for _ in range(l_sent + 1)]
-        # [0, ..., l_sent-1] * [0, 1, ..., l_sent]
+        # the cells are kept sparsely, only the accessed ones being created,
+        # indexed both by the start position (chart[start][end], with end in [0, ..., l_sent])
+        # and by the end position (chart_by_end[end][start])
+        self.chart = [ChartRow(self, i) for i in range(l_sent)]
+        self.chart_by_end: List[Dict[int, Cell]] = [dict() for _ in range(l_sent + 1)]
         self.idx2tag = idx2tag
 
+    def get_cell_items(self, start: int, end: int) -> Optional[List[CellItem]]:
+        # the cell items of span[start][end] (None if not filled), without creating its cell
+        cell = self.chart[start].get(end)
+        return None if cell is None else cell.cell_items
+
+    def get_merged_items(self, start: int, end: int) -> Optional[List[CellItem]]:
+        # the cell items merged in span[start][end] (None if not merged), without creating its cell
+        cell = self.chart[start].get(end)
+        return None if cell is None else cell.merged_items
+
+    def cells_starting_at(self, start: int) -> Iterator[Tuple[int, List[CellItem]]]:
+        # (end, cell items) of the non-empty cells starting at start, from the nearest end
+        for end, cell in sorted(self.chart[start].items()):
+            if cell.cell_items:
+                yield end, cell.cell_items
+
+    def cells_ending_at(self, end: int) -> Iterator[Tuple[int, List[CellItem]]]:
+        # (start, cell items) of the non-empty cells ending at end, from the farthest start
+        for start, cell in sorted(self.chart_by_end[end].items()):
+            if cell.cell_items:
+                yield start, cell.cell_items
+
+    def iter_splits(
+        self, start: int, end: int
+    ) -> Iterator[Tuple[int, List[CellItem], List[CellItem]]]:
+        # (split position, left cell items, right cell items) of span[start][end]
+        # over the split positions with both neighbouring cells non-empty, in ascending order
+        for mid, left_items in self.cells_starting_at(start):
+            if mid >= end:
+                break
+            right_items = self.get_cell_items(mid, end)
+            if right_items:
+                yield mid, left_items, right_items
+
     def _show_tree(self, cell_item: CellItem):
         print(str(cell_item.build_tree(self, self.idx2tag)))
 
 
+class SpanChart(Chart):  # for span-based decoding, not used for now
+
+    cell_class = SpanCell
+
+
+class ParseResult:
+
+    __slots__ = ('derivation', 'score', 'k_best', 'stats', 'chart')
+
+    def __init__(
+        self,
+        derivation: Optional[ConstituentNode] = None,
+        score: Optional[float] = None,
+        k_best: Optional[List[Tuple[float, ConstituentNode]]] = None,
+        stats: Optional[Dict[str, Any]] = None,
+        chart: Optional[Chart] = None
+    ):
+        """
+        Params:
+            derivation - the best derivation of the sentence with a possible root category,
+                         None for a null parse
+            score - the score of the cell item of the best derivation
+            k_best - the (cost, derivation) pairs from the lowest cost (see decoders.k_best),
+                     only extracted if more than one derivation is asked for
+            stats - the statistics of decoding the sentence (if collected by the decoder)
+            chart - the decoded chart, only kept for debugging
+        """
+        self.derivation = derivation
+        self.score = score
+        self.k_best = k_best if k_best is not None else list()
+        self.stats = stats
+        self.chart = chart
+
+
+class BinaryRuleCache:
+
+    def __init__(self, max_size: int = 2**16):
+        """
+        Params:
+            max_size - the maximum number of category pairs kept in the cache,
+                       beyond which the least recently used pair is dropped
+        """
+        self.max_size = max_size
+        # (left category id, right category id) -> results of the binary rules,
+        # kept from the least to the most recently used
+        self.results: OrderedDict = OrderedDict()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def get(
+        self, left_cat: Category, right_cat: Category
+    ) -> Optional[Tuple[Tuple[BinaryRuleResult, ...], ...]]:
+        # return the cached results of one category pair in each context
+        # (see _fuse_constraints) or None if not cached
+        key = (left_cat.id, right_cat.id)
+        results = self.results.get(key)
+        if results is None:
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        self.results.move_to_end(key)
+        return results
+
+    def put(
+        self,
+        left_cat: Category,
+        right_cat: Category,
+        results: Tuple[Tuple[BinaryRuleResult, ...], ...]
+    ) -> None:
+        self.results[(left_cat.id, right_cat.id)] = results
+        self.results.move_to_end((left_cat.id, right_cat.id))
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def load(self, cache_dir: str) -> None:
+        # load the pairs saved by `save`,
+        # category ids differ between runs, so the pairs are saved as strings
+        with open(cache_dir, 'r', encoding='utf8') as f:
+            saved_rules: List[InstantiatedBinaryRule] = json.load(f)
+        for left_cat, right_cat, results in saved_rules:
+            self.put(
+                Category.intern(left_cat),
+                Category.intern(right_cat),
+                _fuse_constraints(
+                    [
+                        {'result_cat': Category.intern(result[0]), 'rule_id': intern_rule(result[1])}
+                        for result in results
+                    ]
+                )
+            )
+
+    def save(self, cache_dir: str) -> None:
+        # save the cached pairs in the format of instantiated binary rules,
+        # including the pairs without any results,
+        # all of which are allowed in the context without constraints (i.e. 0)
+        saved_rules = [
+            [
+                str(Category.from_id(left_id)),
+                str(Category.from_id(right_id)),
+                [
+                    [str(result['result_cat']), get_rule_name(result['rule_id'])]
+                    for result in results[0]
+                ]
+            ]
+            for (left_id, right_id), results in self.results.items()
+        ]
+        with open(cache_dir, 'w', encoding='utf8') as f:
+            json.dump(saved_rules, f, indent=2, ensure_ascii=False)
+
+
+class WorkBudget:
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        max_pops: Optional[int] = None,
+        max_combinations: Optional[int] = None,
+        check_interval: int = 256
+    ):
+        """
+        Params:
+            timeout - maximum seconds allowable for decoding one sentence, None for no limit
+            max_pops - maximum number of cell items popped from the agenda, None for no limit
+            max_combinations - maximum number of cell item pairs tried with binary rules,
+                               None for no limit
+            check_interval - the number of combinations between two checks of the clock,
+                             so that the deadline is checked inside combination loops cheaply
+        Unlike timeout, max_pops and max_combinations stop decoding
+        at the same point on any machine.
+        """
+        self.deadline = None if timeout is None else time.time() + timeout
+        self.max_pops = max_pops
+        self.max_combinations = max_combinations
+        self.check_interval = check_interval
+        self.n_pops = 0
+        self.n_combinations = 0
+        self.stop_reason: Optional[str] = None  # why the budget is exhausted, None if not
+
+    @property
+    def _is_exhausted(self) -> bool:
+        return self.stop_reason is not None
+
+    def check_deadline(self) -> bool:
+        # return False if the budget is exhausted
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.stop_reason = 'timeout'
+        return self.stop_reason is None
+
+    def spend_pop(self) -> bool:
+        # count one pop from the agenda, return False if the budget is exhausted
+        if self.max_pops is not None and self.n_pops >= self.max_pops:
+            self.stop_reason = 'max_pops'
+            return False
+        self.n_pops += 1
+        return self.check_deadline()
+
+    def spend_combination(self) -> bool:
+        # count one pair of cell items tried, return False if the budget is exhausted
+        if self.max_combinations is not None and self.n_combinations >= self.max_combinations:
+            self.stop_reason = 'max_combinations'
+            return False
+        self.n_combinations += 1
+        if self.n_combinations % self.check_interval == 0:
+            return self.check_deadline()
+        return self.stop_reason is None
+
+    def spend_combinations(self, n_combinations: int) -> bool:
+        # count the pairs of cell items tried at once (by vectorized decoders),
+        # return False if the budget is exhausted
+        if self.max_combinations is not None \
+            and self.n_combinations + n_combinations > self.max_combinations:
+            self.n_combinations = self.max_combinations
+            self.stop_reason = 'max_combinations'
+            return False
+        self.n_combinations += n_combinations
+        return self.check_deadline()
+
+
 class Decoder:  # for testing directly, no need to train
 
     def __init__(
         self,
         top_k: int,
-        idx2tag: Dict[int, Any]
+        idx2tag: Dict[int, Any],
+        apply_binary_rule_fallback: bool = False,
+        binary_rule_cache_size: int = 2**16,
+        binary_rule_cache_dir: Optional[str] = None,
+        possible_roots: Optional[List[str]] = None,
+        apply_reachability_pruning: bool = False
     ):
+        """
+        Params:
+            top_k - maximum number of categories allowed for each word
+            idx2tag - a dictionary mapping an index to a category string
+            apply_binary_rule_fallback - whether to apply the binary rules on the fly
+                                         to category pairs unseen in the instantiated rules
+            binary_rule_cache_size - maximum number of unseen pairs whose results are cached
+            binary_rule_cache_dir - the file to load the cache from (if existing)
+                                    and to save it to, not persisted if None
+            possible_roots - allowable categories at the root of each parse, None for any category
+            apply_reachability_pruning - whether to discard cell items whose categories
+                                         can never reach possible_roots from their positions,
+                                         not applied without possible_roots
+                                         or with apply_binary_rule_fallback
+        """
         self.top_k = top_k
         self.idx2tag = idx2tag
         self.tag2idx = {tag: idx for idx, tag in self.idx2tag.items()}
 
+        # map each supertag index to its id in the global category table
+        self.idx2category_id = np.zeros(len(self.idx2tag), dtype=np.int64)
+        for idx, tag in self.idx2tag.items():
+            self.idx2category_id[idx] = Category.intern(tag).id
+
+        # the category filter of each word (1 for categories not allowed),
+        # built once on demand from the category dictionary or loaded from a compiled grammar
+        self.category_filters: Optional[Dict[str, np.ndarray]] = None
+
+        self.apply_binary_rule_fallback = apply_binary_rule_fallback
+        self.binary_rule_cache = BinaryRuleCache(binary_rule_cache_size)
+        self.binary_rule_cache_dir = binary_rule_cache_dir
+        if (
+            apply_binary_rule_fallback
+            and binary_rule_cache_dir is not None
+            and os.path.exists(binary_rule_cache_dir)
+        ):
+            self.binary_rule_cache.load(binary_rule_cache_dir)
+
+        self.possible_roots = possible_roots
+        self.possible_root_ids: Optional[FrozenSet[CategoryId]] = None
+        if possible_roots is not None:
+            self.possible_root_ids = frozenset(
+                Category.intern(root).id for root in possible_roots
+            )
+
+        self.apply_instantiated_unary_rules = dict()
+        self.apply_instantiated_binary_rules = dict()
+        self.allowed_binary_rules = dict()
+        # the key id of each category -> its reachability bits (see grammar.compute_reachability),
+        # None if reachability pruning is not applied
+        self.apply_reachability_pruning = apply_reachability_pruning
+        self.reachability: Optional[Dict[CategoryId, int]] = None
+
+        # the statistics of each sentence decoded by the last batch_decode (if collected)
+        self.stats: List[Dict[str, Any]] = list()
+
+    def save_binary_rule_cache(self) -> None:
+        if self.apply_binary_rule_fallback and self.binary_rule_cache_dir is not None:
+            self.binary_rule_cache.save(self.binary_rule_cache_dir)
+
+    def _get_instantiated_unary_rules(
+        self,
+        instantiated_unary_rules: List[InstantiatedUnaryRule]
+    ):
+        # get instantiated_unary_rules from a specific file,
+        # indexed by the key id of the initial category
+        self.apply_instantiated_unary_rules = dict()
+        for instantiated_unary_rule in instantiated_unary_rules:
+            initial_cat = Category.intern(instantiated_unary_rule[0])
+            final_cat = Category.intern(instantiated_unary_rule[1])
+            if initial_cat.key_id not in self.apply_instantiated_unary_rules:
+                self.apply_instantiated_unary_rules[initial_cat.key_id] = list()
+            self.apply_instantiated_unary_rules[initial_cat.key_id].append(
+                {
+                    'result_cat': final_cat,
+                    'rule_id': intern_rule(instantiated_unary_rule[2])
+                }
+            )
+        self._build_reachability()
+
+    def _get_instantiated_binary_rules(
+        self,
+        instantiated_binary_rules: List[InstantiatedBinaryRule]
+    ):
+        # get instantiated_binary_rules from a specific file,
+        # indexed by the key ids of the left and the right categories
+        self.apply_instantiated_binary_rules = dict()
+        for instantiated_binary_rule in instantiated_binary_rules:
+            left_cat = Category.intern(instantiated_binary_rule[0])
+            if left_cat.key_id not in self.apply_instantiated_binary_rules:
+                self.apply_instantiated_binary_rules[left_cat.key_id] = dict()
+            right_cat = Category.intern(instantiated_binary_rule[1])
+            if right_cat.key_id not in self.apply_instantiated_binary_rules[left_cat.key_id]:
+                self.apply_instantiated_binary_rules[left_cat.key_id][right_cat.key_id] = list()
+            for result in instantiated_binary_rule[2]:
+                self.apply_instantiated_binary_rules[left_cat.key_id][right_cat.key_id].append(
+                    {
+                        'result_cat': Category.intern(result[0]),
+                        'rule_id': intern_rule(result[1])
+                    }
+                )
+        self._build_combinability_index()
+        self._build_allowed_binary_rules()
+        self._build_reachability()
+
+    def _load_grammar(self, grammar: 'Grammar'):
+        # get instantiated rules and category filters from a compiled grammar (see grammar.py),
+        # whose categories have been interned once when loaded
+        categories = grammar.interned_categories
+        rule_ids = [intern_rule(rule_name) for rule_name in grammar.rule_names]
+
+        self.apply_instantiated_unary_rules = dict()
+        for initial_idx, result_idx, rule_idx in grammar.unary_rules.tolist():
+            self.apply_instantiated_unary_rules.setdefault(
+                categories[initial_idx].key_id, list()
+            ).append(
+                {
+                    'result_cat': categories[result_idx],
+                    'rule_id': rule_ids[rule_idx]
+                }
+            )
+
+        self.apply_instantiated_binary_rules = dict()
+        for left_idx, right_idx, result_idx, rule_idx in grammar.binary_rules.tolist():
+            self.apply_instantiated_binary_rules.setdefault(
+                categories[left_idx].key_id, dict()
+            ).setdefault(
+                categories[right_idx].key_id, list()
+            ).append(
+                {
+                    'result_cat': categories[result_idx],
+                    'rule_id': rule_ids[rule_idx]
+                }
+            )
+        self._build_combinability_index()
+        self._build_allowed_binary_rules()
+        if (
+            self.possible_roots is not None
+            and '|'.join(self.possible_roots) == grammar.possible_roots
+            and self.apply_reachability_pruning
+            and not self.apply_binary_rule_fallback
+        ):
+            self.reachability = grammar.get_reachability()
+        else:
+            self._build_reachability()
+
+        self.category_filters = grammar.get_category_filters()
+
+    def _build_combinability_index(self):
+        # the combinability index mapping the key id of each category
+        # to the key ids of the categories it can combine with on its right (left) side
+        right_partners = dict()
+        left_partners = dict()
+        for left_key_id, rules in self.apply_instantiated_binary_rules.items():
+            for right_key_id, results in rules.items():
+                if results:
+                    right_partners.setdefault(left_key_id, set()).add(right_key_id)
+                    left_partners.setdefault(right_key_id, set()).add(left_key_id)
+        self.right_partners: Dict[CategoryId, FrozenSet[CategoryId]] = {
+            key_id: frozenset(partners) for key_id, partners in right_partners.items()
+        }
+        self.left_partners: Dict[CategoryId, FrozenSet[CategoryId]] = {
+            key_id: frozenset(partners) for key_id, partners in left_partners.items()
+        }
+
+    def _build_allowed_binary_rules(self):
+        # the instantiated binary rules fused with the normal-form constraints,
+        # indexed by the key ids of the left and the right categories and then by the context
+        self.allowed_binary_rules: Dict[
+            CategoryId, Dict[CategoryId, Tuple[Tuple[BinaryRuleResult, ...], ...]]
+        ] = {
+            left_key_id: {
+                right_key_id: _fuse_constraints(results)
+                for right_key_id, results in rules.items()
+            }
+            for left_key_id, rules in self.apply_instantiated_binary_rules.items()
+        }
+
+    def _build_reachability(self):
+        # compute the reachability of categories in the instantiated rules,
+        # which does not hold once binary rules are applied on the fly to unseen pairs
+        self.reachability = None
+        if (
+            self.possible_root_ids is None
+            or not self.apply_reachability_pruning
+            or self.apply_binary_rule_fallback
+        ):
+            return
+        self.reachability = compute_reachability(
+            unary_rules=[
+                (initial_key_id, result['result_cat'].key_id)
+                for initial_key_id, results in self.apply_instantiated_unary_rules.items()
+                for result in results
+            ],
+            binary_rules=[
+                (left_key_id, right_key_id, result['result_cat'].key_id)
+                for left_key_id, rules in self.apply_instantiated_binary_rules.items()
+                for right_key_id, results in rules.items()
+                for result in results
+            ],
+            root_ids=[Category.from_id(root_id).key_id for root_id in self.possible_root_ids]
+        )
+
+    @staticmethod
+    def _get_position(start: int, end: int, l_sent: int) -> int:
+        # the reachability bit of a span from its position in the sentence
+        if start == 0:
+            return REACHABLE_AS_WHOLE if end == l_sent else REACHABLE_AT_START
+        return REACHABLE_AT_END if end == l_sent else REACHABLE_INSIDE
+
+    def _is_reachable(self, category: Category, start: int, end: int, l_sent: int) -> bool:
+        # whether a span of the category can be part of a parse with a possible root
+        if self.reachability is None:
+            return True
+        position = self._get_position(start, end, l_sent)
+        return bool(self.reachability.get(category.key_id, 0) & position)
+
+    def _get_binary_rule_results(
+        self, left: CellItem, right: CellItem
+    ) -> Tuple[BinaryRuleResult, ...]:
+        # look up the results of combining two cell items in the instantiated rules,
+        # otherwise apply the binary rules on the fly (if enabled),
+        # each unseen pair being evaluated only once while it stays in the cache,
+        # only the results allowed by the normal-form constraints being returned
+        context = _get_context(left.rule_id, right.rule_id)
+        results = self.allowed_binary_rules.get(left.tag.key_id)
+        if results is not None:
+            results = results.get(right.tag.key_id)
+            if results is not None:
+                return results[context]
+        if not self.apply_binary_rule_fallback:
+            return _NO_RESULTS
+
+        results = self.binary_rule_cache.get(left.tag, right.tag)
+        if results is None:
+            results = _fuse_constraints(self._apply_binary_rules_on_the_fly(left.tag, right.tag))
+            self.binary_rule_cache.put(left.tag, right.tag, results)
+        return results[context]
+
+    @staticmethod
+    def _apply_binary_rules_on_the_fly(
+        left_cat: Category, right_cat: Category
+    ) -> Tuple[BinaryRuleResult, ...]:
+        # apply all binary rules to one category pair
+        # in the same way as tools.collect_binary_rules does for seen pairs
+        left = ConstituentNode(tag=Category.intern(to_X_features.get(str(left_cat), left_cat)))
+        right = ConstituentNode(tag=Category.intern(to_X_features.get(str(right_cat), right_cat)))
+        results = list()
+        for binary_rule in ccg_rules.binary_rules:
+            result = binary_rule(left, right)
+            if result and result.tag not in [item['result_cat'] for item in results]:
+                results.append({'result_cat': result.tag, 'rule_id': intern_rule(result.used_rule)})
+        return tuple(results)
+
+    def _get_ktop_category_ids_with_probs(
+        self,
+        representations: torch.Tensor
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        # get ktop category ids and their probabilities for each word
+        # (only keep categories whose probabilities are greater than 0)
+        # after applying supertagging pruning (beta)
+        if self.apply_supertagging_pruning:
+            representations = self._prune_supertagging_results(representations)
+
+        topk_ps, topk_ids = torch.topk(representations, self.top_k, dim=1)
+        topk_ps = topk_ps.cpu().numpy().astype(np.float64)
+        topk_category_ids = self.idx2category_id[topk_ids.cpu().numpy()]
+
+        return [
+            (topk_category_ids[i][topk_ps[i] > 0], topk_ps[i][topk_ps[i] > 0])
+            for i in range(representations.shape[0])
+        ]
+
+    def _prune_supertagging_results(
+        self, representations: torch.Tensor
+    ) -> torch.Tensor:
+
+        for i in range(representations.shape[0]):
+            top_p = torch.topk(representations[i], 1)[0]
+            binarized = (representations[i] > self.beta * top_p)
+            representations[i] = representations[i] * binarized
+
+        return representations
+
+    def _prepare_batch(
+        self,
+        pretokenized_sents: List[List[str]],
+        batch_representations: List[torch.Tensor]
+    ) -> List[torch.Tensor]:
+        # reset the statistics and return the representations to decode the batch with
+        self.stats = list()
+        return batch_representations
+
     def batch_decode(
         self,
         pretokenized_sents: List[List[str]],
         batch_representations: List[torch.Tensor]
     ) -> List[Chart]:
 
+        batch_representations = self._prepare_batch(pretokenized_sents, batch_representations)
         charts = list()
         for i in range(len(pretokenized_sents)):
             charts.append(
@@ -120,6 +885,73 @@ class Decoder:  # for testing directly, no need to train
             )
         return charts
 
+    def batch_parse(
+        self,
+        pretokenized_sents: List[List[str]],
+        batch_representations: List[torch.Tensor],
+        n_best: int = 1,
+        keep_charts: bool = False
+    ) -> List[ParseResult]:
+        """
+        Input:
+            pretokenized_sents - a list of pretokenized sentences, each of which is a list of strings
+            batch_representations - the supertagging results of the sentences
+            n_best - the number of derivations extracted for each sentence
+            keep_charts - whether to keep the decoded charts in the results, only for debugging
+        Output:
+            the parse results of the sentences,
+            the chart of each sentence being dropped once its derivations are extracted
+        """
+        batch_representations = self._prepare_batch(pretokenized_sents, batch_representations)
+        results = list()
+        for i in range(len(pretokenized_sents)):
+            n_stats = len(self.stats)
+            chart = self.decode(pretokenized_sents[i], batch_representations[i])
+            results.append(
+                self.get_parse_result(
+                    chart,
+                    n_best=n_best,
+                    keep_chart=keep_charts,
+                    stats=self.stats[-1] if len(self.stats) > n_stats else None
+                )
+            )
+        return results
+
+    def get_parse_result(
+        self,
+        chart: Optional[Chart],
+        n_best: int = 1,
+        keep_chart: bool = False,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> ParseResult:
+        # extract the derivations from the cell items of the whole sentence
+        # with possible root categories (all atomic ones if not specified),
+        # the first one being the best
+        # imported here as decoders.k_best depends on this module
+        from decoders.k_best import KBestExtractor
+
+        root_items = list()
+        if chart is not None:
+            root_items = [
+                cell_item for cell_item in chart.get_cell_items(0, chart.l) or list()
+                if isinstance(cell_item.tag, Atom) and (
+                    self.possible_root_ids is None or cell_item.tag.id in self.possible_root_ids
+                )
+            ]
+        if not root_items:
+            return ParseResult(stats=stats, chart=chart if keep_chart else None)
+
+        k_best = None
+        if n_best > 1:
+            k_best = KBestExtractor(self, chart).k_best(n_best, root_items)
+        return ParseResult(
+            derivation=root_items[0].constituent,
+            score=root_items[0].score,
+            k_best=k_best,
+            stats=stats,
+            chart=chart if keep_chart else None
+        )
+
     def decode(
         self,
         pretokenized_sent: List[str],
@@ -128,29 +960,16 @@ class Decoder:  # for testing directly, no need to train
         raise NotImplementedError('Please implement decoding algorithms!!!')
 
     @staticmethod
-    def _check_constraints(
-        left: ConstituentNode,
-        right: ConstituentNode,
-        result_used_rule: str
-    ) -> bool:
-
-        # Eisner constraints
-        if left.used_rule == 'FC' and (
-            result_used_rule == 'FA' or result_used_rule == 'FC'
-        ):
-            return False
-        elif right.used_rule == 'BX' and (
-            result_used_rule == 'BA' or result_used_rule == 'BX'
-        ):
-            return False
+    def _get_normal_form_state(rule_id: RuleId) -> RuleId:
+        # the part of the used rule that _check_constraints depends on,
+        # so that constituents of the same category and state combine in the same way
+        return _normal_form_states[rule_id]
 
-        # Julia and Bisk's Constraint 5
-        elif left.used_rule == 'FT' and result_used_rule == 'FA':
-            return False
-        elif right.used_rule == 'BT' and result_used_rule == 'BA':
-            return False
-        else:
-            return True
+    @staticmethod
+    def _get_leaf_cost(cell_item: CellItem) -> float:
+        # the negative log probability of the supertag of one leaf cell item,
+        # the scores of cell items being log probabilities
+        return -cell_item.score
 
     # token-level (span[i][i+1]) operations
     def _apply_token_ops(self, chart: Chart, tokens, i: int):
@@ -0,0 +1,261 @@
+"""
+lazy k-best extraction of derivations from a decoded chart,
+following Algorithm 3 of Huang and Chiang (2005), Better k-best Parsing
+"""
+
+from typing import Tuple, List, Dict, Set, Optional
+import sys
+import heapq
+
+from decoders.decoder import Chart, CellItem, Decoder, RuleId, get_rule_name
+
+sys.path.append('..')
+from base import Token, Category, ConstituentNode
+
+
+# a vertex of the hypergraph (i.e. packed forest) over the chart,
+# (start, end, category id, normal-form state of the rule used at the top, unary level),
+# the state being part of it as the constraints of the decoders depend on it
+# (see Decoder._get_normal_form_state), and the unary level (the number of unary rules
+# applied at the top) keeping the unary chains to those built by the decoders
+Vertex = Tuple[int, int, int, RuleId, int]
+# (cost, index of the hyperedge, ranks of the derivations of its tails),
+# the cost being the sum of negative log probabilities of the supertags
+Derivation = Tuple[float, int, Tuple[int, ...]]
+
+
+class Hyperedge:
+
+    __slots__ = ('tails', 'rule_id', 'cost', 'token')
+
+    def __init__(
+        self,
+        tails: Tuple[Vertex, ...],
+        rule_id: RuleId = 0,
+        cost: float = 0.0,
+        token: Optional[Token] = None
+    ):
+        """
+        Params:
+            tails - the vertices the head vertex is built from by one rule
+            rule_id - the id of the rule, 0 for supertags
+            cost - the cost of the hyperedge itself, only for supertags
+            token - the token of a supertag, whose hyperedge has no tails
+        """
+        self.tails = tails
+        self.rule_id = rule_id
+        self.cost = cost
+        self.token = token
+
+
+class KBestExtractor:
+
+    def __init__(self, decoder: Decoder, chart: Chart):
+        """
+        Params:
+            decoder - the decoder that built the chart
+            chart - the chart decoded by CCGBaseDecoder, CCGTensorDecoder or CCGAStarDecoder
+
+        The vertices group the cell items of each cell (including those merged by
+        Viterbi merging) by category, normal-form state and unary level,
+        and the hyperedges of a vertex are read from the backpointers of its cell items
+        only when the vertex is first visited, so the cost grows with the number of
+        derivations extracted rather than with the size of the chart.
+        As unary hyperedges come from a lower unary level in the same cell
+        and binary ones from shorter spans, the hypergraph has no cycles.
+        """
+        self.decoder = decoder
+        self.chart = chart
+        # (start, end) -> (category id, normal-form state, unary level) -> its cell items
+        self.cell_vertices: Dict[
+            Tuple[int, int], Dict[Tuple[int, RuleId, int], List[CellItem]]
+        ] = dict()
+        # start -> the id of each cell item starting at it -> its end,
+        # to find the split positions of the binary cell items
+        self.item_ends: Dict[int, Dict[int, int]] = dict()
+        self.incoming: Dict[Vertex, List[Hyperedge]] = dict()
+        self.derivations: Dict[Vertex, List[Derivation]] = dict()  # found in order
+        self.candidates: Dict[Vertex, List[Derivation]] = dict()  # heaps
+        self.seen: Dict[Vertex, Set[Tuple[int, Tuple[int, ...]]]] = dict()
+
+    def k_best(
+        self,
+        k: int,
+        cell_items: Optional[List[CellItem]] = None
+    ) -> List[Tuple[float, ConstituentNode]]:
+        """
+        Input:
+            k - the number of derivations to extract
+            cell_items - the cell items of the whole sentence whose derivations are extracted,
+                         all cell items of the whole sentence if None
+        Output:
+            at most k (cost, derivation) pairs from the lowest cost,
+            the cost being the sum of negative log probabilities of the supertags
+        """
+        l_sent = self.chart.l
+        if cell_items is None:
+            cell_items = self.chart.get_cell_items(0, l_sent) or list()
+        roots = list(
+            dict.fromkeys(
+                (0, l_sent) + self._get_vertex_key(cell_item) for cell_item in cell_items
+            )
+        )
+
+        # merge the derivations of all root vertices
+        merged = list()
+        for idx, root in enumerate(roots):
+            derivation = self._get_derivation(root, 0)
+            if derivation is not None:
+                merged.append((derivation[0], idx, 0))
+        heapq.heapify(merged)
+
+        results = list()
+        while merged and len(results) < k:
+            cost, idx, rank = heapq.heappop(merged)
+            results.append(
+                (cost, self._build_tree(roots[idx], self.derivations[roots[idx]][rank]))
+            )
+            derivation = self._get_derivation(roots[idx], rank + 1)
+            if derivation is not None:
+                heapq.heappush(merged, (derivation[0], idx, rank + 1))
+        return results
+
+    def _get_vertex_key(self, cell_item: CellItem) -> Tuple[int, RuleId, int]:
+        unary_level = 0
+        child = cell_item
+        while child.right is None and not isinstance(child.left, Token):
+            unary_level += 1
+            child = child.left
+        return (
+            cell_item.tag.id,
+            self.decoder._get_normal_form_state(cell_item.rule_id),
+            unary_level
+        )
+
+    def _get_cell_items(self, start: int, end: int) -> List[CellItem]:
+        # the cell items of one cell along with those merged into them
+        return (self.chart.get_cell_items(start, end) or list()) \
+            + (self.chart.get_merged_items(start, end) or list())
+
+    def _get_vertices(
+        self, start: int, end: int
+    ) -> Dict[Tuple[int, RuleId, int], List[CellItem]]:
+        vertices = self.cell_vertices.get((start, end))
+        if vertices is None:
+            vertices = dict()
+            for cell_item in self._get_cell_items(start, end):
+                vertices.setdefault(self._get_vertex_key(cell_item), list()).append(cell_item)
+            self.cell_vertices[(start, end)] = vertices
+        return vertices
+
+    def _get_end(self, start: int, cell_item: CellItem) -> int:
+        # the end of a cell item of the chart starting at start
+        item_ends = self.item_ends.get(start)
+        if item_ends is None:
+            item_ends = {
+                id(item): end
+                for end, _ in self.chart.cells_starting_at(start)
+                for item in self._get_cell_items(start, end)
+            }
+            self.item_ends[start] = item_ends
+        return item_ends[id(cell_item)]
+
+    def _build_incoming(self, vertex: Vertex):
+        # read the hyperedges of one vertex from the backpointers of its cell items,
+        # the cell items differing only in the derivations of their children sharing one
+        start, end = vertex[:2]
+        hyperedges = dict()
+        for cell_item in self._get_vertices(start, end).get(vertex[2:], list()):
+            if isinstance(cell_item.left, Token):
+                hyperedge = Hyperedge(
+                    tails=tuple(),
+                    cost=self.decoder._get_leaf_cost(cell_item),
+                    token=cell_item.left
+                )
+                key = (id(cell_item.left), hyperedge.cost)
+            elif cell_item.right is None:
+                hyperedge = Hyperedge(
+                    tails=((start, end) + self._get_vertex_key(cell_item.left),),
+                    rule_id=cell_item.rule_id
+                )
+                key = (hyperedge.tails, hyperedge.rule_id)
+            else:
+                mid = self._get_end(start, cell_item.left)
+                hyperedge = Hyperedge(
+                    tails=(
+                        (start, mid) + self._get_vertex_key(cell_item.left),
+                        (mid, end) + self._get_vertex_key(cell_item.right)
+                    ),
+                    rule_id=cell_item.rule_id
+                )
+                key = (hyperedge.tails, hyperedge.rule_id)
+            hyperedges.setdefault(key, hyperedge)
+        self.incoming[vertex] = list(hyperedges.values())
+
+    def _initialize(self, vertex: Vertex):
+        # the candidates of one vertex are the best derivations of all its hyperedges
+        if vertex not in self.incoming:
+            self._build_incoming(vertex)
+        candidates = list()
+        for idx, hyperedge in enumerate(self.incoming[vertex]):
+            ranks = (0,) * len(hyperedge.tails)
+            cost = self._get_cost(hyperedge, ranks)
+            if cost is not None:
+                candidates.append((cost, idx, ranks))
+        heapq.heapify(candidates)
+
+        self.candidates[vertex] = candidates
+        self.seen[vertex] = {(idx, ranks) for _, idx, ranks in candidates}
+        self.derivations[vertex] = list()
+
+    def _get_cost(self, hyperedge: Hyperedge, ranks: Tuple[int, ...]) -> Optional[float]:
+        # the cost of the derivation with the given ranks of the tails, None if not existing
+        cost = hyperedge.cost
+        for tail, rank in zip(hyperedge.tails, ranks):
+            derivation = self._get_derivation(tail, rank)
+            if derivation is None:
+                return None
+            cost += derivation[0]
+        return cost
+
+    def _get_derivation(self, vertex: Vertex, rank: int) -> Optional[Derivation]:
+        # get the derivation of the given rank (from 0) of one vertex, None if not existing
+        if vertex not in self.derivations:
+            self._initialize(vertex)
+        derivations = self.derivations[vertex]
+        candidates = self.candidates[vertex]
+        while len(derivations) <= rank:
+            if derivations:
+                self._push_successors(vertex, derivations[-1])
+            if not candidates:
+                return None
+            derivations.append(heapq.heappop(candidates))
+        return derivations[rank]
+
+    def _push_successors(self, vertex: Vertex, derivation: Derivation):
+        # the next candidates of one derivation, each with one tail ranked one lower
+        _, idx, ranks = derivation
+        hyperedge = self.incoming[vertex][idx]
+        for i in range(len(ranks)):
+            successor_ranks = ranks[:i] + (ranks[i] + 1,) + ranks[i + 1:]
+            if (idx, successor_ranks) in self.seen[vertex]:
+                continue
+            self.seen[vertex].add((idx, successor_ranks))
+            cost = self._get_cost(hyperedge, successor_ranks)
+            if cost is not None:
+                heapq.heappush(self.candidates[vertex], (cost, idx, successor_ranks))
+
+    def _build_tree(self, vertex: Vertex, derivation: Derivation) -> ConstituentNode:
+        _, idx, ranks = derivation
+        hyperedge = self.incoming[vertex][idx]
+        tag = Category.from_id(vertex[2])
+        if hyperedge.token is not None:
+            return ConstituentNode(tag=tag, children=[hyperedge.token])
+        return ConstituentNode(
+            tag=tag,
+            children=[
+                self._build_tree(tail, self.derivations[tail][rank])
+                for tail, rank in zip(hyperedge.tails, ranks)
+            ],
+            used_rule=get_rule_name(hyperedge.rule_id)
+        )
@@ -0,0 +1,340 @@
+"""
+compile the grammar used by the decoders, i.e. the lexical categories,
+the instantiated unary and binary rules and the category dictionary,
+into one versioned binary file, and load it by memory-mapping
+"""
+
+from typing import *
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.append('..')
+from base import Category, Functor
+
+
+GRAMMAR_VERSION = 2
+_MAGIC = b'CCGGRAMM'
+_ALIGNMENT = 64  # the byte alignment of each array in the file
+_SLASHES = ('/', '\\')
+
+POSSIBLE_ROOTS = 'S[dcl]|NP|S[wq]|S[q]|S[qem]|S[b]\\NP'
+
+# the bits of the reachability of one category,
+# i.e. where its spans can be in a derivation ending in one of the possible roots
+REACHABLE_INSIDE = 1  # spans touching neither end of the sentence
+REACHABLE_AT_START = 2  # spans starting at the start of the sentence only
+REACHABLE_AT_END = 4  # spans ending at the end of the sentence only
+REACHABLE_AS_WHOLE = 8  # the span of the whole sentence
+
+
+def _align(n_bytes: int) -> int:
+    return (n_bytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class _CategoryTable:
+    # the table of all categories in the grammar,
+    # each functor placed after its left and right categories
+
+    def __init__(self):
+        self.categories: List[str] = list()
+        self.structures: List[Tuple[int, int, int]] = list()  # (left, slash, right), -1 for atoms
+        self.category2idx: Dict[str, int] = dict()
+
+    def add(self, category: Category) -> int:
+        # add one category along with its sub-categories and return its index
+        category_str = str(category)
+        if category_str in self.category2idx:
+            return self.category2idx[category_str]
+        if isinstance(category, Functor):
+            structure = (
+                self.add(category.left),
+                _SLASHES.index(category.slash),
+                self.add(category.right)
+            )
+        else:
+            structure = (-1, -1, -1)
+        self.category2idx[category_str] = len(self.categories)
+        self.categories.append(category_str)
+        self.structures.append(structure)
+        return self.category2idx[category_str]
+
+
+def compute_reachability(
+    unary_rules: List[Tuple[int, int]],
+    binary_rules: List[Tuple[int, int, int]],
+    root_ids: Iterable[int]
+) -> Dict[int, int]:
+    """
+    Input:
+        unary_rules - (initial, result) pairs of category ids
+        binary_rules - (left, right, result) triples of category ids
+        root_ids - the ids of categories allowed at the root of a parse
+    Output:
+        a dictionary mapping each category id to its reachability bits,
+        categories never reaching any root are left out
+    """
+    reachability = {root_id: REACHABLE_AS_WHOLE for root_id in root_ids}
+
+    def _reach(category_id: int, bits: int) -> bool:
+        if bits & ~reachability.get(category_id, 0):
+            reachability[category_id] = reachability.get(category_id, 0) | bits
+            return True
+        return False
+
+    is_changed = True
+    while is_changed:
+        is_changed = False
+        for initial, result in unary_rules:
+            # the initial category covers the same span as the result
+            is_changed |= _reach(initial, reachability.get(result, 0))
+        for left, right, result in binary_rules:
+            bits = reachability.get(result, 0)
+            if not bits:
+                continue
+            # the left category never ends at the end of the sentence and vice versa
+            left_bits = 0
+            right_bits = 0
+            if bits & (REACHABLE_INSIDE | REACHABLE_AT_END):
+                left_bits |= REACHABLE_INSIDE
+            if bits & (REACHABLE_AT_START | REACHABLE_AS_WHOLE):
+                left_bits |= REACHABLE_AT_START
+            if bits & (REACHABLE_AT_START | REACHABLE_INSIDE):
+                right_bits |= REACHABLE_INSIDE
+            if bits & (REACHABLE_AT_END | REACHABLE_AS_WHOLE):
+                right_bits |= REACHABLE_AT_END
+            is_changed |= _reach(left, left_bits)
+            is_changed |= _reach(right, right_bits)
+    return reachability
+
+
+def compile_grammar(
+    lexical_category2idx_dir: str,
+    instantiated_unary_rules_dir: str,
+    instantiated_binary_rules_dir: str,
+    cat_dict_dir: str,
+    saving_dir: str,
+    possible_roots: str = POSSIBLE_ROOTS
+) -> None:
+    """
+    Input:
+        lexical_category2idx_dir - the .json file mapping each lexical category to its index
+        instantiated_unary_rules_dir - the .json file of instantiated unary rules
+        instantiated_binary_rules_dir - the .json file of instantiated binary rules
+        cat_dict_dir - the .json file mapping each word to its allowed categories
+        saving_dir - the path to save the compiled grammar
+        possible_roots - allowable categories at the root of each parse separated by '|',
+                         for which the reachability of all categories is precomputed
+    """
+    with open(lexical_category2idx_dir, 'r', encoding='utf8') as f:
+        category2idx = json.load(f)
+    with open(instantiated_unary_rules_dir, 'r', encoding='utf8') as f:
+        instantiated_unary_rules = json.load(f)
+    with open(instantiated_binary_rules_dir, 'r', encoding='utf8') as f:
+        instantiated_binary_rules = json.load(f)
+    with open(cat_dict_dir, 'r', encoding='utf8') as f:
+        cat_dict = json.load(f)
+
+    lexical_categories = [None] * len(category2idx)
+    for category, idx in category2idx.items():
+        lexical_categories[idx] = category
+    if None in lexical_categories:
+        raise RuntimeError('Please check the indices of lexical categories!!!')
+
+    category_table = _CategoryTable()
+    for category in lexical_categories:
+        category_table.add(Category.intern(category))
+    rule_names = list()
+
+    def _rule_idx(rule_name: str) -> int:
+        if rule_name not in rule_names:
+            rule_names.append(rule_name)
+        return rule_names.index(rule_name)
+
+    unary_rules = np.array(
+        [
+            [
+                category_table.add(Category.intern(initial_cat)),
+                category_table.add(Category.intern(result_cat)),
+                _rule_idx(rule_name)
+            ]
+            for initial_cat, result_cat, rule_name in instantiated_unary_rules
+        ],
+        dtype='<i4'
+    ).reshape(-1, 3)
+
+    binary_rules = np.array(
+        [
+            [
+                category_table.add(Category.intern(left_cat)),
+                category_table.add(Category.intern(right_cat)),
+                category_table.add(Category.intern(result[0])),
+                _rule_idx(result[1])
+            ]
+            for left_cat, right_cat, results in instantiated_binary_rules
+            for result in results
+        ],
+        dtype='<i4'
+    ).reshape(-1, 4)
+
+    # the category filter of each word, 1 for categories not allowed for this word
+    words = list(cat_dict.keys())
+    category_filter = np.ones((len(words), len(lexical_categories)), dtype=np.uint8)
+    for i, word in enumerate(words):
+        category_filter[i, [category2idx[cat] for cat in cat_dict[word]]] = 0
+
+    category_structures = np.array(
+        category_table.structures, dtype='<i4'
+    ).reshape(-1, 3)
+
+    # the reachability of each category, computed over the key ids rule tables are indexed by
+    key_ids = [Category.intern(category).key_id for category in category_table.categories]
+    reachability_by_key_id = compute_reachability(
+        unary_rules=[(key_ids[initial], key_ids[result]) for initial, result, _ in unary_rules.tolist()],
+        binary_rules=[
+            (key_ids[left], key_ids[right], key_ids[result])
+            for left, right, result, _ in binary_rules.tolist()
+        ],
+        root_ids=[Category.intern(root).key_id for root in possible_roots.split('|')]
+    )
+    reachability = np.array(
+        [reachability_by_key_id.get(key_id, 0) for key_id in key_ids], dtype=np.uint8
+    )
+
+    arrays = {
+        'category_structures': category_structures,
+        'unary_rules': unary_rules,
+        'binary_rules': binary_rules,
+        'category_filter': category_filter,
+        'reachability': reachability
+    }
+    header = {
+        'version': GRAMMAR_VERSION,
+        'categories': category_table.categories,
+        'lexical_categories': lexical_categories,
+        'rule_names': rule_names,
+        'words': words,
+        'possible_roots': possible_roots,
+        'arrays': dict()
+    }
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [array.dtype.str, list(array.shape), offset]
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf8')
+    data_start = _align(len(_MAGIC) + 8 + len(header_bytes))
+    with open(saving_dir, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+
+    print(
+        f'{len(category_table.categories)} categories, '
+        f'{len(unary_rules)} unary rules, {len(binary_rules)} binary rules '
+        f'and {len(words)} words saved to {saving_dir}'
+    )
+
+
+class Grammar:
+
+    def __init__(self, grammar_dir: str):
+        """
+        Params:
+            grammar_dir - the path to the grammar compiled by compile_grammar,
+                          whose arrays are memory-mapped,
+                          so that all processes loading it share one copy
+        """
+        with open(grammar_dir, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise RuntimeError('Please check the grammar file!!!')
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length).decode('utf8'))
+        if header['version'] != GRAMMAR_VERSION:
+            raise RuntimeError('Please recompile the grammar with grammar.py!!!')
+
+        self.categories: List[str] = header['categories']
+        self.lexical_categories: List[str] = header['lexical_categories']
+        self.rule_names: List[str] = header['rule_names']
+        self.words: List[str] = header['words']
+        self.possible_roots: str = header['possible_roots']
+
+        data_start = _align(len(_MAGIC) + 8 + header_length)
+        # a plain array over the memory map, whose slices are cheap views,
+        # mapped copy-on-write as torch does not index with read-only arrays,
+        # the pages are still shared since they are never written
+        buffer = np.memmap(grammar_dir, dtype=np.uint8, mode='c').view(np.ndarray)
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            n_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            array = buffer[data_start + offset: data_start + offset + n_bytes]
+            setattr(self, name, array.view(dtype).reshape(shape))
+
+        self.interned_categories = self._intern_categories()
+
+    @property
+    def idx2tag(self) -> Dict[int, str]:
+        return dict(enumerate(self.lexical_categories))
+
+    def _intern_categories(self) -> List[Category]:
+        # return the canonical categories of the category table,
+        # functors are built from their left and right categories without parsing
+        categories = list()
+        for category_str, (left, slash, right) in zip(
+            self.categories, self.category_structures.tolist()
+        ):
+            if left < 0:
+                categories.append(Category.intern(category_str))
+            else:
+                categories.append(
+                    Category.make_functor(categories[left], _SLASHES[slash], categories[right])
+                )
+        return categories
+
+    def get_category_filters(self) -> Dict[str, np.ndarray]:
+        # map each word to its category filter (a row of the memory-mapped matrix)
+        return {
+            word: self.category_filter[i].view(np.bool_)
+            for i, word in enumerate(self.words)
+        }
+
+    def get_reachability(self) -> Dict[int, int]:
+        # map the key id of each category reaching one of the possible roots to its reachability bits
+        return {
+            category.key_id: bits
+            for category, bits in zip(self.interned_categories, self.reachability.tolist())
+            if bits
+        }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='compile the grammar for decoding')
+
+    parser.add_argument('--lexical_category2idx_dir', type=str,
+                        default='../data/lexical_category2idx_cutoff.json')
+    parser.add_argument('--instantiated_unary_rules_dir', type=str,
+                        default='../data/instantiated_unary_rules_with_X.json')
+    parser.add_argument('--instantiated_binary_rules_dir', type=str,
+                        default='../data/instantiated_seen_binary_rules.json')
+    parser.add_argument('--cat_dict_dir', type=str,
+                        default='../data/cat_dict.json')
+    parser.add_argument('--saving_dir', type=str,
+                        default='../data/grammar.bin')
+    parser.add_argument('--possible_roots', help='possible categories at the roots of parses',
+                        type=str, default=POSSIBLE_ROOTS)
+
+    args = parser.parse_args()
+
+    compile_grammar(
+        lexical_category2idx_dir=args.lexical_category2idx_dir,
+        instantiated_unary_rules_dir=args.instantiated_unary_rules_dir,
+        instantiated_binary_rules_dir=args.instantiated_binary_rules_dir,
+        cat_dict_dir=args.cat_dict_dir,
+        saving_dir=args.saving_dir,
+        possible_roots=args.possible_roots
+    )
@@ -8,9 +8,11 @@ import torch
 import torch.nn as nn
 
 from ccg_parsing_models import BaseParsingModel, LSTMParsingModel
-from decoders.decoder import Chart, Decoder
+from decoders.decoder import Chart, Decoder, ParseResult
 from decoders.ccg_base_decoder import CCGBaseDecoder
 from decoders.ccg_a_star_decoder import CCGAStarDecoder
+from decoders.ccg_tensor_decoder import CCGTensorDecoder
+from grammar import Grammar
 
 sys.path.append('..')
 from ccg_supertagger.utils import pre_tokenize_sent
@@ -31,36 +33,54 @@ class Parser:
 
     def batch_parse(
         self,
-        pretokenized_sents: List[List[str]]
-    ) -> List[Chart]:
+        pretokenized_sents: List[List[str]],
+        n_best: int = 1,
+        keep_charts: bool = False
+    ) -> List[ParseResult]:
+        """
+        Input:
+            pretokenized_sents - a list of pretokenized sentences, each of which is a list of strings
+            n_best - the number of derivations extracted for each sentence
+            keep_charts - whether to keep the decoded charts in the results, only for debugging
+        Output:
+            the parse results of the sentences (see decoders.decoder.ParseResult)
+        """
 
         batch_representations = self.parsing_model(pretokenized_sents)
-        charts = self.decoder.batch_decode(
-            pretokenized_sents, batch_representations
+        results = self.decoder.batch_parse(
+            pretokenized_sents, batch_representations, n_best=n_best, keep_charts=keep_charts
         )
         
-        return charts
+        return results
 
-    def parse(self, pretokenized_sent: List[str]) -> Chart:
-        return self.batch_parse([pretokenized_sent])[0]
+    def parse(
+        self,
+        pretokenized_sent: List[str],
+        n_best: int = 1,
+        keep_chart: bool = False
+    ) -> ParseResult:
+        return self.batch_parse([pretokenized_sent], n_best, keep_chart)[0]
 
     def batch_sanity_check(
         self,
         pretokenized_sents: List[List[str]],
         golden_supertags: List[List[str]],
-        print_cell_items: bool = False
-    ) -> List[Chart]:
+        print_cell_items: bool = False,
+        n_best: int = 1,
+        keep_charts: bool = False
+    ) -> List[ParseResult]:
         
-        charts = list()
+        results = list()
         for i in range(len(pretokenized_sents)):
-            charts.append(
-                self.decoder.sanity_check(
-                    pretokenized_sents[i],
-                    golden_supertags[i],
-                    print_cell_items
-                )
+            chart = self.decoder.sanity_check(
+                pretokenized_sents[i],
+                golden_supertags[i],
+                print_cell_items
             )
-        return charts
+            results.append(
+                self.decoder.get_parse_result(chart, n_best=n_best, keep_chart=keep_charts)
+            )
+        return results
 
     def sanity_check(
         self,
@@ -68,11 +88,11 @@ class Parser:
         golden_supertags: List[str],
         print_cell_items: bool = False
     ) -> Chart:
-        return self.batch_sanity_check(
-            [pretokenized_sent],
-            [golden_supertags],
+        return self.decoder.sanity_check(
+            pretokenized_sent,
+            golden_supertags,
             print_cell_items
-        )[0]
+        )
 
 
 def get_batch_data(data_items: List[DataItem]) -> Dict[str, Any]:
@@ -106,8 +126,8 @@ def run(
     parser: Parser,
     saving_dir: str,
     batch_size: int = 10,
-    possible_roots: str = 'S[dcl]|NP|S[wq]|S[q]|S[qem]|S[b]\\NP',
-    mode: str = 'predict_batch'
+    mode: str = 'predict_batch',
+    n_best: int = 1
 ) -> None:
     """
     Input:
@@ -116,32 +136,38 @@ def run(
         parser - the parser
         saving_dir - the directory to save the predicted .auto file
         batch_size - the batch size set for supertagging
-        possible_roots - a list of allowable categories at the root of each parse
         mode - the mode specified for batch parsing,
                choices in ['batch_sanity_check', 'predict_batch']
+        n_best - the number of derivations extracted for each sentence,
+                 saved along with their costs next to the .auto file if greater than 1
     """
     pretokenized_sents = batch_data['pretokenized_sents']
     golden_supertags = batch_data['golden_supertags']
     data_ids = batch_data['data_ids']
-    possible_roots = possible_roots.split('|')
 
     accumulated_time = 0
     n_null_parses = 0
     buffer = []
+    n_best_buffer = []
+    decoding_stats = []  # the statistics of each sentence (if collected by the decoder)
     for i in range(0, len(pretokenized_sents), batch_size):
         print(f'======== {i} / {len(pretokenized_sents)} ========')
 
         t0 = time.time()
 
+        # only the derivations of each sentence are kept (see decoders.decoder.ParseResult),
+        # with the possible root categories given to the decoder
         if mode == 'predict_batch':
-            charts = parser.batch_parse(
-                pretokenized_sents[i: i + batch_size]
+            results = parser.batch_parse(
+                pretokenized_sents[i: i + batch_size],
+                n_best = n_best
             )
         elif mode == 'batch_sanity_check':
-            charts = parser.batch_sanity_check(
+            results = parser.batch_sanity_check(
                 pretokenized_sents[i: i + batch_size],
                 golden_supertags[i: i + batch_size],
-                print_cell_items = False
+                print_cell_items = False,
+                n_best = n_best
             )
         else:
             raise RuntimeError('Please check the batch running mode!!!')
@@ -149,33 +175,26 @@ def run(
         time_cost = time.time() - t0
         print(f'time cost for this batch: {time_cost}s')
         accumulated_time += time_cost
+        decoding_stats.extend(result.stats for result in results if result.stats is not None)
 
         tmp_data_ids = data_ids[i: i + batch_size]
-        for j in range(len(charts)):
+        for j in range(len(results)):
 
             buffer.append(tmp_data_ids[j] + '\n')
 
-            cell_item = None
-            if charts[j] is None:
-                cell_item = None
-            elif charts[j].chart[0][-1].cell_items is None:
-                cell_item = None
-            elif len(charts[j].chart[0][-1].cell_items) == 0:
-                cell_item = None
-            else:
-                for item in charts[j].chart[0][-1].cell_items:
-                    if isinstance(item.constituent.tag, Atom):
-                        if str(item.constituent.tag) in possible_roots:
-                            print(str(item.constituent))
-                            cell_item = item
-                            break
-
-            if cell_item:
-                buffer.append(to_auto(cell_item.constituent) + '\n')
+            derivation = results[j].derivation
+            if derivation is not None:
+                print(str(derivation))
+                buffer.append(to_auto(derivation) + '\n')
             else:
                 buffer.append('(<L S None None None S>)\n')
                 n_null_parses += 1
 
+            if n_best > 1:
+                n_best_buffer.append(tmp_data_ids[j] + '\n')
+                for cost, constituent in results[j].k_best:
+                    n_best_buffer.append(f'{cost}\t{to_auto(constituent)}\n')
+
     print(
         f'averaged parsing time of each sentence: {accumulated_time / len(pretokenized_sents)}'
     )
@@ -184,17 +203,36 @@ def run(
         f'null parses: {n_null_parses} / {len(pretokenized_sents)} = {n_null_parses / len(pretokenized_sents): .2f}'
     )
 
+    if decoding_stats:
+        for name in [name for name in decoding_stats[0] if name != 'stop_reason']:
+            print(f'{name}: max {max(stats[name] for stats in decoding_stats)}')
+        stop_reasons = dict()
+        for stats in decoding_stats:
+            stop_reasons[stats['stop_reason']] = stop_reasons.get(stats['stop_reason'], 0) + 1
+        print(f'stop reasons: {stop_reasons}')
+
     with open(saving_dir, 'w', encoding='utf8') as f:
         f.writelines(buffer)
 
+    if n_best > 1:
+        with open(os.path.splitext(saving_dir)[0] + f'_{n_best}best.txt', 'w', encoding='utf8') as f:
+            f.writelines(n_best_buffer)
+
 
 def apply_parser(args):
 
-    with open(args.lexical_category2idx_dir, 'r', encoding = 'utf8') as f:
-        category2idx = json.load(f)
-    idx2category = {idx: cat for cat, idx in category2idx.items()}
-    with open(args.cat_dict_dir, 'r', encoding = 'utf8') as f:
-        cat_dict = json.load(f)
+    if args.grammar_dir is not None:
+        # the compiled grammar replaces all the .json files below
+        grammar = Grammar(args.grammar_dir)
+        idx2category = grammar.idx2tag
+        cat_dict = None
+    else:
+        grammar = None
+        with open(args.lexical_category2idx_dir, 'r', encoding = 'utf8') as f:
+            category2idx = json.load(f)
+        idx2category = {idx: cat for cat, idx in category2idx.items()}
+        with open(args.cat_dict_dir, 'r', encoding = 'utf8') as f:
+            cat_dict = json.load(f)
 
     if args.decoder == 'base':
         print(
@@ -208,9 +246,41 @@ def apply_parser(args):
             apply_supertagging_pruning=args.apply_supertagging_pruning,
             beta=args.beta,
             timeout=args.decoder_timeout,
-            apply_cat_filtering=args.apply_cat_filtering
+            apply_cat_filtering=args.apply_cat_filtering,
+            apply_binary_rule_fallback=args.apply_binary_rule_fallback,
+            binary_rule_cache_size=args.binary_rule_cache_size,
+            binary_rule_cache_dir=args.binary_rule_cache_dir,
+            possible_roots=args.possible_roots.split('|'),
+            apply_reachability_pruning=args.apply_reachability_pruning,
+            max_combinations=args.max_combinations,
+            apply_viterbi_merging=args.apply_viterbi_merging,
+            apply_cube_pruning=args.apply_cube_pruning
+        )
+    elif args.decoder == 'tensor':
+        print(
+            f'======== decoder{args.decoder}_beamwidth{args.beam_width}_topk{args.top_k_supertags}_beta{args.beta}_timeout{args.decoder_timeout} ========'
+        )
+        decoder = CCGTensorDecoder(
+            beam_width=args.beam_width,
+            idx2tag=idx2category,
+            cat_dict=cat_dict,
+            top_k=args.top_k_supertags,
+            apply_supertagging_pruning=args.apply_supertagging_pruning,
+            beta=args.beta,
+            timeout=args.decoder_timeout,
+            apply_cat_filtering=args.apply_cat_filtering,
+            possible_roots=args.possible_roots.split('|'),
+            apply_reachability_pruning=args.apply_reachability_pruning,
+            max_combinations=args.max_combinations,
+            apply_viterbi_merging=args.apply_viterbi_merging
         )
     elif args.decoder == 'a_star':
+        supertagging_levels = None
+        if args.supertagging_levels is not None:
+            supertagging_levels = [
+                (float(level.split(',')[0]), int(level.split(',')[1]))
+                for level in args.supertagging_levels.split('|')
+            ]
         print(
             f'======== decoder{args.decoder}_topk{args.top_k_supertags}_beta{args.beta}_timeout{args.decoder_timeout} ========'
         )
@@ -221,17 +291,31 @@ def apply_parser(args):
             apply_supertagging_pruning=args.apply_supertagging_pruning,
             beta=args.beta,
             timeout=args.decoder_timeout,
-            apply_cat_filtering=args.apply_cat_filtering
+            apply_cat_filtering=args.apply_cat_filtering,
+            apply_binary_rule_fallback=args.apply_binary_rule_fallback,
+            binary_rule_cache_size=args.binary_rule_cache_size,
+            binary_rule_cache_dir=args.binary_rule_cache_dir,
+            possible_roots=args.possible_roots.split('|'),
+            apply_reachability_pruning=args.apply_reachability_pruning,
+            max_agenda_size=args.max_agenda_size,
+            max_cell_items=args.max_cell_items,
+            max_chart_items=args.max_chart_items,
+            max_pops=args.max_pops,
+            max_combinations=args.max_combinations,
+            supertagging_levels=supertagging_levels
         )
     else:
         raise RuntimeError('Please check the setting of the decoder!!!')
     
-    with open(args.instantiated_unary_rules_dir, 'r', encoding = 'utf8') as f:
-        instantiated_unary_rules = json.load(f)
-    with open(args.instantiated_binary_rules_dir, 'r', encoding = 'utf8') as f:
-        instantiated_binary_rules = json.load(f)
-    decoder._get_instantiated_unary_rules(instantiated_unary_rules)
-    decoder._get_instantiated_binary_rules(instantiated_binary_rules)
+    if grammar is not None:
+        decoder._load_grammar(grammar)
+    else:
+        with open(args.instantiated_unary_rules_dir, 'r', encoding = 'utf8') as f:
+            instantiated_unary_rules = json.load(f)
+        with open(args.instantiated_binary_rules_dir, 'r', encoding = 'utf8') as f:
+            instantiated_binary_rules = json.load(f)
+        decoder._get_instantiated_unary_rules(instantiated_unary_rules)
+        decoder._get_instantiated_binary_rules(instantiated_binary_rules)
 
     if args.supertagging_model_name == 'fc':
         parsing_model = BaseParsingModel(
@@ -272,11 +356,20 @@ def apply_parser(args):
     elif args.mode == 'predict_sent':
         data_items, _ = load_auto_file(args.sample_data_dir)
         pretokenized_sent = [token.contents for token in data_items[0].tokens]
-        chart = parser.parse(pretokenized_sent)
+        result = parser.parse(pretokenized_sent, n_best=args.n_best, keep_chart=args.keep_charts)
 
-        # print out all successful parses
-        for cell_item in chart.chart[0][-1].cell_items:
-            print(to_auto(cell_item.constituent))
+        # print out all successful parses, i.e. the n best derivations along with their costs,
+        # or only the best one if no more are asked for
+        if result.k_best:
+            for cost, constituent in result.k_best:
+                print(cost, to_auto(constituent))
+        elif result.derivation is not None:
+            print(to_auto(result.derivation))
+
+        if result.chart is not None:
+            # print out all cell items of the whole sentence, only for debugging
+            for cell_item in result.chart.get_cell_items(0, result.chart.l) or list():
+                print(cell_item.score, to_auto(cell_item.constituent))
 
     elif args.mode == 'batch_sanity_check':
         data_items, _ = load_auto_file(args.dev_data_dir)
@@ -292,8 +385,8 @@ def apply_parser(args):
             parser=parser,
             saving_dir=saving_dir,
             batch_size=args.batch_size,
-            possible_roots=args.possible_roots,
-            mode=args.mode
+            mode=args.mode,
+            n_best=args.n_best
         )
 
     elif args.mode == 'predict_batch':
@@ -310,13 +403,15 @@ def apply_parser(args):
             parser=parser,
             saving_dir=saving_dir,
             batch_size=args.batch_size,
-            possible_roots=args.possible_roots,
-            mode=args.mode
+            mode=args.mode,
+            n_best=args.n_best
         )
     
     else:
         raise RuntimeError('Please check the mode of the parser!!!')
 
+    decoder.save_binary_rule_cache()
+
 
 if __name__ == '__main__':
 
@@ -337,6 +432,8 @@ if __name__ == '__main__':
                         default='../data/instantiated_seen_binary_rules.json')
     parser.add_argument('--cat_dict_dir', type=str,
                         default='../data/cat_dict.json')
+    parser.add_argument('--grammar_dir', help='the grammar compiled by grammar.py, used instead of the .json files above',
+                        type=str, default=None)
                         
     parser.add_argument('--supertagging_model_path', type=str,
                         default='../plms/bert-base-uncased')
@@ -350,7 +447,7 @@ if __name__ == '__main__':
     parser.add_argument('--embed_dim', type=int, default=768)
     parser.add_argument('--num_lstm_layers', type=int, default=1)
     parser.add_argument('--decoder', type=str, default='a_star',
-                        choices=['base', 'a_star'])
+                        choices=['base', 'tensor', 'a_star'])
     parser.add_argument('--apply_cat_filtering', default=True,
                         action=argparse.BooleanOptionalAction)
     parser.add_argument('--apply_supertagging_pruning', default=True,
@@ -358,11 +455,41 @@ if __name__ == '__main__':
     parser.add_argument('--beta', type=float, default=0.0005)
     parser.add_argument('--top_k_supertags', type=int, default=10)
     parser.add_argument('--beam_width', type=int, default=4)
+    parser.add_argument('--apply_viterbi_merging', help='keep only the best cell item of each category and normal-form state in each cell of the base decoder',
+                        default=False, action=argparse.BooleanOptionalAction)
+    parser.add_argument('--apply_cube_pruning', help='try the cell item pairs of each span in the base decoder from the highest score until the beam is full',
+                        default=False, action=argparse.BooleanOptionalAction)
     parser.add_argument('--batch_size', type=int, default=10)
     parser.add_argument('--decoder_timeout', help='time out value for decoding one sentence',
                         type=float, default=16.0)
     parser.add_argument('--possible_roots', help='possible categories at the roots of parses',
                         type=str, default='S[dcl]|NP|S[wq]|S[q]|S[qem]|S[b]\\NP')
+    parser.add_argument('--apply_reachability_pruning', help='discard cell items which can never reach the possible roots',
+                        default=False, action=argparse.BooleanOptionalAction)
+    parser.add_argument('--max_agenda_size', help='number of cell items the A* agenda of each sentence is trimmed back to (keeping the best ones) '
+                        'once it grows to twice that size',
+                        type=int, default=None)
+    parser.add_argument('--max_cell_items', help='maximum number of cell items in each A* chart cell except for the whole-sentence span, '
+                        'small values (e.g. 1 or 2) changing or losing parses',
+                        type=int, default=None)
+    parser.add_argument('--max_chart_items', help='maximum number of cell items in the A* chart for each sentence',
+                        type=int, default=None)
+    parser.add_argument('--max_pops', help='maximum number of cell items popped from the A* agenda for each sentence',
+                        type=int, default=None)
+    parser.add_argument('--max_combinations', help='maximum number of cell item pairs tried with binary rules for each sentence',
+                        type=int, default=None)
+    parser.add_argument('--supertagging_levels', help='beta,top_k pairs for adaptive supertagging in A* decoding, e.g. 0.075,3|0.01,5|0.0005,10, '
+                        'overriding --beta, --top_k_supertags and --apply_supertagging_pruning when set',
+                        type=str, default=None)
+    parser.add_argument('--apply_binary_rule_fallback', help='apply binary rules on the fly to unseen category pairs',
+                        default=False, action=argparse.BooleanOptionalAction)
+    parser.add_argument('--binary_rule_cache_size', type=int, default=65536)
+    parser.add_argument('--binary_rule_cache_dir', help='the file persisting the results of unseen category pairs',
+                        type=str, default=None)
+    parser.add_argument('--n_best', help='number of derivations extracted lazily from the chart of each sentence',
+                        type=int, default=1)
+    parser.add_argument('--keep_charts', help='whether to keep the whole chart of each sentence, only for debugging',
+                        default=False, action=argparse.BooleanOptionalAction)
     parser.add_argument('--device', type=str, default='cuda')
 
     parser.add_argument('--mode', type=str, default='sanity_check',